@@ -1,19 +1,51 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import google.generativeai as genai
 import json
+import hashlib
+import socket
 import time
 from datetime import datetime
 import os
 from uuid import uuid4
 from threading import Lock
-from typing import Any, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
 from copy import deepcopy
+from contextlib import contextmanager
+from functools import wraps
 from dotenv import load_dotenv
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows dev machines
+    fcntl = None
+
+from dashboard import (
+    AGGREGATE_FORMAT, HISTORY_KEEP, DashboardRules, apply_record, build_aggregate, record_domain_scores, summarize
+)
+from idempotency import FileIdempotencyStore
+from jobs import ACTIVE_STATUSES, JobRunner, JobStore
+from llm_cache import ResponseCache, SemanticCache, make_cache_key
+from llm_providers import CancellationToken, GenerationCancelled, create_provider
+from llm_resilience import CircuitOpenError, LLMTimeoutError, ResilientLLM, is_retryable
+from llm_routing import PolicyFile
+from metrics import Metrics
+from onboarding_index import OnboardingIndex
+from quantiles import SketchStore
+from quotas import QuotaEnforcer
+from rate_limit import RateLimiter
+from results_index import ResultsIndex, timestamp_key
+from scoring import ScoringPlanFile
+from text_index import PerUserIndex
+from usage import UsageLedger, with_averages
+
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=[
+    'RateLimit-Limit', 'RateLimit-Remaining', 'RateLimit-Reset', 'Retry-After', 'Idempotent-Replayed',
+    'Quota-Limit', 'Quota-Remaining', 'Quota-Reset', 'Quota-Warning'
+])
 
 BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
 for env_name in (".env", "local.env"):
@@ -24,11 +56,57 @@ for env_name in (".env", "local.env"):
 # Fallback to repository root .env if not already loaded.
 load_dotenv(os.path.join(BACKEND_DIR, "..", ".env"))
 
-# Configure Gemini API
-GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
-if not GEMINI_API_KEY:
-    raise RuntimeError('GEMINI_API_KEY environment variable is not set.')
-genai.configure(api_key=GEMINI_API_KEY)
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+metrics = Metrics()
+
+# Configure the model provider (LLM_PROVIDER=gemini by default, "fake" for
+# offline load tests and CI) behind timeouts, retries, optional hedging and a
+# circuit breaker; see env.example for the settings.
+llm = ResilientLLM(
+    create_provider(fake_content_seeded=_env_flag('FAKE_LLM_CONTENT_SEEDED')),
+    metrics,
+    attempt_timeout=float(os.environ.get('LLM_ATTEMPT_TIMEOUT_SECONDS', 30)),
+    max_attempts=int(os.environ.get('LLM_MAX_ATTEMPTS', 3)),
+    backoff_base=float(os.environ.get('LLM_BACKOFF_BASE_SECONDS', 0.5)),
+    backoff_max=float(os.environ.get('LLM_BACKOFF_MAX_SECONDS', 8)),
+    hedge_enabled=_env_flag('LLM_HEDGE_ENABLED'),
+    hedge_percentile=float(os.environ.get('LLM_HEDGE_PERCENTILE', 95)),
+    hedge_min_samples=int(os.environ.get('LLM_HEDGE_MIN_SAMPLES', 20)),
+    breaker_failure_threshold=int(os.environ.get('LLM_BREAKER_FAILURE_THRESHOLD', 5)),
+    breaker_reset_timeout=float(os.environ.get('LLM_BREAKER_RESET_SECONDS', 30)),
+    max_concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', 16))
+)
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Hard deadlines for a whole generation (context summary, retries included).
+# Synchronous requests should finish before the proxy gives up on them.
+LLM_REQUEST_DEADLINE_SECONDS = float(os.environ.get('LLM_REQUEST_DEADLINE_SECONDS', 55))
+JOB_DEADLINE_SECONDS = float(os.environ.get('JOB_DEADLINE_SECONDS', 300))
+# Async jobs nobody has polled for this long are cancelled (0 disables).
+JOB_ABANDON_SECONDS = float(os.environ.get('JOB_ABANDON_SECONDS', 60))
+
+# Idempotency-Key handling for generation endpoints
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 600))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 120))
+
+# Opt-in token-bucket limits for generation endpoints (0 disables a bucket)
+rate_limiter = RateLimiter(
+    user_rps=float(os.environ.get('RATE_LIMIT_USER_RPS', 1)),
+    user_burst=float(os.environ.get('RATE_LIMIT_USER_BURST', 5)),
+    user_tokens_per_minute=float(os.environ.get('RATE_LIMIT_USER_TOKENS_PER_MIN', 60000)),
+    global_rps=float(os.environ.get('RATE_LIMIT_GLOBAL_RPS', 20)),
+    global_burst=float(os.environ.get('RATE_LIMIT_GLOBAL_BURST', 40)),
+    global_tokens_per_minute=float(os.environ.get('RATE_LIMIT_GLOBAL_TOKENS_PER_MIN', 1000000)),
+    state_path=os.environ.get('RATE_LIMIT_STATE_PATH') or None
+) if _env_flag('RATE_LIMIT_ENABLED') else None
+
 SYSTEM_INSTRUCTION = (
     "You are an AI Agent developed to help you complete tasks and help you analyze how your AI Skills. "
     "Provide concise, actionable guidance. Use Markdown formatting with short paragraphs and bullet points. "
@@ -40,9 +118,73 @@ GENERATION_CONFIG = {
     "top_p": 0.9
 }
 
-MAX_HISTORY_MESSAGES = 20
+# Per-request model routing by prompt size, task category, send/improve and
+# observed latency (see routing_policy.example.json). Without a policy file
+# every request uses the provider's default model and GENERATION_CONFIG.
+routing_policy = PolicyFile(os.environ.get('LLM_ROUTING_POLICY_PATH') or None, llm.default_model, GENERATION_CONFIG)
+
+# Prompt budget for conversation history. The most recent turns that fit in
+# CONTEXT_TOKEN_BUDGET are sent verbatim; older turns are folded into a running
+# summary capped at CONTEXT_SUMMARY_TOKENS. When folding is needed the window is
+# shrunk to CONTEXT_FOLD_RATIO of the budget so the summary is not refreshed on
+# every turn.
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 4000))
+CONTEXT_SUMMARY_TOKENS = int(os.environ.get('CONTEXT_SUMMARY_TOKENS', 300))
+CONTEXT_FOLD_RATIO = float(os.environ.get('CONTEXT_FOLD_RATIO', 0.5))
+MESSAGE_TOKEN_OVERHEAD = 4
+SUMMARY_GENERATION_CONFIG = {
+    "temperature": 0.2,
+    "top_p": 0.9
+}
 
-model = genai.GenerativeModel('gemini-2.5-flash')
+# Improve requests send only the question, the target reply and the feedback
+# ("narrow"), plus IMPROVE_CONTEXT_WINDOW earlier messages; "full" sends the
+# regular conversation context. A request may override with "context_mode".
+IMPROVE_CONTEXT_MODES = ('narrow', 'full')
+IMPROVE_CONTEXT_MODE = (os.environ.get('IMPROVE_CONTEXT_MODE') or 'narrow').strip().lower()
+if IMPROVE_CONTEXT_MODE not in IMPROVE_CONTEXT_MODES:
+    IMPROVE_CONTEXT_MODE = 'narrow'
+IMPROVE_CONTEXT_WINDOW = int(os.environ.get('IMPROVE_CONTEXT_WINDOW', 0))
+# /api/improve-messages: "structured" asks for every revision in one JSON
+# reply (falling back to separate calls if it cannot be parsed); "concurrent"
+# always makes one call per message.
+IMPROVE_BATCH_MAX_ITEMS = int(os.environ.get('IMPROVE_BATCH_MAX_ITEMS', 10))
+IMPROVE_BATCH_MODE = (os.environ.get('IMPROVE_BATCH_MODE') or 'structured').strip().lower()
+IMPROVE_BATCH_CONCURRENCY = int(os.environ.get('IMPROVE_BATCH_CONCURRENCY', 4))
+
+
+# Opt-in cross-task memory: snippets from the user's other tasks that match the
+# latest message are retrieved from a local hashed TF-IDF index and added to
+# the prompt, up to MEMORY_TOP_K snippets and MEMORY_TOKEN_BUDGET tokens.
+MEMORY_ENABLED = _env_flag('MEMORY_ENABLED')
+MEMORY_TOP_K = int(os.environ.get('MEMORY_TOP_K', 3))
+MEMORY_TOKEN_BUDGET = int(os.environ.get('MEMORY_TOKEN_BUDGET', 300))
+MEMORY_SNIPPET_TOKENS = int(os.environ.get('MEMORY_SNIPPET_TOKENS', 120))
+MEMORY_MIN_SCORE = float(os.environ.get('MEMORY_MIN_SCORE', 0.1))
+user_memory = PerUserIndex(
+    dim=int(os.environ.get('MEMORY_INDEX_DIM', 2048)),
+    max_docs_per_user=int(os.environ.get('MEMORY_MAX_SNIPPETS', 2000)),
+    max_users=int(os.environ.get('MEMORY_MAX_USERS', 256))
+) if MEMORY_ENABLED else None
+
+
+# Opt-in exact-match cache for model replies (see env.example for settings)
+LLM_CACHE_ENABLED = _env_flag('LLM_CACHE_ENABLED')
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 256)),
+    ttl_seconds=float(os.environ.get('LLM_CACHE_TTL_SECONDS', 600)),
+    disk_dir=os.environ.get('LLM_CACHE_DIR') or None
+) if LLM_CACHE_ENABLED else None
+
+# Opt-in reuse of answers to near-duplicate first-turn questions. Scope is
+# "user" (a user's own earlier questions), "global" (everyone's) or "both".
+LLM_SEMANTIC_CACHE_ENABLED = _env_flag('LLM_SEMANTIC_CACHE_ENABLED')
+LLM_SEMANTIC_CACHE_SCOPE = (os.environ.get('LLM_SEMANTIC_CACHE_SCOPE') or 'both').strip().lower()
+semantic_cache = SemanticCache(
+    threshold=float(os.environ.get('LLM_SEMANTIC_CACHE_THRESHOLD', 0.9)),
+    max_entries=int(os.environ.get('LLM_SEMANTIC_CACHE_MAX_ENTRIES', 2048)),
+    ttl_seconds=float(os.environ.get('LLM_SEMANTIC_CACHE_TTL_SECONDS', 86400))
+) if LLM_SEMANTIC_CACHE_ENABLED else None
 
 # In-memory storage for tasks and conversations (scoped per user)
 tasks_by_id: Dict[str, 'Task'] = {}
@@ -62,6 +204,54 @@ def _iso_now() -> str:
     return datetime.now().isoformat()
 
 
+def _estimate_tokens(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    return (len(text) + 3) // 4
+
+
+def _message_tokens(message: Dict[str, Any]) -> int:
+    content = message.get('content', '')
+    if not content:
+        return 0
+    return _estimate_tokens(content) + MESSAGE_TOKEN_OVERHEAD
+
+
+def _compile_message(message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    content = message.get('content', '')
+    if not content:
+        return None
+    return {
+        'role': 'model' if message.get('role') == 'assistant' else 'user',
+        'parts': [{'text': content}]
+    }
+
+
+def _memory_document(task: 'Task', message: Dict[str, Any]) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+    content = message.get('content') or ''
+    if not content or not message.get('id') or message.get('role') not in ('user', 'assistant'):
+        return None
+    if (message.get('metadata') or {}).get('kind') == 'improve_feedback':
+        # Improve instructions are boilerplate around the user's feedback.
+        content = (message.get('metadata') or {}).get('feedback') or ''
+        if not content:
+            return None
+    return message['id'], content, {
+        'task_id': task.id,
+        'task_name': task.name,
+        'role': message['role'],
+        'text': _truncate_to_tokens(' '.join(content.split()), MEMORY_SNIPPET_TOKENS)
+    }
+
+
+def _remember_message(task: 'Task', message: Dict[str, Any]) -> None:
+    if user_memory is None or not task.user_id:
+        return
+    document = _memory_document(task, message)
+    if document is not None:
+        user_memory.add(task.user_id, *document)
+
+
 def _task_history_path(user_id: str) -> str:
     return os.path.join(TASK_HISTORY_DIR, f'{user_id}.json')
 
@@ -82,6 +272,7 @@ class Task:
         updated_at: Optional[str] = None,
         start_ts: Optional[float] = None,
         end_ts: Optional[float] = None,
+        context_summary: Optional[Dict[str, Any]] = None,
     ):
         now_iso = _iso_now()
         self.id = task_id or str(int(time.time() * 1000))
@@ -98,6 +289,59 @@ class Task:
         self.updated_at = updated_at or now_iso
         self.start_ts = start_ts if start_ts is not None else _parse_ts(self.started_at, time.time())
         self.end_ts = end_ts if end_ts is not None else (_parse_ts(self.completed_at) if self.completed_at else None)
+        summary = context_summary if isinstance(context_summary, dict) else {}
+        self.summary_text = summary.get('text') or ''
+        self.summarized_count = min(int(summary.get('message_count') or 0), len(self.messages))
+        if not self.summarized_count:
+            self.summary_text = ''
+        self._rebuild_compiled()
+        self.pending_job_id: Optional[str] = None
+
+    def _rebuild_compiled(self) -> None:
+        # Model-ready context kept in step with self.messages:
+        # _compiled holds one entry per non-empty message, _compiled_ends[i] is
+        # len(_compiled) after message i and _token_prefix[i] is the estimated
+        # token count of messages[:i].
+        self._compiled: list = []
+        self._compiled_ends: list = []
+        self._token_prefix: list = [0]
+        for message in self.messages:
+            self._append_compiled(message)
+
+    def _append_compiled(self, message: Dict[str, Any]) -> None:
+        compiled = _compile_message(message)
+        if compiled is not None:
+            self._compiled.append(compiled)
+        self._compiled_ends.append(len(self._compiled))
+        self._token_prefix.append(self._token_prefix[-1] + _message_tokens(message))
+
+    def pop_message(self) -> Optional[Dict[str, Any]]:
+        if not self.messages:
+            return None
+        message = self.messages.pop()
+        if user_memory is not None and message.get('id'):
+            user_memory.remove(self.user_id, message['id'])
+        self._compiled_ends.pop()
+        self._token_prefix.pop()
+        del self._compiled[self._compiled_ends[-1] if self._compiled_ends else 0:]
+        if self.summarized_count > len(self.messages):
+            self.summarized_count = len(self.messages)
+        return message
+
+    def window_start(self, budget: int, floor: int = 0) -> int:
+        """Index of the oldest message such that messages[index:] fit in ``budget``.
+
+        The latest message is always kept, even when it alone exceeds the budget.
+        """
+        count = len(self.messages)
+        if count == 0:
+            return 0
+        floor = min(floor, count - 1)
+        return bisect_left(self._token_prefix, self._token_prefix[count] - budget, floor, count - 1)
+
+    def compiled_since(self, start: int) -> list:
+        offset = self._compiled_ends[start - 1] if start > 0 else 0
+        return self._compiled[offset:]
 
     def _normalize_messages(self) -> None:
         normalized = []
@@ -114,7 +358,7 @@ class Task:
             normalized.append(cleaned)
         self.messages = normalized
 
-    def add_message(self, role: str, content: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+    def add_message(self, role: str, content: str, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         metadata_copy = deepcopy(metadata) if metadata else None
         message_id = None
         if metadata_copy:
@@ -128,9 +372,12 @@ class Task:
         if metadata_copy:
             entry["metadata"] = metadata_copy
         self.messages.append(entry)
+        self._append_compiled(entry)
+        _remember_message(self, entry)
         if role == "user":
             self.iterations += 1
         self.updated_at = entry["timestamp"]
+        return entry
 
     def get_duration(self) -> int:
         if self.start_ts is None:
@@ -163,7 +410,11 @@ class Task:
             'created_at': self.created_at,
             'updated_at': self.updated_at,
             'start_ts': self.start_ts,
-            'end_ts': self.end_ts
+            'end_ts': self.end_ts,
+            'context_summary': {
+                'text': self.summary_text,
+                'message_count': self.summarized_count
+            }
         }
         return payload
 
@@ -200,7 +451,8 @@ class Task:
             created_at=record.get('created_at'),
             updated_at=record.get('updated_at'),
             start_ts=record.get('start_ts'),
-            end_ts=record.get('end_ts')
+            end_ts=record.get('end_ts'),
+            context_summary=record.get('context_summary')
         )
 
 # Paths for reflection data
@@ -210,10 +462,56 @@ QUESTIONS_PATH = os.path.join(DATA_DIR, 'questions.json')
 RESULTS_PATH = os.path.join(DATA_DIR, 'results.json')
 PROMPT_HACKS_PATH = os.path.join(DATA_DIR, 'prompt_hacks.json')
 CLARITY_QUESTIONS_PATH = os.path.join(DATA_DIR, 'clarity_questions.json')
-CLARITY_RESULTS_PATH = os.path.join(DATA_DIR, 'clarity_results.json')
 USERS_PATH = os.path.join(DATA_DIR, 'users.json')
 ONBOARDING_RESPONSES_PATH = os.path.join(DATA_DIR, 'onboarding_responses.json')
+ONBOARDING_INDEX_DIR = os.path.join(DATA_DIR, 'onboarding_index')
 TASK_HISTORY_DIR = os.path.join(DATA_DIR, 'task_history')
+RESULT_AGGREGATES_DIR = os.path.join(DATA_DIR, 'result_aggregates')
+JOBS_DIR = os.path.join(DATA_DIR, 'jobs')
+USAGE_PATH = os.path.join(DATA_DIR, 'usage.json')
+BENCHMARKS_PATH = os.path.join(DATA_DIR, 'benchmarks.json')
+IDEMPOTENCY_STATE_PATH = os.environ.get('IDEMPOTENCY_STATE_PATH') or os.path.join(DATA_DIR, 'idempotency.json')
+
+# Shared through a locked file so retries that reach another worker process replay too.
+idempotency_store = FileIdempotencyStore(IDEMPOTENCY_STATE_PATH, ttl_seconds=IDEMPOTENCY_TTL_SECONDS)
+
+# Compiled view of questions.json used by compute_reflection_score
+question_scoring = ScoringPlanFile(
+    QUESTIONS_PATH,
+    check_interval=float(os.environ.get('QUESTIONS_RELOAD_SECONDS', 1))
+)
+
+# Upper bound on records accepted by one /api/reflection/submit-batch call
+REFLECTION_BATCH_MAX_RECORDS = int(os.environ.get('REFLECTION_BATCH_MAX_RECORDS', 500))
+
+# Token and latency rollups per task, user and day (see /api/admin/usage)
+usage_ledger = UsageLedger(
+    USAGE_PATH,
+    flush_interval=float(os.environ.get('USAGE_FLUSH_SECONDS', 30)),
+    retention_days=int(os.environ.get('USAGE_RETENTION_DAYS', 400))
+)
+
+# Opt-in daily and monthly token allowances per user, checked against the
+# usage ledger before each generation. The env limits apply to the default tier;
+# QUOTA_POLICY_PATH can define further tiers (0 means unlimited).
+quota_enforcer = QuotaEnforcer(
+    usage_ledger.counters,
+    {
+        'daily_soft_tokens': int(os.environ.get('QUOTA_DAILY_SOFT_TOKENS', 150000)),
+        'daily_hard_tokens': int(os.environ.get('QUOTA_DAILY_HARD_TOKENS', 200000)),
+        'monthly_soft_tokens': int(os.environ.get('QUOTA_MONTHLY_SOFT_TOKENS', 2000000)),
+        'monthly_hard_tokens': int(os.environ.get('QUOTA_MONTHLY_HARD_TOKENS', 3000000))
+    },
+    policy_path=os.environ.get('QUOTA_POLICY_PATH') or None
+) if _env_flag('QUOTA_ENABLED') else None
+
+# Population distribution of per-submission domain scores, one KLL sketch
+# per domain, merged across workers through benchmarks.json.
+benchmark_sketches = SketchStore(
+    BENCHMARKS_PATH,
+    k=int(os.environ.get('BENCHMARK_SKETCH_K', 200)),
+    flush_interval=float(os.environ.get('BENCHMARK_FLUSH_SECONDS', 30))
+)
 
 _file_locks: Dict[str, Lock] = {}
 _file_registry_lock = Lock()
@@ -238,6 +536,9 @@ def read_json_file(path, default):
                     json.dump(default, f)
                 return default
             with open(path, 'r') as f:
+                if fcntl is not None:
+                    # Wait out an in-progress append_json_list from another worker.
+                    fcntl.flock(f, fcntl.LOCK_SH)
                 return json.load(f)
         except Exception:
             return default
@@ -250,6 +551,70 @@ def write_json_file(path, data):
             json.dump(data, f, indent=2)
 
 
+@contextmanager
+def _exclusive_file_lock(path: str):
+    """Serialise a read-modify-write of ``path`` across threads and worker processes.
+
+    Uses ``<path>.lock`` so it can be held while ``path`` itself is read and written.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _get_file_lock(f'{path}:update'), open(f'{path}.lock', 'a') as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def append_json_list(path: str, items: List[Any]) -> None:
+    """Append ``items`` to the JSON array stored in ``path``, writing only the new
+    items and the closing bracket, so the cost does not grow with the file.
+
+    The file is held under an exclusive flock for the whole read-seek-write, so
+    worker processes cannot interleave appends (readers take a shared lock in
+    read_json_file). A file that is not a JSON array raises ValueError rather
+    than being overwritten.
+    """
+    if not items:
+        return
+    lines = ',\n'.join('\n'.join(f'  {line}' for line in json.dumps(item, indent=2).splitlines()) for item in items)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _get_file_lock(path), os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            size = f.seek(0, os.SEEK_END)
+            tail_start = max(0, size - 4096)
+            f.seek(tail_start)
+            body = f.read().rstrip()
+            if body.endswith(b']') and body[:-1].rstrip():
+                body = body[:-1].rstrip()
+                position = tail_start + len(body)
+                payload = f"{'' if body.endswith(b'[') else ','}\n{lines}\n]"
+            else:
+                f.seek(0)
+                raw = f.read()
+                existing: Any = []
+                if raw.strip():
+                    try:
+                        existing = json.loads(raw)
+                    except ValueError:
+                        existing = None
+                    if not isinstance(existing, list):
+                        raise ValueError(f'{path} does not hold a JSON array; refusing to overwrite it')
+                position = 0
+                payload = json.dumps(existing + list(items), indent=2)
+            f.seek(position)
+            f.write(payload.encode('utf-8'))
+            f.truncate()
+            f.flush()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
 def load_users() -> Dict[str, Dict[str, str]]:
     payload = read_json_file(USERS_PATH, {'users': {}})
     users = payload.get('users', {}) if isinstance(payload, dict) else {}
@@ -312,10 +677,6 @@ def load_onboarding_responses() -> Dict[str, Dict[str, Any]]:
     return data if isinstance(data, dict) else {}
 
 
-def save_onboarding_responses(responses: Dict[str, Dict[str, Any]]) -> None:
-    write_json_file(ONBOARDING_RESPONSES_PATH, responses)
-
-
 ensure_seed_user()
 
 
@@ -339,22 +700,200 @@ def load_results(path: str = RESULTS_PATH, user_id: Optional[str] = None):
         raw_results = []
     normalized = []
     for entry in raw_results:
-        if not isinstance(entry, dict):
+        entry = _normalize_result(entry)
+        if entry is None:
             continue
-        entry.setdefault('context', 'reflection')
-        entry.setdefault('task_meta', {})
         if user_id and entry.get('user_id') != user_id:
             continue
         normalized.append(entry)
     return normalized
 
 
-def persist_result(record: Dict[str, Any], path: str = RESULTS_PATH) -> None:
-    existing = read_json_file(path, [])
-    if not isinstance(existing, list):
-        existing = []
-    existing.append(record)
-    write_json_file(path, existing)
+def _normalize_result(entry: Any) -> Optional[Dict[str, Any]]:
+    if not isinstance(entry, dict):
+        return None
+    entry.setdefault('context', 'reflection')
+    entry.setdefault('task_meta', {})
+    return entry
+
+
+# Timestamp-ordered per-user view of results.json for /api/reflection/results
+results_index = ResultsIndex(RESULTS_PATH, lambda: load_results(RESULTS_PATH), normalize=_normalize_result)
+
+
+def persist_results(records: List[Dict[str, Any]]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """Append ``records`` to results.json in one write.
+
+    A record carrying a ``client_record_id`` that its user already stored is
+    not written again; the stored records are returned by (user_id, id). The
+    check and the append happen under one cross-process lock, so two workers
+    cannot both accept the same client record.
+    """
+    with _exclusive_file_lock(RESULTS_PATH):
+        client_ids = {
+            (record.get('user_id'), record['client_record_id'])
+            for record in records if record.get('client_record_id')
+        }
+        stored = results_index.client_records(client_ids) if client_ids else {}
+        new_records = [
+            record for record in records
+            if (record.get('user_id'), record.get('client_record_id')) not in stored
+        ]
+        if new_records:
+            stamp_before = results_index.file_stamp()
+            append_json_list(RESULTS_PATH, new_records)
+            results_index.appended(new_records, stamp_before)
+    return stored
+
+
+def persist_result(record: Dict[str, Any]) -> None:
+    persist_results([record])
+
+
+def _onboarding_seed() -> Dict[str, Dict[str, Any]]:
+    """Onboarding entries for every user, from onboarding_responses.json and the
+    baselines in results.json (the newest wins; results.json on a tie)."""
+    entries: Dict[str, Dict[str, Any]] = {}
+    for user_id, response in load_onboarding_responses().items():
+        if isinstance(response, dict) and response.get('completed'):
+            entries[user_id] = {
+                'completed': True,
+                'completed_at': response.get('completed_at'),
+                'answers_ref': {'source': 'onboarding_responses'}
+            }
+    for record in load_results():
+        user_id = record.get('user_id')
+        if record.get('context') != 'baseline' or not user_id:
+            continue
+        current = entries.get(user_id)
+        if current is None or timestamp_key(record.get('timestamp')) >= timestamp_key(current.get('completed_at')):
+            entries[user_id] = {
+                'completed': True,
+                'completed_at': record.get('timestamp'),
+                'answers_ref': {'source': 'results', 'timestamp': record.get('timestamp')}
+            }
+    return entries
+
+
+# Per-user onboarding status, so login and signup read one small file
+onboarding_index = OnboardingIndex(ONBOARDING_INDEX_DIR, _onboarding_seed)
+
+
+def get_onboarding_status(user_id: str) -> Dict[str, Any]:
+    entry = onboarding_index.get(user_id) or {}
+    return {'completed': bool(entry.get('completed')), 'completed_at': entry.get('completed_at')}
+
+
+def load_onboarding_answers(user_id: str) -> Dict[str, Any]:
+    """The answers behind a user's onboarding entry, read from where it points."""
+    entry = onboarding_index.get(user_id, cached=False) or {}
+    ref = entry.get('answers_ref') or {}
+    if ref.get('source') == 'results':
+        key = timestamp_key(ref.get('timestamp'))
+        baselines = results_index.query(user_id, since=key, until=key + 1e-3, context='baseline')
+        return baselines[-1].get('answers', {}) if baselines else {}
+    if ref.get('source') == 'onboarding_responses':
+        return (load_onboarding_responses().get(user_id) or {}).get('answers', {})
+    return {}
+
+
+_dashboard_rules_cache: Dict[str, Any] = {'plan': None, 'rules': None}
+
+
+def _dashboard_rules() -> DashboardRules:
+    plan = question_scoring.current()
+    if _dashboard_rules_cache['plan'] is not plan:
+        bank = question_scoring.bank
+        _dashboard_rules_cache['rules'] = DashboardRules(bank.get('questions') or [], bank.get('version'))
+        _dashboard_rules_cache['plan'] = plan
+    return _dashboard_rules_cache['rules']
+
+
+def _result_aggregate_path(user_id: str) -> str:
+    return os.path.join(RESULT_AGGREGATES_DIR, f'{user_id}.json')
+
+
+def _aggregate_is_current(aggregate: Any, rules: DashboardRules) -> bool:
+    return (
+        isinstance(aggregate, dict)
+        and aggregate.get('format') == AGGREGATE_FORMAT
+        and aggregate.get('questions_version') == rules.version
+    )
+
+
+def _read_result_aggregate(path: str) -> Any:
+    # read_json_file would create a missing file; a missing aggregate just means "build one".
+    return read_json_file(path, {}) if os.path.exists(path) else None
+
+
+def load_result_aggregate(user_id: str) -> Dict[str, Any]:
+    """The user's dashboard aggregate, rebuilt from their indexed results if it is
+    missing or was built against another question bank version."""
+    rules = _dashboard_rules()
+    path = _result_aggregate_path(user_id)
+    aggregate = _read_result_aggregate(path)
+    if _aggregate_is_current(aggregate, rules):
+        return aggregate
+    with _exclusive_file_lock(path):
+        aggregate = _read_result_aggregate(path)
+        if not _aggregate_is_current(aggregate, rules):
+            aggregate = build_aggregate(results_index.query(user_id), rules)
+            if aggregate['records']:
+                write_json_file(path, aggregate)
+    return aggregate
+
+
+def record_result_aggregates(records: List[Dict[str, Any]]) -> None:
+    """Fold results that were just persisted to results.json into their users' aggregates,
+    with one read and write per user and no scan of results.json."""
+    by_user: Dict[str, List[Dict[str, Any]]] = {}
+    for record in records:
+        if record.get('user_id'):
+            by_user.setdefault(record['user_id'], []).append(record)
+    rules = _dashboard_rules()
+    for user_id, user_records in by_user.items():
+        path = _result_aggregate_path(user_id)
+        with _exclusive_file_lock(path):
+            aggregate = _read_result_aggregate(path)
+            if _aggregate_is_current(aggregate, rules):
+                for record in user_records:
+                    apply_record(aggregate, record, rules)
+            else:
+                # The results index already holds the new records; for a new
+                # user that is all there is, so this stays O(their records).
+                aggregate = build_aggregate(results_index.query(user_id), rules)
+            write_json_file(path, aggregate)
+
+
+_benchmarks_seeded = {'done': False}
+_benchmarks_seed_lock = Lock()
+
+
+def _seed_benchmarks() -> bool:
+    """Build benchmarks.json from results.json the first time it is needed.
+
+    Returns True when this call seeded it (so it already holds every stored result).
+    """
+    if _benchmarks_seeded['done']:
+        return False
+    with _benchmarks_seed_lock:
+        if _benchmarks_seeded['done']:
+            return False
+        rules = _dashboard_rules()
+        seeded = benchmark_sketches.seed_if_missing(
+            lambda: (record_domain_scores(record, rules) for record in load_results())
+        )
+        _benchmarks_seeded['done'] = True
+        return seeded
+
+
+def record_benchmark_scores(records: List[Dict[str, Any]]) -> None:
+    """Add results that were just persisted to results.json to the population sketches."""
+    if _seed_benchmarks():
+        return
+    rules = _dashboard_rules()
+    for record in records:
+        benchmark_sketches.add(record_domain_scores(record, rules))
 
 
 def persist_task(task: Task) -> None:
@@ -401,37 +940,663 @@ def _find_message_index(task: Task, message_id: str) -> int:
             return idx
     return -1
 
-def _build_context_messages(messages: Any) -> list:
-    if isinstance(messages, Task):
-        source = messages.messages
-    else:
-        source = messages
-    history = (source or [])[-MAX_HISTORY_MESSAGES:]
-    compiled = [{
-        'role': 'user',
-        'parts': [{'text': SYSTEM_INSTRUCTION}]
-    }]
-    for message in history:
-        role = message.get('role')
-        content = message.get('content', '')
+def _window_start(source: list, budget: int) -> int:
+    start = len(source)
+    used = 0
+    while start > 0:
+        cost = _message_tokens(source[start - 1])
+        if used + cost > budget and start < len(source):
+            break
+        used += cost
+        start -= 1
+    return start
+
+
+def _format_turns(messages: list) -> str:
+    lines = []
+    for message in messages:
+        content = (message.get('content') or '').strip()
         if not content:
             continue
-        mapped_role = 'model' if role == 'assistant' else 'user'
-        compiled.append({
-            'role': mapped_role,
-            'parts': [{'text': content}]
-        })
-    return compiled
+        speaker = 'Assistant' if message.get('role') == 'assistant' else 'User'
+        lines.append(f"{speaker}: {content}")
+    return '\n'.join(lines)
+
 
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rsplit(' ', 1)[0] + ' ...'
 
-def _generate_markdown_response(context_source: Any) -> str:
-    context_messages = _build_context_messages(context_source)
-    response = model.generate_content(
-        contents=context_messages,
-        generation_config=GENERATION_CONFIG
+
+def _extractive_summary(previous: str, messages: list) -> str:
+    lines = [line for line in previous.splitlines() if line.strip()]
+    for message in messages:
+        content = ' '.join((message.get('content') or '').split())
+        if not content:
+            continue
+        speaker = 'Assistant' if message.get('role') == 'assistant' else 'User'
+        lines.append(f"- {speaker}: {_truncate_to_tokens(content, 40)}")
+    while len(lines) > 1 and _estimate_tokens('\n'.join(lines)) > CONTEXT_SUMMARY_TOKENS:
+        lines.pop(0)
+    return _truncate_to_tokens('\n'.join(lines), CONTEXT_SUMMARY_TOKENS)
+
+
+def _summarize_turns(
+    previous: str,
+    messages: list,
+    cancel_token: Optional[CancellationToken] = None,
+    task: Optional['Task'] = None,
+) -> str:
+    prompt = (
+        "Update the running summary of a conversation between a user and an AI assistant. "
+        f"Keep it under {CONTEXT_SUMMARY_TOKENS * 3 // 4} words. Preserve facts the user shared "
+        "about themselves (name, goals, constraints), decisions made and open questions. "
+        "Reply with the updated summary only.\n\n"
+        f"Current summary:\n{previous or '(empty)'}\n\n"
+        f"New turns:\n{_format_turns(messages)}"
     )
-    raw_text = getattr(response, 'text', '') or ''
-    return raw_text.strip()
+    try:
+        started = time.monotonic()
+        result = llm.generate(
+            [{'role': 'user', 'parts': [{'text': prompt}]}],
+            SUMMARY_GENERATION_CONFIG,
+            cancel_token=cancel_token
+        )
+        summary = result.text
+        if task is not None:
+            usage_ledger.record(
+                task.user_id,
+                task.id,
+                result.model,
+                result.prompt_tokens if result.prompt_tokens is not None else _estimate_tokens(prompt),
+                result.response_tokens if result.response_tokens is not None else _estimate_tokens(summary),
+                (time.monotonic() - started) * 1000.0
+            )
+    except GenerationCancelled:
+        raise
+    except Exception:
+        summary = ''
+    if not summary:
+        return _extractive_summary(previous, messages)
+    return _truncate_to_tokens(summary, CONTEXT_SUMMARY_TOKENS)
+
+
+def _fold_older_turns(task: 'Task', window_start: int, cancel_token: Optional[CancellationToken] = None) -> None:
+    target = task.window_start(int(CONTEXT_TOKEN_BUDGET * CONTEXT_FOLD_RATIO), floor=window_start)
+    folded = task.messages[task.summarized_count:target]
+    task.summary_text = _summarize_turns(task.summary_text, folded, cancel_token, task)
+    task.summarized_count = target
+
+
+SYSTEM_CONTEXT_ENTRY = {
+    'role': 'user',
+    'parts': [{'text': SYSTEM_INSTRUCTION}]
+}
+
+
+def _user_memory_index(user_id: str):
+    index = user_memory.get(user_id)
+    if index is not None:
+        return index
+    documents = []
+    for task in list(tasks_by_id.values()):
+        if task.user_id != user_id:
+            continue
+        for message in task.messages:
+            document = _memory_document(task, message)
+            if document is not None:
+                documents.append(document)
+    return user_memory.build(user_id, documents)
+
+
+def _memory_context_entry(task: 'Task') -> Optional[Dict[str, Any]]:
+    """Snippets from the user's other tasks relevant to the latest message."""
+    if user_memory is None or not task.user_id or not task.messages:
+        return None
+    latest = task.messages[-1]
+    if latest.get('role') != 'user':
+        return None
+    query = (latest.get('metadata') or {}).get('feedback') or latest.get('content') or ''
+    started = time.monotonic()
+    hits = _user_memory_index(task.user_id).query(
+        query,
+        k=MEMORY_TOP_K,
+        min_score=MEMORY_MIN_SCORE,
+        exclude=lambda payload: payload['task_id'] == task.id
+    )
+    metrics.observe('memory.query_ms', (time.monotonic() - started) * 1000.0)
+    lines = []
+    used = 0
+    for _, payload in hits:
+        speaker = 'User' if payload['role'] == 'user' else 'Assistant'
+        line = f"- [{payload['task_name']}] {speaker}: {payload['text']}"
+        cost = _estimate_tokens(line)
+        if used + cost > MEMORY_TOKEN_BUDGET:
+            break
+        lines.append(line)
+        used += cost
+    if not lines:
+        return None
+    metrics.incr('memory.injected')
+    return {
+        'role': 'user',
+        'parts': [{'text': "Notes from our conversations in other tasks, in case they are relevant:\n" + '\n'.join(lines)}]
+    }
+
+
+def _build_context_messages(messages: Any, cancel_token: Optional[CancellationToken] = None) -> Tuple[list, bool]:
+    """The model context for ``messages`` and whether memory snippets were injected into it."""
+    if not isinstance(messages, Task):
+        source = messages or []
+        compiled = [SYSTEM_CONTEXT_ENTRY]
+        for message in source[_window_start(source, CONTEXT_TOKEN_BUDGET):]:
+            entry = _compile_message(message)
+            if entry is not None:
+                compiled.append(entry)
+        return compiled, False
+
+    task = messages
+    start = task.window_start(CONTEXT_TOKEN_BUDGET, floor=task.summarized_count)
+    if start > task.summarized_count:
+        _fold_older_turns(task, start, cancel_token)
+        start = task.summarized_count
+    if task.summary_text and task.summarized_count:
+        prefix = [SYSTEM_CONTEXT_ENTRY, {
+            'role': 'user',
+            'parts': [{'text': f"Summary of the earlier conversation:\n{task.summary_text}"}]
+        }]
+    else:
+        prefix = [SYSTEM_CONTEXT_ENTRY]
+    memory_entry = _memory_context_entry(task)
+    if memory_entry is not None:
+        prefix.append(memory_entry)
+    return prefix + task.compiled_since(start), memory_entry is not None
+
+
+def _narrow_context_indices(task: 'Task', target_index: int) -> List[int]:
+    """Indices of the question behind a reply (plus IMPROVE_CONTEXT_WINDOW
+    earlier messages) and the reply itself."""
+    question_index = target_index - 1
+    # Earlier revisions of the same answer hang off improve instructions; the
+    # question is the closest real user turn before them.
+    while question_index >= 0 and (
+        task.messages[question_index].get('role') != 'user'
+        or (task.messages[question_index].get('metadata') or {}).get('kind') == 'improve_feedback'
+    ):
+        question_index -= 1
+    indices = []
+    if question_index >= 0:
+        window_start = max(0, question_index - max(0, IMPROVE_CONTEXT_WINDOW))
+        indices.extend(range(window_start, question_index + 1))
+    indices.append(target_index)
+    return indices
+
+
+def _narrow_improve_context(task: 'Task', target_message_id: str, feedback_entry: Dict[str, Any]) -> Optional[list]:
+    """Messages for a focused revision: the question behind the target reply,
+    the reply itself and the feedback instruction."""
+    target_index = _find_message_index(task, target_message_id)
+    if target_index < 0:
+        return None
+    return [task.messages[index] for index in _narrow_context_indices(task, target_index)] + [feedback_entry]
+
+
+def _improve_instruction(message_id: str, feedback: str) -> str:
+    return (
+        f"Improve your earlier response (message id: {message_id}). "
+        f"User feedback:\n{feedback.strip()}\n"
+        "Revise the answer, keeping correct parts while addressing the feedback."
+    )
+
+
+def _context_tokens(context_messages: list) -> int:
+    return sum(
+        _estimate_tokens(part.get('text')) + MESSAGE_TOKEN_OVERHEAD
+        for entry in context_messages
+        for part in entry.get('parts', [])
+    )
+
+
+def _wants_cache_bypass(data: Optional[Dict[str, Any]]) -> bool:
+    if isinstance(data, dict) and data.get('bypass_cache'):
+        return True
+    cache_control = (request.headers.get('Cache-Control') or '').lower()
+    return 'no-cache' in cache_control or 'no-store' in cache_control
+
+
+def _generation_error_status(error: Exception) -> int:
+    if isinstance(error, GenerationCancelled):
+        # 499: client closed request (nginx convention)
+        return 504 if error.reason == 'deadline' else 499
+    if isinstance(error, CircuitOpenError):
+        return 503
+    if isinstance(error, LLMTimeoutError):
+        return 504
+    if is_retryable(error):
+        return 502
+    return 500
+
+
+def _generation_error_response(prefix: str, error: Exception):
+    status = _generation_error_status(error)
+    payload = {'error': f'{prefix}: {str(error)}'}
+    if status not in (499, 500):
+        payload['retryable'] = True
+    response = jsonify(payload)
+    if isinstance(error, CircuitOpenError):
+        response.headers['Retry-After'] = str(max(1, int(error.retry_after + 0.5)))
+    return response, status
+
+
+def _require_admin():
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Admin endpoints are disabled; set ADMIN_TOKEN'}), 403
+    supplied = request.headers.get('X-Admin-Token') or ''
+    if supplied != ADMIN_TOKEN:
+        return jsonify({'error': 'Invalid admin token'}), 401
+    return None
+
+
+def _idempotent_replay(entry):
+    response = app.response_class(entry.body, status=entry.status, headers=entry.headers)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """Deduplicate retries that carry the same Idempotency-Key header (or body field).
+
+    Keys are scoped to the endpoint and user. Concurrent duplicates wait for the
+    original request and share its response; later duplicates get it replayed
+    until IDEMPOTENCY_TTL_SECONDS. Error outcomes (including 429s) are not kept,
+    so a retry after a failure runs again. Keys live in IDEMPOTENCY_STATE_PATH,
+    so they are shared by every worker process.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        data = request.get_json(silent=True) or {}
+        key = request.headers.get('Idempotency-Key') or (data.get('idempotency_key') if isinstance(data, dict) else None)
+        if not key:
+            return view(*args, **kwargs)
+        payload = {k: v for k, v in data.items() if k != 'idempotency_key'} if isinstance(data, dict) else data
+        fingerprint = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        user_id = data.get('user_id') if isinstance(data, dict) else None
+        scoped_key = f"{request.path}:{user_id or ''}:{key}"
+        state, entry = idempotency_store.begin(scoped_key, fingerprint)
+        if state == 'conflict':
+            metrics.incr('idempotency.conflicts')
+            return jsonify({'error': 'Idempotency-Key was already used with a different request body'}), 422
+        if state == 'pending':
+            metrics.incr('idempotency.waits')
+            if not idempotency_store.wait(scoped_key, entry, IDEMPOTENCY_WAIT_SECONDS):
+                return jsonify({'error': 'The original request with this Idempotency-Key did not complete'}), 409
+            return _idempotent_replay(entry)
+        if state == 'replay':
+            metrics.incr('idempotency.replays')
+            return _idempotent_replay(entry)
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except Exception:
+            idempotency_store.finish(scoped_key, entry, None, keep=False)
+            raise
+        idempotency_store.finish(
+            scoped_key,
+            entry,
+            response.status_code,
+            response.get_data(),
+            {k: v for k, v in response.headers.items() if k.lower() != 'content-length'},
+            keep=response.status_code < 400
+        )
+        return response
+    return wrapper
+
+
+def _estimate_request_tokens(data: Dict[str, Any]) -> int:
+    new_text = data.get('message') or data.get('feedback') or ''
+    if isinstance(data.get('items'), list):
+        new_text = '\n'.join(str(item.get('feedback') or '') for item in data['items'] if isinstance(item, dict))
+    tokens = _estimate_tokens(SYSTEM_INSTRUCTION) + _estimate_tokens(new_text) + MESSAGE_TOKEN_OVERHEAD
+    task = tasks_by_id.get(data.get('task_id') or active_task_by_user.get(data.get('user_id')) or '')
+    history_cap = CONTEXT_TOKEN_BUDGET + CONTEXT_SUMMARY_TOKENS
+    if user_memory is not None:
+        history_cap += MEMORY_TOKEN_BUDGET
+    if task is None:
+        return tokens + history_cap
+    return tokens + min(history_cap, task._token_prefix[-1] - task._token_prefix[task.summarized_count])
+
+
+def rate_limited(view):
+    """Apply per-user and global request/prompt-token buckets and RateLimit-* headers."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if rate_limiter is None:
+            return view(*args, **kwargs)
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            data = {}
+        decision = rate_limiter.check(str(data.get('user_id') or ''), _estimate_request_tokens(data))
+        if decision is None:
+            return view(*args, **kwargs)
+        if not decision.allowed:
+            metrics.incr('rate_limit.rejected')
+            response = jsonify({
+                'error': 'Rate limit exceeded, please slow down',
+                'retry_after': decision.retry_after
+            })
+            response.status_code = 429
+        else:
+            response = app.make_response(view(*args, **kwargs))
+        response.headers.extend(decision.headers())
+        return response
+    return wrapper
+
+
+def quota_checked(view):
+    """Reject generation requests that would push the user past a hard token quota.
+
+    Soft limits only add a Quota-Warning header so the frontend can nudge the user.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if quota_enforcer is None:
+            return view(*args, **kwargs)
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            data = {}
+        user_id = str(data.get('user_id') or '')
+        if not user_id:
+            return view(*args, **kwargs)
+        now = datetime.now()
+        decision = quota_enforcer.check(user_id, _estimate_request_tokens(data), get_user, now)
+        if not decision.allowed:
+            metrics.incr(f"quota.{decision.exceeded['period']}.rejected")
+            response = jsonify(decision.error_payload())
+            response.status_code = 429
+            response.headers['Retry-After'] = str(decision.retry_after(now))
+        else:
+            if decision.warnings:
+                metrics.incr('quota.soft_warnings')
+            response = app.make_response(view(*args, **kwargs))
+        response.headers.extend(decision.headers())
+        return response
+    return wrapper
+
+
+def _first_turn_question(context_source: Any, kind: str) -> Optional[str]:
+    if kind != 'send' or not isinstance(context_source, Task) or len(context_source.messages) != 1:
+        return None
+    message = context_source.messages[0]
+    return message.get('content') if message.get('role') == 'user' else None
+
+
+def _semantic_scopes(user_id: str) -> list:
+    scopes = []
+    if LLM_SEMANTIC_CACHE_SCOPE in ('user', 'both') and user_id:
+        scopes.append(f'user:{user_id}')
+    if LLM_SEMANTIC_CACHE_SCOPE in ('global', 'both'):
+        scopes.append('global')
+    return scopes
+
+
+def _generate_markdown_response(
+    context_source: Any,
+    bypass_cache: bool = False,
+    cancel_token: Optional[CancellationToken] = None,
+    kind: str = 'send',
+    category: Optional[str] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """Return the model reply and metadata describing how it was produced."""
+    context_messages, memory_injected = _build_context_messages(context_source, cancel_token)
+    context_tokens = _context_tokens(context_messages)
+    route = routing_policy.current().route(
+        context_tokens,
+        category=category or getattr(context_source, 'category', 'General'),
+        kind=kind,
+        latency_p95_ms=llm.model_p95_ms
+    )
+    metrics.incr(f'routing.{route.rule}')
+    context_meta = {'context_tokens': context_tokens, 'model': route.model, 'route': route.rule}
+    question = _first_turn_question(context_source, kind) if semantic_cache is not None else None
+    semantic_scopes = _semantic_scopes(context_source.user_id) if question else []
+    if memory_injected:
+        # Personalised by memory snippets: neither served from nor shared with other users.
+        semantic_scopes = [scope for scope in semantic_scopes if scope != 'global']
+    if question and semantic_scopes and not bypass_cache:
+        reused = semantic_cache.lookup(question, semantic_scopes)
+        if reused is not None:
+            return reused['text'], {
+                **context_meta,
+                'model': reused['meta'].get('model', route.model),
+                'reused': True,
+                'reused_scope': reused['scope'],
+                'reused_similarity': reused['similarity'],
+                'reused_age_seconds': reused['age_seconds']
+            }
+    cache_key = None
+    if response_cache is not None:
+        cache_key = make_cache_key(context_messages, route.generation_config, route.model)
+        if not bypass_cache:
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                return cached['text'], {
+                    **context_meta,
+                    'cache_hit': True,
+                    'cache_tier': cached['tier'],
+                    'cache_age_seconds': cached['age_seconds']
+                }
+    started = time.monotonic()
+    result = llm.generate(context_messages, route.generation_config, route.model, cancel_token=cancel_token)
+    usage_meta = {
+        'prompt_tokens': result.prompt_tokens if result.prompt_tokens is not None else context_tokens,
+        'response_tokens': (
+            result.response_tokens if result.response_tokens is not None else _estimate_tokens(result.text)
+        ),
+        'token_source': 'sdk' if result.prompt_tokens is not None else 'estimate',
+        'latency_ms': round((time.monotonic() - started) * 1000.0, 1)
+    }
+    if cache_key is not None:
+        response_cache.put(cache_key, result.text)
+    if question and semantic_scopes:
+        semantic_cache.put(question, result.text, semantic_scopes, {'model': result.model})
+    return result.text, {**context_meta, **usage_meta, 'model': result.model}
+
+
+def _record_usage(task: Task, generation_meta: Dict[str, Any]) -> None:
+    cached = bool(generation_meta.get('cache_hit') or generation_meta.get('reused'))
+    usage_ledger.record(
+        task.user_id,
+        task.id,
+        generation_meta.get('model'),
+        generation_meta.get('prompt_tokens', 0),
+        generation_meta.get('response_tokens', 0),
+        generation_meta.get('latency_ms', 0.0),
+        cached=cached
+    )
+
+
+def _rollback_turn(task: Task, user_message_id: str) -> None:
+    index = _find_message_index(task, user_message_id)
+    if index < 0:
+        return
+    while len(task.messages) > index:
+        removed = task.pop_message()
+        if removed and removed.get('role') == 'user':
+            task.iterations = max(0, task.iterations - 1)
+
+
+def _generate_reply(
+    task: Task,
+    user_message_id: str,
+    reply_metadata: Dict[str, Any],
+    bypass_cache: bool = False,
+    cancel_token: Optional[CancellationToken] = None,
+) -> Dict[str, Any]:
+    """Append the assistant reply for the turn ending at ``user_message_id``.
+
+    On failure or cancellation the turn is rolled back and persisted before the
+    error is re-raised.
+    """
+    started = time.monotonic()
+    kind = 'improve' if reply_metadata.get('kind') == 'improved_response' else 'send'
+    context_source: Any = task
+    if kind == 'improve' and reply_metadata.get('context_mode') == 'narrow':
+        feedback_index = _find_message_index(task, user_message_id)
+        if feedback_index >= 0:
+            context_source = _narrow_improve_context(
+                task, reply_metadata.get('target_message_id'), task.messages[feedback_index]
+            ) or task
+    try:
+        markdown_reply, generation_meta = _generate_markdown_response(
+            context_source, bypass_cache, cancel_token, kind, task.category
+        )
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        reply = task.add_message("assistant", markdown_reply, metadata={
+            **reply_metadata,
+            **generation_meta
+        })
+    except Exception as error:
+        if isinstance(error, GenerationCancelled):
+            metrics.incr(f'generation.cancelled.{error.reason}')
+        _rollback_turn(task, user_message_id)
+        persist_task(task)
+        raise
+    persist_task(task)
+    _record_usage(task, generation_meta)
+    if kind == 'improve':
+        mode = reply_metadata.get('context_mode') or 'full'
+        metrics.incr(f'improve.{mode}.requests')
+        metrics.observe(f'improve.{mode}.context_tokens', generation_meta.get('context_tokens', 0))
+        metrics.observe(f'improve.{mode}.latency_ms', (time.monotonic() - started) * 1000.0)
+    return reply
+
+
+def _client_disconnect_probe():
+    conn = request.environ.get('gunicorn.socket') or request.environ.get('werkzeug.socket')
+    if conn is None:
+        return None
+
+    def probe() -> Optional[str]:
+        try:
+            peeked = conn.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return None
+        except OSError:
+            return 'client_disconnected'
+        return None if peeked else 'client_disconnected'
+    return probe
+
+
+def _request_cancel_token() -> CancellationToken:
+    return CancellationToken(LLM_REQUEST_DEADLINE_SECONDS, probe=_client_disconnect_probe())
+
+
+def _job_cancel_probe(job_id: str):
+    def probe() -> Optional[str]:
+        job = job_store.get(job_id)
+        if not job or job.get('cancel_requested'):
+            return 'cancelled'
+        if JOB_ABANDON_SECONDS > 0:
+            last_seen = job.get('last_polled_ts') or 0
+            if time.time() - last_seen > JOB_ABANDON_SECONDS:
+                return 'abandoned'
+        return None
+    return probe
+
+
+def _wants_async(data: Dict[str, Any]) -> bool:
+    if isinstance(data, dict) and data.get('async'):
+        return True
+    return 'respond-async' in (request.headers.get('Prefer') or '').lower()
+
+
+def _has_pending_job(task: Task) -> bool:
+    if not task.pending_job_id:
+        return False
+    job = job_store.get(task.pending_job_id)
+    if job and job.get('status') in ACTIVE_STATUSES:
+        return True
+    task.pending_job_id = None
+    return False
+
+
+def _job_payload(job: Dict[str, Any]) -> Dict[str, Any]:
+    result = job.get('result') or {}
+    return {
+        'job_id': job['id'],
+        'kind': job.get('kind'),
+        'status': job.get('status'),
+        'task_id': job.get('task_id'),
+        'created_at': job.get('created_at'),
+        'updated_at': job.get('updated_at'),
+        'error': job.get('error'),
+        'messages': result.get('messages', [])
+    }
+
+
+def _enqueue_generation(kind: str, task: Task, user_entry: Dict[str, Any], reply_metadata: Dict[str, Any], bypass_cache: bool):
+    persist_task(task)
+    job = job_store.create(kind, task.user_id, task.id, {
+        'user_message_id': user_entry['id'],
+        'reply_metadata': reply_metadata,
+        'bypass_cache': bypass_cache
+    }, last_polled_ts=time.time())
+    task.pending_job_id = job['id']
+    active_task_by_user[task.user_id] = task.id
+    job_runner.submit(job)
+    metrics.incr(f'jobs.{kind}.queued')
+    payload = _job_payload(job)
+    payload['status_url'] = f"/api/jobs/{job['id']}?user_id={task.user_id}"
+    payload['task'] = task.to_dict()
+    response = jsonify(payload)
+    response.headers['Location'] = payload['status_url']
+    return response, 202
+
+
+def _run_generation_job(job: Dict[str, Any]) -> None:
+    params = job.get('params') or {}
+    user_message_id = params.get('user_message_id')
+    hydrate_tasks_for_user(job.get('user_id'))
+    task = tasks_by_id.get(job.get('task_id'))
+    index = _find_message_index(task, user_message_id) if task else -1
+    if index < 0:
+        job_store.update(job['id'], status='failed', error={'message': 'Task or message no longer exists', 'status': 404})
+        return
+    task.pending_job_id = job['id']
+    cancel_token = CancellationToken(JOB_DEADLINE_SECONDS, probe=_job_cancel_probe(job['id']), probe_interval=1.0)
+    running_job_tokens[job['id']] = cancel_token
+    try:
+        following = task.messages[index + 1] if index + 1 < len(task.messages) else None
+        if following and following.get('role') == 'assistant':
+            # Reply was persisted before a restart interrupted the job.
+            reply = following
+        else:
+            reply = _generate_reply(
+                task,
+                user_message_id,
+                params.get('reply_metadata') or {},
+                bool(params.get('bypass_cache')),
+                cancel_token
+            )
+    except GenerationCancelled as error:
+        metrics.incr(f"jobs.{job.get('kind')}.cancelled")
+        job_store.update(job['id'], status='cancelled', error={'message': str(error), 'reason': error.reason})
+        return
+    except Exception as error:
+        status = _generation_error_status(error)
+        metrics.incr(f"jobs.{job.get('kind')}.failed")
+        job_store.update(job['id'], status='failed', error={'message': str(error), 'status': status})
+        return
+    finally:
+        running_job_tokens.pop(job['id'], None)
+        if task.pending_job_id == job['id']:
+            task.pending_job_id = None
+    metrics.incr(f"jobs.{job.get('kind')}.succeeded")
+    job_store.update(job['id'], status='succeeded', result={
+        'messages': [deepcopy(task.messages[index]), deepcopy(reply)]
+    })
 
 
 def get_task_meta(task_id: Optional[str], user_id: Optional[str] = None):
@@ -454,65 +1619,9 @@ def compute_reflection_score(answers: dict):
     Likert: normalized to 0-100 via (x - min) / (max - min) * 100
     MCQ (single/multi): percentage of selected options that are tagged as (+1).
     Overall: average of Likert mean and MCQ mean (when both present).
+    The question bank is compiled once and recompiled when questions.json changes.
     """
-    qbank = read_json_file(QUESTIONS_PATH, { 'questions': [] }).get('questions', [])
-    q_by_id = { q.get('id'): q for q in qbank }
-
-    likert_scores = []
-    mcq_scores = []
-
-    for qid, value in (answers or {}).items():
-        q = q_by_id.get(qid)
-        if not q:
-            continue
-        qtype = q.get('type')
-        if qtype == 'scale':
-            scale = q.get('scale', {})
-            min_v = float(scale.get('min', 1))
-            max_v = float(scale.get('max', 5))
-            try:
-                x = float(value)
-            except Exception:
-                continue
-            if max_v == min_v:
-                continue
-            norm = max(0.0, min(1.0, (x - min_v) / (max_v - min_v)))
-            likert_scores.append(norm * 100.0)
-        elif qtype in ('single', 'multi'):
-            options = q.get('options', [])
-            def is_positive(opt: str):
-                return '(+1' in opt or '+1' in opt
-            positives = [opt for opt in options if is_positive(opt)]
-            if qtype == 'single':
-                selected = [value] if isinstance(value, str) else []
-            else:
-                selected = value if isinstance(value, list) else []
-            if not selected:
-                mcq_scores.append(0.0)
-                continue
-            pos_selected = [opt for opt in selected if isinstance(opt, str) and is_positive(opt)]
-            pct = (len(pos_selected) / len(selected)) * 100.0
-            mcq_scores.append(pct)
-
-    likert_mean = sum(likert_scores) / len(likert_scores) if likert_scores else None
-    mcq_mean = sum(mcq_scores) / len(mcq_scores) if mcq_scores else None
-
-    if likert_mean is not None and mcq_mean is not None:
-        overall = (likert_mean + mcq_mean) / 2.0
-    elif likert_mean is not None:
-        overall = likert_mean
-    elif mcq_mean is not None:
-        overall = mcq_mean
-    else:
-        overall = 0.0
-
-    return {
-        'overall': round(overall, 2),
-        'likert_mean': round(likert_mean, 2) if likert_mean is not None else None,
-        'mcq_mean': round(mcq_mean, 2) if mcq_mean is not None else None,
-        'likert_count': len(likert_scores),
-        'mcq_count': len(mcq_scores)
-    }
+    return question_scoring.current().score(answers)
 
 
 @app.route('/api/auth/signup', methods=['POST'])
@@ -542,16 +1651,10 @@ def signup():
     users[user_id] = record
     save_users(users)
 
-    responses = load_onboarding_responses()
-    onboarding_entry = responses.get(user_id, {})
-
     return jsonify({
         'user': sanitize_user(record),
         'credentials_plaintext': True,
-        'onboarding': {
-            'completed': bool(onboarding_entry.get('completed')),
-            'completed_at': onboarding_entry.get('completed_at')
-        }
+        'onboarding': get_onboarding_status(user_id)
     })
 
 
@@ -568,16 +1671,10 @@ def login():
     if not user or user.get('password') != password:
         return jsonify({'error': 'Invalid credentials'}), 401
 
-    responses = load_onboarding_responses()
-    onboarding_entry = responses.get(user['id'], {})
-
     return jsonify({
         'user': sanitize_user(user),
         'credentials_plaintext': True,
-        'onboarding': {
-            'completed': bool(onboarding_entry.get('completed')),
-            'completed_at': onboarding_entry.get('completed_at')
-        }
+        'onboarding': get_onboarding_status(user['id'])
     })
 
 
@@ -589,13 +1686,11 @@ def onboarding_status():
     if not get_user(user_id):
         return jsonify({'error': 'User not found'}), 404
 
-    responses = load_onboarding_responses()
-    entry = responses.get(user_id, {})
+    status = get_onboarding_status(user_id)
     return jsonify({
         'user_id': user_id,
-        'completed': bool(entry.get('completed')),
-        'completed_at': entry.get('completed_at'),
-        'answers': entry.get('answers', {})
+        **status,
+        'answers': load_onboarding_answers(user_id) if status['completed'] else {}
     })
 
 @app.route('/api/new-task', methods=['POST'])
@@ -619,6 +1714,9 @@ def new_task():
 
 
 @app.route('/api/send-message', methods=['POST'])
+@idempotent
+@rate_limited
+@quota_checked
 def send_message():
     data = request.get_json() or {}
     user_id = data.get('user_id')
@@ -640,29 +1738,27 @@ def send_message():
     if not message:
         return jsonify({'error': 'message is required'}), 400
 
-    has_prior_assistant = any(msg.get('role') == 'assistant' for msg in task.messages)
+    if _has_pending_job(task):
+        return jsonify({'error': 'A reply is still being generated for this task', 'job_id': task.pending_job_id}), 409
 
-    task.add_message("user", message)
+    user_entry = task.add_message("user", message)
+    reply_metadata = {'format': 'markdown'}
+    if _wants_async(data):
+        return _enqueue_generation('send', task, user_entry, reply_metadata, _wants_cache_bypass(data))
 
     try:
-        markdown_reply = _generate_markdown_response(task)
-        task.add_message("assistant", markdown_reply, metadata={
-            'format': 'markdown'
-        })
-        persist_task(task)
+        _generate_reply(task, user_entry['id'], reply_metadata, _wants_cache_bypass(data), _request_cancel_token())
     except Exception as error:
-        if task.messages and task.messages[-1]['role'] == 'user':
-            task.messages.pop()
-            task.iterations = max(0, task.iterations - 1)
-        persist_task(task)
-        return jsonify({'error': f'Failed to generate response: {str(error)}'}), 500
+        return _generation_error_response('Failed to generate response', error)
 
     active_task_by_user[user_id] = task.id
-    persist_task(task)
     return jsonify(task.to_dict())
 
 
 @app.route('/api/improve-message', methods=['POST'])
+@idempotent
+@rate_limited
+@quota_checked
 def improve_message():
     data = request.get_json() or {}
     user_id = data.get('user_id')
@@ -694,39 +1790,325 @@ def improve_message():
     if target_message.get('role') != 'assistant':
         return jsonify({'error': 'Selected message is not an assistant response'}), 400
 
-    instruction = (
-        f"Improve your earlier response (message id: {message_id}). "
-        f"User feedback:\n{feedback.strip()}\n"
-        "Revise the answer, keeping correct parts while addressing the feedback."
-    )
+    if _has_pending_job(task):
+        return jsonify({'error': 'A reply is still being generated for this task', 'job_id': task.pending_job_id}), 409
+
+    context_mode = str(data.get('context_mode') or IMPROVE_CONTEXT_MODE).strip().lower()
+    if context_mode not in IMPROVE_CONTEXT_MODES:
+        return jsonify({'error': f"context_mode must be one of {', '.join(IMPROVE_CONTEXT_MODES)}"}), 400
+
+    target_metadata = target_message.get('metadata') or {}
+    if target_metadata.get('kind') == 'improved_response':
+        # Asking to revise a revision counts against the mode that produced it.
+        metrics.incr(f"improve.{target_metadata.get('context_mode') or 'full'}.reimproved")
 
-    task.add_message("user", instruction, metadata={
+    user_entry = task.add_message("user", _improve_instruction(message_id, feedback), metadata={
         'kind': 'improve_feedback',
         'target_message_id': message_id,
         'feedback': feedback
     })
+    reply_metadata = {
+        'kind': 'improved_response',
+        'target_message_id': message_id,
+        'context_mode': context_mode,
+        'format': 'markdown'
+    }
+    if _wants_async(data):
+        return _enqueue_generation('improve', task, user_entry, reply_metadata, _wants_cache_bypass(data))
 
     try:
-        markdown_reply = _generate_markdown_response(task)
-        task.add_message("assistant", markdown_reply, metadata={
-            'kind': 'improved_response',
-            'target_message_id': message_id,
-            'format': 'markdown'
+        _generate_reply(task, user_entry['id'], reply_metadata, _wants_cache_bypass(data), _request_cancel_token())
+    except Exception as error:
+        return _generation_error_response('Failed to improve response', error)
+
+    active_task_by_user[user_id] = task.id
+    return jsonify(task.to_dict())
+
+
+def _parse_batch_revisions(text: str, message_ids: List[str]) -> Optional[Dict[str, str]]:
+    cleaned = (text or '').strip()
+    if cleaned.startswith('```'):
+        # Models often wrap JSON in a ```json fence.
+        cleaned = cleaned.split('\n', 1)[1] if '\n' in cleaned else ''
+        cleaned = cleaned.rsplit('```', 1)[0]
+    try:
+        parsed = json.loads(cleaned)
+    except ValueError:
+        return None
+    if isinstance(parsed, dict):
+        parsed = parsed.get('revisions')
+    if not isinstance(parsed, list):
+        return None
+    revisions = {}
+    for item in parsed:
+        if not isinstance(item, dict):
+            continue
+        revision = item.get('revision')
+        if isinstance(revision, str) and revision.strip():
+            revisions[str(item.get('message_id'))] = revision.strip()
+    if any(message_id not in revisions for message_id in message_ids):
+        return None
+    return revisions
+
+
+def _split_batch_usage(results: List[Tuple[str, Dict[str, Any]]]) -> List[Tuple[str, Dict[str, Any]]]:
+    count = len(results)
+    split = []
+    for position, (revision, generation_meta) in enumerate(results):
+        meta = dict(generation_meta)
+        for field in ('prompt_tokens', 'response_tokens'):
+            if field in meta:
+                total = int(meta[field] or 0)
+                meta[field] = total // count + (1 if position < total % count else 0)
+        meta['usage_shared_by'] = count
+        split.append((revision, meta))
+    return split
+
+
+def _structured_batch_revisions(
+    task: Task,
+    batch: List[Dict[str, Any]],
+    context_mode: str,
+    bypass_cache: bool,
+    cancel_token: CancellationToken,
+) -> Optional[List[Tuple[str, Dict[str, Any]]]]:
+    """Ask for every revision in one JSON reply; None if the call fails or the reply is unusable."""
+    if context_mode == 'narrow':
+        indices = sorted({
+            index
+            for item in batch
+            for index in _narrow_context_indices(task, item['target_index'])
+            if index != item['target_index']
         })
-        persist_task(task)
+        source = [task.messages[index] for index in indices]
+    else:
+        source = list(task.messages)
+    sections = []
+    for item in batch:
+        # Always quote the whole reply: the full-mode history is windowed to
+        # CONTEXT_TOKEN_BUDGET and may no longer contain it.
+        response_text = task.messages[item['target_index']].get('content', '')
+        sections.append(
+            f"message_id: {item['message_id']}\n"
+            f"Earlier response:\n{response_text}\n"
+            f"User feedback:\n{item['feedback']}"
+        )
+    instruction = {
+        'role': 'user',
+        'content': (
+            "Improve several of your earlier responses. Revise each one, keeping correct parts "
+            "while addressing its feedback.\n\n"
+            + '\n\n---\n\n'.join(sections)
+            + '\n\nReply with only a JSON array containing one object per message_id: '
+            '{"message_id": "<id>", "revision": "<revised answer in Markdown>"}.'
+        )
+    }
+    try:
+        # No response_mime_type: the pinned google-generativeai SDK rejects it,
+        # so the JSON is parsed out of the plain-text reply instead.
+        text, generation_meta = _generate_markdown_response(
+            source + [instruction],
+            bypass_cache,
+            cancel_token,
+            'improve',
+            task.category
+        )
+    except GenerationCancelled:
+        raise
+    except Exception:
+        # Let the caller retry item by item rather than fail the whole batch.
+        metrics.incr('improve_batch.structured_errors')
+        return None
+    revisions = _parse_batch_revisions(text, [item['message_id'] for item in batch])
+    if revisions is None:
+        return None
+    return [(revisions[item['message_id']], generation_meta) for item in batch]
+
+
+def _concurrent_batch_revisions(
+    task: Task,
+    batch: List[Dict[str, Any]],
+    context_mode: str,
+    bypass_cache: bool,
+    cancel_token: CancellationToken,
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """One model call per revision, run in parallel against the same history snapshot."""
+    snapshot = list(task.messages)
+
+    def revise(item: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        feedback_entry = {'role': 'user', 'content': item['instruction']}
+        source = None
+        if context_mode == 'narrow':
+            source = _narrow_improve_context(task, item['message_id'], feedback_entry)
+        if source is None:
+            source = snapshot + [feedback_entry]
+        return _generate_markdown_response(source, bypass_cache, cancel_token, 'improve', task.category)
+
+    workers = max(1, min(len(batch), IMPROVE_BATCH_CONCURRENCY))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='improve') as pool:
+        futures = [pool.submit(revise, item) for item in batch]
+        try:
+            return [future.result() for future in futures]
+        except Exception:
+            # One failure sinks the batch; stop the remaining calls early.
+            cancel_token.cancel('batch_failed')
+            raise
+
+
+@app.route('/api/improve-messages', methods=['POST'])
+@idempotent
+@rate_limited
+@quota_checked
+def improve_messages():
+    data = request.get_json() or {}
+    user_id = data.get('user_id')
+    task_id = data.get('task_id') or active_task_by_user.get(user_id)
+    items = data.get('items')
+
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+    if not task_id:
+        return jsonify({'error': 'task_id is required'}), 400
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'items must be a non-empty list of {message_id, feedback}'}), 400
+    if len(items) > IMPROVE_BATCH_MAX_ITEMS:
+        return jsonify({'error': f'At most {IMPROVE_BATCH_MAX_ITEMS} messages can be improved at once'}), 400
+    if not get_user(user_id):
+        return jsonify({'error': 'User not found'}), 404
+
+    hydrate_tasks_for_user(user_id)
+    task = tasks_by_id.get(task_id)
+    if not task or task.user_id != user_id:
+        return jsonify({'error': 'Task not found'}), 404
+
+    if _has_pending_job(task):
+        return jsonify({'error': 'A reply is still being generated for this task', 'job_id': task.pending_job_id}), 409
+
+    context_mode = str(data.get('context_mode') or IMPROVE_CONTEXT_MODE).strip().lower()
+    if context_mode not in IMPROVE_CONTEXT_MODES:
+        return jsonify({'error': f"context_mode must be one of {', '.join(IMPROVE_CONTEXT_MODES)}"}), 400
+
+    batch = []
+    for item in items:
+        message_id = item.get('message_id') if isinstance(item, dict) else None
+        feedback = str(item.get('feedback') or '').strip() if isinstance(item, dict) else ''
+        if not message_id or not feedback:
+            return jsonify({'error': 'Each item requires message_id and feedback'}), 400
+        if any(existing['message_id'] == message_id for existing in batch):
+            return jsonify({'error': f'Duplicate message_id: {message_id}'}), 400
+        target_index = _find_message_index(task, message_id)
+        if target_index < 0:
+            return jsonify({'error': 'Message not found', 'message_id': message_id}), 404
+        if task.messages[target_index].get('role') != 'assistant':
+            return jsonify({'error': 'Selected message is not an assistant response', 'message_id': message_id}), 400
+        batch.append({
+            'message_id': message_id,
+            'feedback': feedback,
+            'target_index': target_index,
+            'instruction': _improve_instruction(message_id, feedback)
+        })
+
+    bypass_cache = _wants_cache_bypass(data)
+    cancel_token = _request_cancel_token()
+    batch_mode = IMPROVE_BATCH_MODE if len(batch) > 1 else 'concurrent'
+    started = time.monotonic()
+    try:
+        results = None
+        if batch_mode == 'structured':
+            results = _structured_batch_revisions(task, batch, context_mode, bypass_cache, cancel_token)
+            if results is None:
+                metrics.incr('improve_batch.structured_fallback')
+                batch_mode = 'concurrent'
+        if results is None:
+            results = _concurrent_batch_revisions(task, batch, context_mode, bypass_cache, cancel_token)
+        cancel_token.raise_if_cancelled()
     except Exception as error:
-        if task.messages and task.messages[-1]['role'] == 'assistant':
-            task.messages.pop()
-        if task.messages and task.messages[-1]['role'] == 'user':
-            task.messages.pop()
-            task.iterations = max(0, task.iterations - 1)
-        persist_task(task)
-        return jsonify({'error': f'Failed to improve response: {str(error)}'}), 500
+        if isinstance(error, GenerationCancelled):
+            metrics.incr(f'generation.cancelled.{error.reason}')
+        return _generation_error_response('Failed to improve responses', error)
+
+    if batch_mode == 'structured':
+        # One upstream call: account for it once, and split its tokens across
+        # the revisions so per-message metadata still sums to the real usage.
+        _record_usage(task, results[0][1])
+        results = _split_batch_usage(results)
+    else:
+        for _, generation_meta in results:
+            _record_usage(task, generation_meta)
+
+    # Nothing is appended until every revision exists, so a failed batch
+    # leaves the history untouched.
+    batch_id = f'batch-{uuid4().hex}'
+    for item, (revision, generation_meta) in zip(batch, results):
+        target_metadata = task.messages[item['target_index']].get('metadata') or {}
+        if target_metadata.get('kind') == 'improved_response':
+            metrics.incr(f"improve.{target_metadata.get('context_mode') or 'full'}.reimproved")
+        metrics.incr(f'improve.{context_mode}.requests')
+        task.add_message("user", item['instruction'], metadata={
+            'kind': 'improve_feedback',
+            'target_message_id': item['message_id'],
+            'feedback': item['feedback'],
+            'batch_id': batch_id
+        })
+        task.add_message("assistant", revision, metadata={
+            **generation_meta,
+            'kind': 'improved_response',
+            'target_message_id': item['message_id'],
+            'context_mode': context_mode,
+            'format': 'markdown',
+            'batch_id': batch_id,
+            'batch_mode': batch_mode
+        })
+    persist_task(task)
+    metrics.incr(f'improve_batch.{batch_mode}')
+    metrics.observe('improve_batch.items', len(batch))
+    metrics.observe('improve_batch.latency_ms', (time.monotonic() - started) * 1000.0)
 
     active_task_by_user[user_id] = task.id
     return jsonify(task.to_dict())
 
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+    job = job_store.get(job_id)
+    if not job or job.get('user_id') != user_id:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.get('status') in ACTIVE_STATUSES:
+        job = job_store.update(job_id, last_polled_ts=time.time()) or job
+    payload = _job_payload(job)
+    if job.get('status') == 'succeeded':
+        task = tasks_by_id.get(job.get('task_id'))
+        if task:
+            payload['task'] = task.to_dict()
+    return jsonify(payload)
+
+
+def _request_job_cancel(job_id: str) -> Optional[Dict[str, Any]]:
+    job = job_store.get(job_id)
+    if not job or job.get('status') not in ACTIVE_STATUSES:
+        return job
+    job = job_store.update(job_id, cancel_requested=True) or job
+    token = running_job_tokens.get(job_id)
+    if token is not None:
+        token.cancel('cancelled')
+    return job
+
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+    job = job_store.get(job_id)
+    if not job or job.get('user_id') != user_id:
+        return jsonify({'error': 'Job not found'}), 404
+    job = _request_job_cancel(job_id) or job
+    return jsonify(_job_payload(job))
+
+
 @app.route('/api/get-task/<task_id>', methods=['GET'])
 def get_task(task_id):
     user_id = request.args.get('user_id')
@@ -849,6 +2231,11 @@ def switch_task():
     if not task or task.user_id != user_id:
         return jsonify({'error': 'Task not found'}), 404
 
+    previous = tasks_by_id.get(active_task_by_user.get(user_id) or '')
+    if previous is not None and previous.id != task_id and previous.pending_job_id:
+        # The user left the task mid-generation; stop paying for the reply.
+        _request_job_cancel(previous.pending_job_id)
+
     active_task_by_user[user_id] = task_id
     persist_task(task)
     return jsonify(task.to_dict())
@@ -857,6 +2244,121 @@ def switch_task():
 def health_check():
     return jsonify({'status': 'healthy', 'message': 'QOG Chatbot API is running'})
 
+
+def _improve_context_summary(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    """Side-by-side cost and re-improve rate for the improve context modes."""
+    counters = snapshot.get('counters', {})
+    observations = snapshot.get('observations', {})
+    summary = {}
+    for mode in IMPROVE_CONTEXT_MODES:
+        requests_count = counters.get(f'improve.{mode}.requests', 0)
+        reimproved = counters.get(f'improve.{mode}.reimproved', 0)
+        summary[mode] = {
+            'requests': requests_count,
+            'reimproved': reimproved,
+            'reimprove_rate': round(reimproved / requests_count, 3) if requests_count else None,
+            'mean_context_tokens': (observations.get(f'improve.{mode}.context_tokens') or {}).get('mean'),
+            'mean_latency_ms': (observations.get(f'improve.{mode}.latency_ms') or {}).get('mean')
+        }
+    summary['default_mode'] = IMPROVE_CONTEXT_MODE
+    return summary
+
+
+@app.route('/api/admin/metrics', methods=['GET'])
+def admin_metrics():
+    denied = _require_admin()
+    if denied:
+        return denied
+    payload = metrics.snapshot()
+    payload['llm'] = llm.status()
+    policy = routing_policy.current()
+    payload['routing'] = {
+        'policy_path': routing_policy.path,
+        'version': policy.version,
+        'rules': [rule.name for rule in policy.rules],
+        'last_error': routing_policy.last_error
+    }
+    if response_cache is not None:
+        payload['response_cache'] = response_cache.stats()
+    payload['improve_context'] = _improve_context_summary(payload)
+    if user_memory is not None:
+        payload['memory'] = user_memory.stats()
+    if semantic_cache is not None:
+        payload['semantic_cache'] = semantic_cache.stats()
+    if quota_enforcer is not None:
+        quota_policy = quota_enforcer.policy()
+        payload['quotas'] = {
+            'policy_path': quota_enforcer.policy_path,
+            'default_tier': quota_policy.default_tier,
+            'tiers': quota_policy.tiers,
+            'last_error': quota_enforcer.last_error
+        }
+    return jsonify(payload)
+
+@app.route('/api/admin/usage', methods=['GET'])
+def admin_usage():
+    """Token and latency rollups. Filters: user_id, task_id, from/to (YYYY-MM-DD), limit."""
+    denied = _require_admin()
+    if denied:
+        return denied
+    usage_ledger.flush()
+    user_id = request.args.get('user_id')
+    task_id = request.args.get('task_id')
+    date_from = request.args.get('from') or ''
+    date_to = request.args.get('to') or '9999-12-31'
+    try:
+        limit = max(1, min(int(request.args.get('limit', 10)), 500))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+
+    def in_range(day: str) -> bool:
+        return date_from <= day <= date_to
+
+    if task_id:
+        counters = usage_ledger.counters('task', task_id)
+        return jsonify({'task_id': task_id, 'usage': with_averages(counters)})
+
+    if user_id:
+        prefix = f'{user_id}/'
+        days = {
+            key[len(prefix):]: with_averages(counters)
+            for key, counters in usage_ledger.scope_items('user_day').items()
+            if key.startswith(prefix) and in_range(key[len(prefix):])
+        }
+        months = {
+            key[len(prefix):]: with_averages(counters)
+            for key, counters in usage_ledger.scope_items('user_month').items()
+            if key.startswith(prefix)
+        }
+        return jsonify({
+            'user_id': user_id,
+            'usage': with_averages(usage_ledger.counters('user', user_id)),
+            'days': dict(sorted(days.items())),
+            'months': dict(sorted(months.items())),
+            'top_tasks': usage_ledger.top(
+                'task', 'total_tokens', limit, lambda key, counters: counters.get('user_id') == user_id
+            )
+        })
+
+    days = {
+        key: with_averages(counters)
+        for key, counters in usage_ledger.scope_items('day').items()
+        if in_range(key)
+    }
+    models = {}
+    for key, counters in usage_ledger.scope_items('model_day').items():
+        model, _, day = key.rpartition('/')
+        if in_range(day):
+            models.setdefault(model, {})[day] = with_averages(counters)
+    return jsonify({
+        'usage': with_averages(usage_ledger.counters('total', 'all')),
+        'days': dict(sorted(days.items())),
+        'models': models,
+        'top_users': usage_ledger.top('user', 'total_tokens', limit),
+        'slowest_tasks': usage_ledger.top('task', 'mean_latency_ms', limit)
+    })
+
+
 # Reflection APIs
 @app.route('/api/reflection/questions', methods=['GET'])
 def get_reflection_questions():
@@ -888,16 +2390,177 @@ def submit_reflection():
         'task_meta': task_meta or {}
     }
     persist_result(record)
+    record_result_aggregates([record])
+    record_benchmark_scores([record])
     return jsonify({'status': 'ok'})
 
+# Fields that must match for a resubmitted client record id to count as the same record.
+_BATCH_IDENTITY_FIELDS = ('task_id', 'answers', 'iterations', 'duration')
+
+
+def _batch_item_status(record: Dict[str, Any], stored: Dict[str, Any]) -> Dict[str, Any]:
+    same = all(record.get(field) == stored.get(field) for field in _BATCH_IDENTITY_FIELDS)
+    status = {
+        'id': record['client_record_id'],
+        'status': 'duplicate' if same else 'conflict',
+        'timestamp': stored.get('timestamp'),
+        'score': stored.get('score')
+    }
+    if not same:
+        status['error'] = 'id was already used for a different record'
+    return status
+
+
+@app.route('/api/reflection/submit-batch', methods=['POST'])
+def submit_reflection_batch():
+    """Validate, score and store up to REFLECTION_BATCH_MAX_RECORDS reflections with one
+    write to results.json. Every record carries a client-supplied ``id``; sending an id the
+    user has already stored reports it as a duplicate instead of storing it twice."""
+    payload = request.get_json(silent=True) or {}
+    items = payload.get('records')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'records must be a non-empty list'}), 400
+    if len(items) > REFLECTION_BATCH_MAX_RECORDS:
+        return jsonify({'error': f'At most {REFLECTION_BATCH_MAX_RECORDS} records can be submitted at once'}), 400
+
+    plan = question_scoring.current()
+    received_at = datetime.now().isoformat()
+    known_users: Dict[str, bool] = {}
+    statuses: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    accepted: Dict[Tuple[str, str], Tuple[int, Dict[str, Any]]] = {}
+    for position, item in enumerate(items):
+        item = item if isinstance(item, dict) else {}
+        record_id = item.get('id')
+        user_id = item.get('user_id') or payload.get('user_id')
+        answers = item.get('answers', {})
+        timestamp = item.get('timestamp') or received_at
+        error = None
+        if not isinstance(record_id, str) or not record_id.strip():
+            error = 'id is required'
+        elif not user_id:
+            error = 'user_id is required'
+        elif not isinstance(answers, dict):
+            error = 'answers must be an object'
+        elif timestamp_key(timestamp) == float('-inf'):
+            error = 'timestamp must be an ISO 8601 timestamp'
+        else:
+            if user_id not in known_users:
+                known_users[user_id] = get_user(user_id) is not None
+            if not known_users[user_id]:
+                error = 'User not found'
+        if error:
+            statuses[position] = {'id': record_id, 'status': 'invalid', 'error': error}
+            continue
+
+        task_id = item.get('task_id')
+        record = {
+            'timestamp': timestamp,
+            'user_id': user_id,
+            'task_id': task_id,
+            'answers': answers,
+            'iterations': item.get('iterations'),
+            'duration': item.get('duration'),
+            'score': plan.score(answers),
+            'context': 'reflection',
+            'task_meta': item.get('task_meta') or get_task_meta(task_id, user_id) or {},
+            'client_record_id': record_id
+        }
+        key = (user_id, record_id)
+        if key in accepted:
+            statuses[position] = _batch_item_status(record, accepted[key][1])
+            continue
+        accepted[key] = (position, record)
+
+    stored = persist_results([record for _, record in accepted.values()])
+    created = []
+    for key, (position, record) in accepted.items():
+        if key in stored:
+            statuses[position] = _batch_item_status(record, stored[key])
+            continue
+        created.append(record)
+        statuses[position] = {'id': key[1], 'status': 'created', 'timestamp': record['timestamp'], 'score': record['score']}
+    if created:
+        record_result_aggregates(created)
+        record_benchmark_scores(created)
+
+    counts: Dict[str, int] = {}
+    for status in statuses:
+        counts[status['status']] = counts.get(status['status'], 0) + 1
+    for name, count in counts.items():
+        metrics.incr(f'reflection_batch.{name}', count)
+    return jsonify({'status': 'ok', 'counts': counts, 'results': statuses})
+
 @app.route('/api/reflection/results', methods=['GET'])
 def get_reflection_results():
     user_id = request.args.get('user_id')
     if not user_id:
         return jsonify({'error': 'user_id is required'}), 400
-    results = load_results(user_id=user_id)
+    bounds = {}
+    for name in ('since', 'until'):
+        value = request.args.get(name)
+        if value is None:
+            continue
+        bounds[name] = timestamp_key(value)
+        if bounds[name] == float('-inf'):
+            return jsonify({'error': f'{name} must be an ISO 8601 timestamp'}), 400
+    limit = request.args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+    results = results_index.query(
+        user_id,
+        since=bounds.get('since'),
+        until=bounds.get('until'),
+        context=request.args.get('context') or None,
+        task_id=request.args.get('task_id') or None,
+        limit=limit
+    )
     return jsonify(results)
 
+@app.route('/api/dashboard/summary', methods=['GET'])
+def dashboard_summary():
+    """Domain summaries, weekly trend, iterations histogram and prompt hack for the Clarity dashboard."""
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+    try:
+        history_limit = max(0, min(int(request.args.get('history_limit', 20)), HISTORY_KEEP))
+    except ValueError:
+        return jsonify({'error': 'history_limit must be an integer'}), 400
+    summary = summarize(load_result_aggregate(user_id), load_prompt_hacks(), datetime.now(), history_limit)
+    summary['user_id'] = user_id
+    return jsonify(summary)
+
+@app.route('/api/benchmarks/percentiles', methods=['GET'])
+def benchmark_percentiles():
+    """Where the user's latest score in each dashboard domain falls among all submissions' scores.
+
+    The sketches hold one value per submission, so the user is ranked by a single
+    submission too: for each domain, the most recent one that scored it, as kept
+    in the user's dashboard aggregate.
+    """
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+    _seed_benchmarks()
+    latest = load_result_aggregate(user_id).get('latest') or {}
+    domains = []
+    for domain in sorted(latest):
+        score, scored_at = latest[domain]['score'], latest[domain]['timestamp']
+        percentile, population = benchmark_sketches.percentile(domain, score)
+        domains.append({
+            'domain': domain,
+            'score': round(score, 2),
+            'scored_at': scored_at,
+            'percentile': round(percentile, 1) if percentile is not None else None,
+            'population': population
+        })
+    return jsonify({'user_id': user_id, 'domains': domains})
+
 @app.route('/api/baseline/questions', methods=['GET'])
 def get_baseline_questions():
     questions = load_clarity_questions()
@@ -931,17 +2594,11 @@ def submit_baseline():
     }
     score = compute_reflection_score(answers) if answers else None
     with_score = {**baseline_record, 'score': score}
+    # results.json holds the record; the onboarding index only points at it.
     persist_result(with_score)
-    persist_result(with_score, CLARITY_RESULTS_PATH)
-
-    responses = load_onboarding_responses()
-    responses[user_id] = {
-        'completed': True,
-        'completed_at': timestamp,
-        'answers': answers,
-        'score': score
-    }
-    save_onboarding_responses(responses)
+    onboarding_index.mark_completed(user_id, timestamp, {'source': 'results', 'timestamp': timestamp})
+    record_result_aggregates([with_score])
+    record_benchmark_scores([with_score])
 
     return jsonify({'status': 'ok', 'completed': True})
 
@@ -950,6 +2607,22 @@ def get_prompt_hacks():
     hacks = load_prompt_hacks()
     return jsonify({ 'hacks': hacks })
 
+job_store = JobStore(JOBS_DIR)
+running_job_tokens: Dict[str, CancellationToken] = {}
+job_runner = JobRunner(job_store, _run_generation_job, workers=int(os.environ.get('JOB_WORKERS', 4)))
+
+
+def recover_jobs() -> None:
+    job_store.prune(float(os.environ.get('JOB_RETENTION_SECONDS', 86400)))
+    for job in job_store.claim_orphans():
+        metrics.incr('jobs.recovered')
+        # Give clients a fresh abandonment window after the restart.
+        job_store.update(job['id'], last_polled_ts=time.time())
+        job_runner.submit(job)
+
+
+recover_jobs()
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5050))
     app.run(debug=False, host='0.0.0.0', port=port)
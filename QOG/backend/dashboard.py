@@ -0,0 +1,499 @@
+"""Server-side port of the Clarity dashboard calculations (src/components/ClarityDashboard.tsx).
+
+The helpers mirror normalizeAnswer, computeScore, buildDomainSummaries,
+computeWeekStats, buildHistogram and selectPromptHack, including their
+JavaScript quirks: answers go through ``Number()`` coercion, only '(+1'
+marks a positive option, "(reverse scored)" scale items are inverted and
+ties resolve by first appearance. Keep the two in sync.
+
+Instead of rescanning a user's results, each submission is folded into a
+per-user aggregate (``apply_record``) and the dashboard is summarised from
+that. Rebuild the stored aggregates from results.json with::
+
+    python dashboard.py --rebuild [--user USER_ID]
+"""
+import argparse
+import json
+import math
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+EXCLUDED_DOMAINS = frozenset({'Analogical', 'Reliance'})
+REASONING_DOMAINS = ('Inductive', 'Deductive', 'Analytical', 'Critical', 'Flexibility')
+WEEK_MS = 7 * 24 * 60 * 60 * 1000
+HISTOGRAM_BUCKETS = 6
+HISTORY_KEEP = 100
+AGGREGATE_FORMAT = 2
+
+# qid -> ('likert', min, max, reverse) or ('mcq', single)
+Rule = Tuple[Any, ...]
+
+
+def js_number(value: Any) -> float:
+    """JavaScript ``Number(value)`` for JSON values."""
+    if value is None:
+        return 0.0
+    if isinstance(value, bool):
+        return 1.0 if value else 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        text = value.strip()
+        if not text:
+            return 0.0
+        if text in ('Infinity', '+Infinity', '-Infinity'):
+            return -math.inf if text.startswith('-') else math.inf
+        lowered = text.lower()
+        if lowered.startswith(('0x', '0o', '0b')):
+            try:
+                return float(int(text, 0))
+            except ValueError:
+                return math.nan
+        if 'inf' in lowered or 'nan' in lowered or '_' in text:
+            return math.nan
+        try:
+            return float(text)
+        except ValueError:
+            return math.nan
+    if isinstance(value, list):
+        if not value:
+            return 0.0
+        if len(value) == 1:
+            # Number([x]) is Number(String(x)).
+            item = value[0]
+            if item is None:
+                return 0.0
+            if isinstance(item, (str, int, float)) and not isinstance(item, bool):
+                return js_number(str(item))
+        return math.nan
+    return math.nan
+
+
+def js_round2(value: float) -> float:
+    """``Math.round(value * 100) / 100``."""
+    return math.floor(value * 100 + 0.5) / 100
+
+
+def _is_positive_option(option: Any) -> bool:
+    return isinstance(option, str) and '(+1' in option
+
+
+def _is_reverse_scored(question: Dict[str, Any]) -> bool:
+    return 'reverse scored' in f"{question.get('title') or ''} {question.get('question') or ''}".lower()
+
+
+def _timestamp_ms(value: Any) -> Optional[float]:
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp() * 1000
+    except ValueError:
+        return None
+
+
+def _number_or_zero(value: Any) -> float:
+    """``value ?? 0`` for fields that hold numbers."""
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+class DashboardRules:
+    """The question bank compiled into per-question normalisation rules."""
+
+    def __init__(self, questions: List[Dict[str, Any]], version: Any = None):
+        self.version = version
+        self.rules: Dict[str, Optional[Rule]] = {}
+        self.domains: Dict[str, str] = {}
+        for question in questions or []:
+            if not isinstance(question, dict):
+                continue
+            qid = question.get('id')
+            qtype = question.get('type')
+            rule: Optional[Rule] = None
+            if qtype == 'scale':
+                scale = question.get('scale') if isinstance(question.get('scale'), dict) else {}
+                low = scale.get('min')
+                high = scale.get('max')
+                rule = (
+                    'likert',
+                    js_number(1 if low is None else low),
+                    js_number(5 if high is None else high),
+                    _is_reverse_scored(question)
+                )
+            elif qtype in ('single', 'multi'):
+                rule = ('mcq', qtype == 'single')
+            self.rules[qid] = rule
+            domain = question.get('domain')
+            if domain:
+                self.domains[qid] = domain
+            else:
+                self.domains.pop(qid, None)
+
+    def normalize(self, qid: str, answer: Any) -> Optional[Tuple[float, str]]:
+        rule = self.rules.get(qid)
+        if rule is None:
+            return None
+        if rule[0] == 'likert':
+            _, low, high, reverse = rule
+            value = js_number(answer)
+            if not math.isfinite(value) or high <= low:
+                return None
+            normalized = min(1.0, max(0.0, (value - low) / (high - low)))
+            adjusted = 1 - normalized if reverse else normalized
+            return min(1.0, max(0.0, adjusted)) * 100, 'likert'
+        if rule[1]:
+            selected = [answer] if isinstance(answer, str) else []
+        else:
+            selected = answer if isinstance(answer, list) else []
+        if not selected:
+            return 0.0, 'mcq'
+        positives = sum(1 for item in selected if _is_positive_option(item))
+        return (positives / len(selected)) * 100, 'mcq'
+
+    def compute_score(self, answers: Any) -> Dict[str, Any]:
+        likert: List[float] = []
+        mcq: List[float] = []
+        for qid, value in (answers.items() if isinstance(answers, dict) else ()):
+            normalized = self.normalize(qid, value)
+            if normalized is None:
+                continue
+            (likert if normalized[1] == 'likert' else mcq).append(normalized[0])
+        likert_mean = sum(likert) / len(likert) if likert else None
+        mcq_mean = sum(mcq) / len(mcq) if mcq else None
+        if likert_mean is not None and mcq_mean is not None:
+            overall = (likert_mean + mcq_mean) / 2
+        else:
+            overall = likert_mean if likert_mean is not None else (mcq_mean if mcq_mean is not None else 0)
+        return {
+            'overall': js_round2(overall),
+            'likert_mean': js_round2(likert_mean) if likert_mean is not None else None,
+            'mcq_mean': js_round2(mcq_mean) if mcq_mean is not None else None,
+            'likert_count': len(likert),
+            'mcq_count': len(mcq)
+        }
+
+
+def _day(timestamp: Any) -> Optional[str]:
+    ts = _timestamp_ms(timestamp)
+    return datetime.fromtimestamp(ts / 1000).strftime('%Y-%m-%d') if ts is not None else None
+
+
+def _empty_day() -> Dict[str, Any]:
+    return {'reflections': 0, 'scored': 0, 'overall_sum': 0, 'duration_sum': 0, 'iterations_sum': 0}
+
+
+def new_aggregate(questions_version: Any) -> Dict[str, Any]:
+    """Running totals behind a user's dashboard.
+
+    ``domains`` keeps per-domain Likert/MCQ sums in first-seen order (the
+    dashboard breaks ties by that order), ``days`` buckets reflections by
+    local calendar day, ``iterations`` counts reflections per iteration
+    count and ``history`` keeps the newest rows. ``latest`` holds, per
+    domain, the score and timestamp of the newest result that scored it
+    (ties go to the later record), which is what benchmark percentiles
+    rank. Sums are accumulated in stored record order, so means match the
+    dashboard's reduce() exactly.
+    """
+    return {
+        'format': AGGREGATE_FORMAT,
+        'questions_version': questions_version,
+        'records': 0,
+        'reflections': 0,
+        'overall_sum': 0,
+        'reflection_iterations_sum': 0,
+        'domains': {},
+        'days': {},
+        'iterations': {},
+        'history': [],
+        'latest': {}
+    }
+
+
+def _newer_or_equal(ts: Optional[float], other: Optional[float]) -> bool:
+    # Undated results sort before dated ones, as in the results index.
+    return other is None or (ts is not None and ts >= other)
+
+
+def apply_record(aggregate: Dict[str, Any], record: Dict[str, Any], rules: DashboardRules) -> None:
+    """Fold one stored result into ``aggregate``; O(answers)."""
+    score = record.get('score')
+    if score is None:
+        score = rules.compute_score(record.get('answers'))
+    overall = score.get('overall') if isinstance(score, dict) else None
+    aggregate['records'] += 1
+    aggregate['overall_sum'] += _number_or_zero(overall)
+
+    answers = record.get('answers')
+    domains = aggregate['domains']
+    for qid, value in (answers.items() if isinstance(answers, dict) else ()):
+        domain = rules.domains.get(qid)
+        if not domain or domain in EXCLUDED_DOMAINS:
+            continue
+        normalized = rules.normalize(qid, value)
+        if normalized is None:
+            continue
+        entry = domains.get(domain)
+        if entry is None:
+            entry = domains[domain] = {'likert_sum': 0, 'likert_count': 0, 'mcq_sum': 0, 'mcq_count': 0, 'responses': 0}
+        kind = normalized[1]
+        entry[f'{kind}_sum'] += normalized[0]
+        entry[f'{kind}_count'] += 1
+        entry['responses'] += 1
+
+    record_ts = _timestamp_ms(record.get('timestamp'))
+    latest = aggregate['latest']
+    for domain, domain_score in record_domain_scores(record, rules).items():
+        previous = latest.get(domain)
+        if previous is None or _newer_or_equal(record_ts, _timestamp_ms(previous['timestamp'])):
+            latest[domain] = {'score': domain_score, 'timestamp': record.get('timestamp')}
+
+    if record.get('context') != 'baseline':
+        iterations = _number_or_zero(record.get('iterations'))
+        aggregate['reflections'] += 1
+        aggregate['reflection_iterations_sum'] += iterations
+        # 2 and 2.0 are one Map key in the dashboard.
+        key = json.dumps(int(iterations) if isinstance(iterations, float) and iterations.is_integer() else iterations)
+        aggregate['iterations'][key] = aggregate['iterations'].get(key, 0) + 1
+        day = _day(record.get('timestamp'))
+        if day is not None:
+            bucket = aggregate['days'].get(day)
+            if bucket is None:
+                bucket = aggregate['days'][day] = _empty_day()
+            bucket['reflections'] += 1
+            if isinstance(overall, (int, float)) and not isinstance(overall, bool):
+                bucket['scored'] += 1
+                bucket['overall_sum'] += overall
+            bucket['duration_sum'] += _number_or_zero(record.get('duration'))
+            bucket['iterations_sum'] += iterations
+
+    row = history_row({**record, 'score': score})
+    history = aggregate['history']
+    row_ts = _timestamp_ms(row['timestamp']) or 0
+    position = 0
+    while position < len(history) and (_timestamp_ms(history[position]['timestamp']) or 0) >= row_ts:
+        position += 1
+    if position < HISTORY_KEEP:
+        history.insert(position, row)
+        del history[HISTORY_KEEP:]
+
+
+def build_aggregate(records: List[Dict[str, Any]], rules: DashboardRules) -> Dict[str, Any]:
+    """Recompute a user's aggregate from their stored results (recovery path)."""
+    aggregate = new_aggregate(rules.version)
+    for record in records:
+        if isinstance(record, dict):
+            apply_record(aggregate, record, rules)
+    return aggregate
+
+
+def record_domain_scores(record: Dict[str, Any], rules: DashboardRules) -> Dict[str, float]:
+    """One result's per-domain overall, combined the way domain summaries are."""
+    sums: Dict[str, List[float]] = {}
+    answers = record.get('answers')
+    for qid, value in (answers.items() if isinstance(answers, dict) else ()):
+        domain = rules.domains.get(qid)
+        if not domain or domain in EXCLUDED_DOMAINS:
+            continue
+        normalized = rules.normalize(qid, value)
+        if normalized is None:
+            continue
+        entry = sums.setdefault(domain, [0.0, 0, 0.0, 0])
+        offset = 0 if normalized[1] == 'likert' else 2
+        entry[offset] += normalized[0]
+        entry[offset + 1] += 1
+    scores = {}
+    for domain, (likert_sum, likert_count, mcq_sum, mcq_count) in sums.items():
+        likert = likert_sum / likert_count if likert_count else None
+        mcq = mcq_sum / mcq_count if mcq_count else None
+        scores[domain] = (likert + mcq) / 2 if likert is not None and mcq is not None else (
+            likert if likert is not None else mcq)
+    return scores
+
+
+def _domain_summaries(aggregate: Dict[str, Any]) -> List[Dict[str, Any]]:
+    summaries = []
+    for domain, entry in aggregate['domains'].items():
+        likert = entry['likert_sum'] / entry['likert_count'] if entry['likert_count'] else None
+        mcq = entry['mcq_sum'] / entry['mcq_count'] if entry['mcq_count'] else None
+        if likert is not None and mcq is not None:
+            overall = (likert + mcq) / 2
+        else:
+            overall = likert if likert is not None else (mcq if mcq is not None else 0)
+        summaries.append({'domain': domain, 'overall': overall, 'likert': likert, 'mcq': mcq, 'responses': entry['responses']})
+    return summaries
+
+
+def _week_totals_from_rows(rows: List[Dict[str, Any]], now_ms: float) -> List[Dict[str, Any]]:
+    start_current = now_ms - WEEK_MS
+    start_previous = now_ms - WEEK_MS * 2
+    totals = [_empty_day(), _empty_day()]
+    for row in rows:
+        if row.get('context') == 'baseline':
+            continue
+        ts = _timestamp_ms(row.get('timestamp'))
+        if ts is None or ts < start_previous:
+            continue
+        total = totals[0] if ts >= start_current else totals[1]
+        total['reflections'] += 1
+        overall = row.get('overall')
+        if isinstance(overall, (int, float)) and not isinstance(overall, bool):
+            total['scored'] += 1
+            total['overall_sum'] += overall
+        total['duration_sum'] += _number_or_zero(row.get('duration'))
+        total['iterations_sum'] += _number_or_zero(row.get('iterations'))
+    return totals
+
+
+def _week_totals_from_days(aggregate: Dict[str, Any], now: datetime) -> List[Dict[str, Any]]:
+    totals = []
+    for start, end in ((0, 7), (7, 14)):
+        total = _empty_day()
+        for offset in range(start, end):
+            bucket = aggregate['days'].get((now - timedelta(days=offset)).strftime('%Y-%m-%d'))
+            if bucket:
+                for field in total:
+                    total[field] += bucket[field]
+        totals.append(total)
+    return totals
+
+
+def _week_stats(aggregate: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+    """computeWeekStats: the last 7 x 24h against the 7 x 24h before.
+
+    When the kept history rows reach back past that window they give the
+    dashboard's exact numbers; otherwise (very active users) the day buckets
+    are used, with weeks cut at local midnight.
+    """
+    now_ms = now.timestamp() * 1000
+    history = aggregate['history']
+    if len(history) == aggregate['records'] or (
+        history and (_timestamp_ms(history[-1]['timestamp']) or 0) < now_ms - WEEK_MS * 2
+    ):
+        current, previous = _week_totals_from_rows(history, now_ms)
+    else:
+        current, previous = _week_totals_from_days(aggregate, now)
+    current_avg = current['overall_sum'] / current['scored'] if current['scored'] else 0
+    previous_avg = previous['overall_sum'] / previous['scored'] if previous['scored'] else 0
+    return {
+        'current_avg': current_avg,
+        'previous_avg': previous_avg,
+        'delta': current_avg - previous_avg,
+        'duration_seconds': current['duration_sum'],
+        'iterations_avg': current['iterations_sum'] / current['reflections'] if current['reflections'] else 0,
+        'sample_count': current['reflections']
+    }
+
+
+def _histogram(aggregate: Dict[str, Any]) -> List[List[Any]]:
+    buckets = sorted((json.loads(key), count) for key, count in aggregate['iterations'].items())
+    return [[key, count] for key, count in buckets[:HISTOGRAM_BUCKETS]]
+
+
+def select_prompt_hack(summaries: List[Dict[str, Any]], hacks: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    hacks = [hack for hack in hacks if isinstance(hack, dict) and hack.get('domain') not in EXCLUDED_DOMAINS]
+    if not summaries or not hacks:
+        return None
+    weakest = summaries[0]
+    for summary in summaries[1:]:
+        if summary['overall'] < weakest['overall']:
+            weakest = summary
+    return next((hack for hack in hacks if hack.get('domain') == weakest['domain']), hacks[0])
+
+
+def select_top_domain(summaries: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not summaries:
+        return None
+    best = summaries[0]
+    for summary in summaries:
+        if summary['domain'] in REASONING_DOMAINS and summary['overall'] > best['overall']:
+            best = summary
+    return best
+
+
+def history_row(record: Dict[str, Any]) -> Dict[str, Any]:
+    task_meta = record.get('task_meta') if isinstance(record.get('task_meta'), dict) else {}
+    score = record.get('score') if isinstance(record.get('score'), dict) else {}
+    return {
+        'timestamp': record.get('timestamp'),
+        'context': record.get('context'),
+        'task_id': record.get('task_id'),
+        'task_name': task_meta.get('name'),
+        'category': task_meta.get('category'),
+        'overall': score.get('overall'),
+        'iterations': record.get('iterations'),
+        'duration': record.get('duration')
+    }
+
+
+def summarize(
+    aggregate: Dict[str, Any],
+    hacks: List[Dict[str, Any]],
+    now: datetime,
+    history_limit: int = 20,
+) -> Dict[str, Any]:
+    """Everything the dashboard derives from a user's results, in O(domains + days in two weeks)."""
+    summaries = _domain_summaries(aggregate)
+    return {
+        'questions_version': aggregate['questions_version'],
+        'record_count': aggregate['records'],
+        'reflection_count': aggregate['reflections'],
+        'overall_average': aggregate['overall_sum'] / aggregate['records'] if aggregate['records'] else 0,
+        'iterations_average': (
+            aggregate['reflection_iterations_sum'] / aggregate['reflections'] if aggregate['reflections'] else 0
+        ),
+        'domains': summaries,
+        'top_domain': select_top_domain(summaries),
+        'week': _week_stats(aggregate, now),
+        'iterations_histogram': _histogram(aggregate),
+        'prompt_hack': select_prompt_hack(summaries, hacks),
+        'history': aggregate['history'][:max(0, history_limit)]
+    }
+
+
+def _write_atomic(path: str, payload: Any) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def rebuild_aggregates(data_dir: str, user_id: Optional[str] = None) -> Dict[str, int]:
+    """Recompute ``result_aggregates/<user>.json`` from ``results.json``; returns records per user."""
+    with open(os.path.join(data_dir, 'questions.json'), 'r') as f:
+        bank = json.load(f)
+    rules = DashboardRules(bank.get('questions') or [], bank.get('version'))
+    try:
+        with open(os.path.join(data_dir, 'results.json'), 'r') as f:
+            records = json.load(f)
+    except FileNotFoundError:
+        records = []
+    by_user: Dict[str, List[Dict[str, Any]]] = {}
+    for record in records if isinstance(records, list) else []:
+        if isinstance(record, dict) and record.get('user_id') and (user_id is None or record['user_id'] == user_id):
+            record.setdefault('context', 'reflection')
+            by_user.setdefault(record['user_id'], []).append(record)
+    if user_id is not None:
+        by_user.setdefault(user_id, [])
+    for uid, user_records in by_user.items():
+        _write_atomic(os.path.join(data_dir, 'result_aggregates', f'{uid}.json'), build_aggregate(user_records, rules))
+    return {uid: len(user_records) for uid, user_records in by_user.items()}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Clarity dashboard aggregates')
+    parser.add_argument('--rebuild', action='store_true', help='recompute stored aggregates from results.json')
+    parser.add_argument('--user', help='only rebuild this user')
+    parser.add_argument('--data-dir', default=os.environ.get('DATA_DIR', os.path.dirname(os.path.abspath(__file__))))
+    args = parser.parse_args(argv)
+    if not args.rebuild:
+        parser.print_help()
+        return 0
+    counts = rebuild_aggregates(args.data_dir, args.user)
+    print(f'rebuilt {len(counts)} aggregates from {sum(counts.values())} results')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,221 @@
+import base64
+import json
+import os
+import time
+from collections import OrderedDict
+from threading import Event, Lock
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows dev machines
+    fcntl = None
+
+
+class IdempotencyEntry:
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.created_at = time.time()
+        self.done = Event()
+        self.status: Optional[int] = None
+        self.body: Optional[bytes] = None
+        self.headers: Dict[str, str] = {}
+
+    @property
+    def has_response(self) -> bool:
+        return self.status is not None
+
+
+class IdempotencyStore:
+    """Maps idempotency keys to the outcome of the first request that used them.
+
+    Entries live in this process only, so retries that land on another worker
+    process run again; use ``FileIdempotencyStore`` when running several.
+
+    ``begin`` returns one of:
+    - ``'new'``: the caller owns the key and must call ``finish``.
+    - ``'pending'``: the original request is still running; call ``wait``.
+    - ``'replay'``: the stored response should be returned as-is.
+    - ``'conflict'``: the key was reused with a different payload.
+    """
+
+    def __init__(self, ttl_seconds: float = 600.0):
+        self.ttl_seconds = float(ttl_seconds)
+        self._entries: 'OrderedDict[str, IdempotencyEntry]' = OrderedDict()
+        self._lock = Lock()
+
+    def _evict_expired(self, now: float) -> None:
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry.created_at <= self.ttl_seconds or not entry.done.is_set():
+                break
+            self._entries.pop(key)
+
+    def begin(self, key: str, fingerprint: str) -> Tuple[str, IdempotencyEntry]:
+        with self._lock:
+            self._evict_expired(time.time())
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = IdempotencyEntry(fingerprint)
+                self._entries[key] = entry
+                return 'new', entry
+            if entry.fingerprint != fingerprint:
+                return 'conflict', entry
+            if entry.done.is_set():
+                return 'replay', entry
+            return 'pending', entry
+
+    def finish(
+        self,
+        key: str,
+        entry: IdempotencyEntry,
+        status: Optional[int],
+        body: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None,
+        keep: bool = True,
+    ) -> None:
+        """Store the outcome and wake waiters.
+
+        With ``keep=False`` (server errors, crashes) the outcome is still shared
+        with requests already waiting, but the key is released so a later retry
+        runs again.
+        """
+        entry.status = status
+        entry.body = body
+        entry.headers = dict(headers or {})
+        with self._lock:
+            if not keep and self._entries.get(key) is entry:
+                self._entries.pop(key)
+        entry.done.set()
+
+    def wait(self, key: str, entry: IdempotencyEntry, timeout: float) -> bool:
+        """Block until the request that owns ``key`` finishes; True if it left a response."""
+        return entry.done.wait(timeout) and entry.has_response
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class FileIdempotencyStore:
+    """``IdempotencyStore`` semantics shared by every worker process through a locked JSON file.
+
+    Waiters in other processes poll the file until the owner records its
+    outcome. A released key (``keep=False``) keeps its outcome for those
+    waiters but counts as unused for ``begin``. Pending entries whose owner
+    died are dropped once they are older than the TTL.
+    """
+
+    POLL_SECONDS = 0.1
+
+    def __init__(self, path: str, ttl_seconds: float = 600.0):
+        self.path = path
+        self.ttl_seconds = float(ttl_seconds)
+        self._lock = Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _load(self, handle) -> Dict[str, Dict[str, Any]]:
+        handle.seek(0)
+        raw = handle.read()
+        try:
+            data = json.loads(raw) if raw else {}
+        except ValueError:
+            data = {}
+        return data if isinstance(data, dict) else {}
+
+    def _update(self, mutate):
+        """Run ``mutate(entries, now)`` under the file lock and save the result."""
+        with self._lock, open(self.path, 'a+') as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                entries = {
+                    key: stored for key, stored in self._load(handle).items()
+                    if isinstance(stored, dict) and now - float(stored.get('created_at') or 0) <= self.ttl_seconds
+                }
+                result = mutate(entries, now)
+                handle.seek(0)
+                handle.truncate()
+                json.dump(entries, handle)
+                handle.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+        return result
+
+    @staticmethod
+    def _fill(entry: IdempotencyEntry, stored: Dict[str, Any]) -> None:
+        entry.status = stored.get('status')
+        entry.body = base64.b64decode(stored['body']) if stored.get('body') is not None else None
+        entry.headers = dict(stored.get('headers') or {})
+        entry.done.set()
+
+    def begin(self, key: str, fingerprint: str) -> Tuple[str, IdempotencyEntry]:
+        def mutate(entries, now):
+            stored = entries.get(key)
+            if stored is None or stored.get('released'):
+                entries[key] = {'fingerprint': fingerprint, 'created_at': now, 'done': False}
+                entry = IdempotencyEntry(fingerprint)
+                entry.created_at = now
+                return 'new', entry
+            entry = IdempotencyEntry(stored.get('fingerprint'))
+            entry.created_at = float(stored.get('created_at') or now)
+            if stored.get('fingerprint') != fingerprint:
+                return 'conflict', entry
+            if stored.get('done'):
+                self._fill(entry, stored)
+                return 'replay', entry
+            return 'pending', entry
+        return self._update(mutate)
+
+    def finish(
+        self,
+        key: str,
+        entry: IdempotencyEntry,
+        status: Optional[int],
+        body: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None,
+        keep: bool = True,
+    ) -> None:
+        entry.status = status
+        entry.body = body
+        entry.headers = dict(headers or {})
+
+        def mutate(entries, now):
+            stored = entries.get(key)
+            if stored is None or stored.get('done') or stored.get('created_at') != entry.created_at:
+                return
+            stored.update({
+                'done': True,
+                'released': not keep,
+                'status': status,
+                'body': base64.b64encode(body).decode('ascii') if body is not None else None,
+                'headers': entry.headers,
+            })
+        self._update(mutate)
+        entry.done.set()
+
+    def wait(self, key: str, entry: IdempotencyEntry, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock, open(self.path, 'a+') as handle:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_SH)
+                try:
+                    stored = self._load(handle).get(key)
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(handle, fcntl.LOCK_UN)
+            if stored is None or stored.get('fingerprint') != entry.fingerprint:
+                # Expired or taken over after the owner died without an outcome.
+                return False
+            if stored.get('done'):
+                self._fill(entry, stored)
+                return entry.has_response
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.POLL_SECONDS)
+
+    def __len__(self) -> int:
+        return self._update(lambda entries, now: len(entries))
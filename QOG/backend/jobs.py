@@ -0,0 +1,199 @@
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional
+from uuid import uuid4
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows dev machines
+    fcntl = None
+
+
+ACTIVE_STATUSES = ('queued', 'running')
+_JOB_ID_PATTERN = re.compile(r'^job-[0-9a-f]{32}$')
+
+
+class JobStore:
+    """One JSON file per generation job under ``directory``.
+
+    Files are replaced atomically, so any worker process can read a job's state.
+    Every read-modify-write holds an flock on ``.lock``, so workers cannot lose
+    each other's updates. Each store takes a random instance id and holds an
+    exclusive flock on ``.instances/<id>.lock`` for as long as its process
+    lives. Jobs are stamped with that id, so queued or running jobs whose
+    instance lock is free belong to a dead process and can be reclaimed. PIDs
+    are not used for this: they repeat after a container restart.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.instance_id = uuid4().hex
+        self._lock = Lock()
+        self._instances_dir = os.path.join(directory, '.instances')
+        os.makedirs(self._instances_dir, exist_ok=True)
+        # Held (never closed) for the life of the process; the OS drops it on exit.
+        self._instance_handle = open(self._instance_lock_path(self.instance_id), 'a')
+        if fcntl is not None:
+            fcntl.flock(self._instance_handle, fcntl.LOCK_EX)
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f'{job_id}.json')
+
+    def _instance_lock_path(self, instance_id: str) -> str:
+        return os.path.join(self._instances_dir, f'{instance_id}.lock')
+
+    def _instance_alive(self, instance_id: Optional[str]) -> bool:
+        if not instance_id or not re.match(r'^[0-9a-f]{32}$', str(instance_id)):
+            return False
+        if instance_id == self.instance_id:
+            return True
+        if fcntl is None:
+            # No way to probe another process's lock; assume it is still running.
+            return True
+        path = self._instance_lock_path(instance_id)
+        if not os.path.exists(path):
+            return False
+        with open(path, 'a') as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(handle, fcntl.LOCK_UN)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return False
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, open(os.path.join(self.directory, '.lock'), 'a') as lock_handle:
+            if fcntl is not None:
+                fcntl.flock(lock_handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_handle, fcntl.LOCK_UN)
+
+    def _write(self, job: Dict[str, Any]) -> None:
+        path = self._path(job['id'])
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def _read(self, job_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(job_id), 'r') as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return job if isinstance(job, dict) else None
+
+    def create(self, kind: str, user_id: str, task_id: str, params: Dict[str, Any], **fields: Any) -> Dict[str, Any]:
+        now = datetime.now().isoformat()
+        job = {
+            'id': f'job-{uuid4().hex}',
+            'kind': kind,
+            'status': 'queued',
+            'user_id': user_id,
+            'task_id': task_id,
+            'params': params,
+            'result': None,
+            'error': None,
+            'worker_pid': os.getpid(),
+            'worker_instance': self.instance_id,
+            'created_at': now,
+            'updated_at': now,
+            **fields
+        }
+        with self._locked():
+            self._write(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if not job_id or not _JOB_ID_PATTERN.match(job_id):
+            return None
+        return self._read(job_id)
+
+    def update(self, job_id: str, **fields: Any) -> Optional[Dict[str, Any]]:
+        with self._locked():
+            job = self._read(job_id)
+            if job is None:
+                return None
+            job.update(fields)
+            job['updated_at'] = datetime.now().isoformat()
+            self._write(job)
+            return job
+
+    def _job_ids(self) -> List[str]:
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return [name[:-5] for name in names if name.endswith('.json') and _JOB_ID_PATTERN.match(name[:-5])]
+
+    def claim_orphans(self) -> List[Dict[str, Any]]:
+        """Take over queued/running jobs whose worker instance is gone."""
+        claimed = []
+        with self._locked():
+            for job_id in self._job_ids():
+                job = self._read(job_id)
+                if not job or job.get('status') not in ACTIVE_STATUSES:
+                    continue
+                if self._instance_alive(job.get('worker_instance')):
+                    continue
+                job['status'] = 'queued'
+                job['worker_pid'] = os.getpid()
+                job['worker_instance'] = self.instance_id
+                job['recovered'] = int(job.get('recovered') or 0) + 1
+                job['updated_at'] = datetime.now().isoformat()
+                self._write(job)
+                claimed.append(job)
+        return claimed
+
+    def prune(self, retention_seconds: float) -> int:
+        cutoff = time.time() - retention_seconds
+        removed = 0
+        for job_id in self._job_ids():
+            path = self._path(job_id)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+            except OSError:
+                continue
+            job = self._read(job_id)
+            if job and job.get('status') in ACTIVE_STATUSES:
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+
+class JobRunner:
+    def __init__(self, store: JobStore, handler: Callable[[Dict[str, Any]], None], workers: int = 4):
+        self.store = store
+        self.handler = handler
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix='job')
+
+    def submit(self, job: Dict[str, Any]) -> None:
+        self._executor.submit(self._run, job['id'])
+
+    def _run(self, job_id: str) -> None:
+        job = self.store.update(job_id, status='running', worker_pid=os.getpid(), worker_instance=self.store.instance_id)
+        if job is None:
+            return
+        try:
+            self.handler(job)
+        except Exception as error:
+            self.store.update(job_id, status='failed', error={'message': str(error), 'status': 500})
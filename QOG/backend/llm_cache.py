@@ -0,0 +1,297 @@
+import hashlib
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from text_index import hashed_features
+
+
+def make_cache_key(contents: Any, generation_config: Any, model_name: str = '') -> str:
+    payload = json.dumps(
+        {'model': model_name, 'contents': contents, 'config': generation_config},
+        sort_keys=True,
+        separators=(',', ':'),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Exact-match LRU cache for model replies with a TTL and optional disk tier.
+
+    Memory entries are ``key -> (stored_at, text)``. When ``disk_dir`` is set,
+    every stored reply is also written to ``<disk_dir>/<key[:2]>/<key>.json`` so
+    it survives restarts and can be shared between workers on the same volume.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 600.0, disk_dir: Optional[str] = None):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = float(ttl_seconds)
+        self.disk_dir = disk_dir or None
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - stored_at > self.ttl_seconds
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f'{key}.json')
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, text = entry
+                if not self._expired(stored_at, now):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return {'text': text, 'age_seconds': round(now - stored_at, 3), 'tier': 'memory'}
+                del self._entries[key]
+        disk_entry = self._read_disk(key, now)
+        with self._lock:
+            if disk_entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._insert(key, disk_entry['stored_at'], disk_entry['text'])
+        return {
+            'text': disk_entry['text'],
+            'age_seconds': round(now - disk_entry['stored_at'], 3),
+            'tier': 'disk'
+        }
+
+    def put(self, key: str, text: str) -> None:
+        if not text:
+            return
+        stored_at = time.time()
+        with self._lock:
+            self._insert(key, stored_at, text)
+        self._write_disk(key, stored_at, text)
+
+    def _insert(self, key: str, stored_at: float, text: str) -> None:
+        self._entries[key] = (stored_at, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _read_disk(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except Exception:
+            return None
+        if not isinstance(entry, dict) or not entry.get('text'):
+            return None
+        stored_at = float(entry.get('stored_at') or 0)
+        if self._expired(stored_at, now):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return {'stored_at': stored_at, 'text': entry['text']}
+
+    def _write_disk(self, key: str, stored_at: float, text: str) -> None:
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump({'stored_at': stored_at, 'text': text}, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'disk_enabled': bool(self.disk_dir),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses
+            }
+
+
+class SemanticEntry:
+    def __init__(
+        self,
+        entry_id: int,
+        scope: str,
+        question: str,
+        answer: str,
+        features: Dict[int, float],
+        signatures: List[int],
+        meta: Dict[str, Any],
+    ):
+        self.id = entry_id
+        self.scope = scope
+        self.question = question
+        self.answer = answer
+        self.features = features
+        self.signatures = signatures
+        self.meta = meta
+        self.stored_at = time.time()
+
+
+class SemanticCache:
+    """Reuses answers to near-duplicate questions.
+
+    Questions are embedded as hashed n-gram term-frequency vectors and bucketed
+    with random-hyperplane LSH (``tables`` tables of ``bits`` bits each).
+    Candidates sharing a bucket in any table are re-ranked by exact TF-IDF
+    cosine, with IDF taken from the cached questions; the best one at or above
+    ``threshold`` is returned. Entries live in a scope (e.g. ``user:<id>`` or
+    ``global``) and are evicted LRU once ``max_entries`` is reached or after
+    ``ttl_seconds``.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        max_entries: int = 2048,
+        ttl_seconds: float = 86400.0,
+        dim: int = 2048,
+        tables: int = 16,
+        bits: int = 10,
+        seed: int = 7,
+    ):
+        self.threshold = float(threshold)
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = float(ttl_seconds)
+        self.dim = int(dim)
+        self.tables = max(1, int(tables))
+        self.bits = max(1, min(62, int(bits)))
+        rng = np.random.default_rng(seed)
+        self._planes = rng.standard_normal((self.tables * self.bits, self.dim)).astype(np.float32)
+        self._bit_weights = (1 << np.arange(self.bits, dtype=np.int64))
+        self._entries: 'OrderedDict[int, SemanticEntry]' = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, int], set] = {}
+        self._df: Dict[int, int] = {}
+        self._next_id = 0
+        self._lock = Lock()
+        self.lookups = 0
+        self.hits: Dict[str, int] = {}
+        self.evictions = 0
+
+    def _signatures(self, features: Dict[int, float]) -> List[int]:
+        buckets = np.fromiter(features.keys(), dtype=np.int64, count=len(features))
+        weights = np.fromiter(features.values(), dtype=np.float32, count=len(features))
+        projections = self._planes[:, buckets] @ weights
+        bits = (projections > 0).reshape(self.tables, self.bits).astype(np.int64)
+        return [int(value) for value in bits @ self._bit_weights]
+
+    def _cosine(self, left: Dict[int, float], right: Dict[int, float]) -> float:
+        total = len(self._entries) + 1
+        def idf(bucket: int) -> float:
+            return math.log((1.0 + total) / (1.0 + self._df.get(bucket, 0))) + 1.0
+        weighted_left = {bucket: value * idf(bucket) for bucket, value in left.items()}
+        weighted_right = {bucket: value * idf(bucket) for bucket, value in right.items()}
+        dot = sum(value * weighted_right.get(bucket, 0.0) for bucket, value in weighted_left.items())
+        norm = math.sqrt(sum(v * v for v in weighted_left.values())) * math.sqrt(sum(v * v for v in weighted_right.values()))
+        return dot / norm if norm else 0.0
+
+    def _expired(self, entry: SemanticEntry, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - entry.stored_at > self.ttl_seconds
+
+    def _remove(self, entry: SemanticEntry) -> None:
+        self._entries.pop(entry.id, None)
+        for table, signature in enumerate(entry.signatures):
+            members = self._buckets.get((entry.scope, table, signature))
+            if members is not None:
+                members.discard(entry.id)
+                if not members:
+                    del self._buckets[(entry.scope, table, signature)]
+        for bucket in entry.features:
+            remaining = self._df.get(bucket, 0) - 1
+            if remaining > 0:
+                self._df[bucket] = remaining
+            else:
+                self._df.pop(bucket, None)
+
+    def lookup(self, question: str, scopes: List[str]) -> Optional[Dict[str, Any]]:
+        """Best cached answer in the first scope that has one above the threshold."""
+        features = hashed_features(question, self.dim)
+        if not features:
+            return None
+        signatures = self._signatures(features)
+        now = time.time()
+        with self._lock:
+            self.lookups += 1
+            for scope in scopes:
+                candidate_ids = set()
+                for table, signature in enumerate(signatures):
+                    candidate_ids |= self._buckets.get((scope, table, signature), set())
+                best = None
+                best_score = self.threshold
+                for entry_id in candidate_ids:
+                    entry = self._entries.get(entry_id)
+                    if entry is None:
+                        continue
+                    if self._expired(entry, now):
+                        self._remove(entry)
+                        continue
+                    score = self._cosine(features, entry.features)
+                    if score >= best_score:
+                        best, best_score = entry, score
+                if best is not None:
+                    self._entries.move_to_end(best.id)
+                    kind = scope.split(':', 1)[0]
+                    self.hits[kind] = self.hits.get(kind, 0) + 1
+                    return {
+                        'text': best.answer,
+                        'similarity': round(best_score, 4),
+                        'scope': kind,
+                        'age_seconds': round(now - best.stored_at, 3),
+                        'meta': dict(best.meta)
+                    }
+        return None
+
+    def put(self, question: str, answer: str, scopes: List[str], meta: Optional[Dict[str, Any]] = None) -> None:
+        features = hashed_features(question, self.dim)
+        if not features or not answer:
+            return
+        signatures = self._signatures(features)
+        with self._lock:
+            for scope in scopes:
+                entry = SemanticEntry(self._next_id, scope, question, answer, features, signatures, dict(meta or {}))
+                self._next_id += 1
+                self._entries[entry.id] = entry
+                for table, signature in enumerate(signatures):
+                    self._buckets.setdefault((scope, table, signature), set()).add(entry.id)
+                for bucket in features:
+                    self._df[bucket] = self._df.get(bucket, 0) + 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries.values())))
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = sum(self.hits.values())
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'lookups': self.lookups,
+                'hits': hits,
+                'hits_by_scope': dict(self.hits),
+                'hit_rate': round(hits / self.lookups, 4) if self.lookups else None,
+                'evictions': self.evictions
+            }
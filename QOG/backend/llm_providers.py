@@ -0,0 +1,350 @@
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import time
+from abc import ABC, abstractmethod
+from threading import Event, Lock
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional
+
+
+class LLMProviderError(Exception):
+    pass
+
+
+class TransientLLMError(LLMProviderError):
+    """Upstream failure that is expected to succeed on retry."""
+
+
+class GenerationCancelled(LLMProviderError):
+    """The caller gave up: client disconnected, job abandoned or deadline passed."""
+
+    def __init__(self, reason: str):
+        super().__init__(f'Generation cancelled ({reason})')
+        self.reason = reason
+
+
+class CancellationToken:
+    """Deadline plus cancel flag shared by everything working on one generation.
+
+    ``probe`` is an optional callable polled at most every ``probe_interval``
+    seconds; returning a reason string (e.g. ``'client_disconnected'``) cancels
+    the token.
+    """
+
+    def __init__(
+        self,
+        deadline_seconds: Optional[float] = None,
+        probe: Optional[Callable[[], Optional[str]]] = None,
+        probe_interval: float = 0.25,
+    ):
+        self._event = Event()
+        self._lock = Lock()
+        self.reason: Optional[str] = None
+        self.deadline = time.monotonic() + deadline_seconds if deadline_seconds else None
+        self._probe = probe
+        self._probe_interval = probe_interval
+        self._next_probe = 0.0
+
+    def cancel(self, reason: str = 'cancelled') -> None:
+        with self._lock:
+            if self.reason is None:
+                self.reason = reason
+        self._event.set()
+
+    def remaining(self) -> float:
+        if self.deadline is None:
+            return float('inf')
+        return max(0.0, self.deadline - time.monotonic())
+
+    def is_cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        now = time.monotonic()
+        if self.deadline is not None and now >= self.deadline:
+            self.cancel('deadline')
+            return True
+        if self._probe is not None and now >= self._next_probe:
+            self._next_probe = now + self._probe_interval
+            try:
+                reason = self._probe()
+            except Exception:
+                reason = None
+            if reason:
+                self.cancel(reason)
+                return True
+        return False
+
+    def raise_if_cancelled(self) -> None:
+        if self.is_cancelled():
+            raise GenerationCancelled(self.reason or 'cancelled')
+
+    def sleep(self, seconds: float) -> None:
+        """Sleep up to ``seconds``, raising GenerationCancelled as soon as the token trips."""
+        end = time.monotonic() + max(0.0, seconds)
+        while True:
+            self.raise_if_cancelled()
+            left = end - time.monotonic()
+            if left <= 0:
+                return
+            self._event.wait(min(left, self._probe_interval))
+
+
+def _sleep(seconds: float, cancel_token: Optional[CancellationToken]) -> None:
+    if cancel_token is not None:
+        cancel_token.sleep(seconds)
+    elif seconds > 0:
+        time.sleep(seconds)
+
+
+class LLMResult:
+    def __init__(
+        self,
+        text: str,
+        model: str,
+        prompt_tokens: Optional[int] = None,
+        response_tokens: Optional[int] = None,
+    ):
+        self.text = text
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.response_tokens = response_tokens
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    return (len(text) + 3) // 4
+
+
+def contents_text(contents: List[Dict[str, Any]]) -> str:
+    return '\n'.join(
+        part.get('text', '')
+        for entry in contents or []
+        for part in entry.get('parts', [])
+        if isinstance(part, dict)
+    )
+
+
+class LLMProvider(ABC):
+    name = 'base'
+
+    def __init__(self, default_model: str):
+        self.default_model = default_model
+
+    @abstractmethod
+    def generate(
+        self,
+        contents: List[Dict[str, Any]],
+        generation_config: Optional[Dict[str, Any]] = None,
+        model_name: Optional[str] = None,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> LLMResult:
+        ...
+
+    def stream(
+        self,
+        contents: List[Dict[str, Any]],
+        generation_config: Optional[Dict[str, Any]] = None,
+        model_name: Optional[str] = None,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> Iterator[str]:
+        yield self.generate(contents, generation_config, model_name, cancel_token).text
+
+
+class GeminiProvider(LLMProvider):
+    name = 'gemini'
+
+    def __init__(self, api_key: Optional[str], default_model: str = 'gemini-2.5-flash'):
+        if not api_key:
+            raise RuntimeError('GEMINI_API_KEY environment variable is not set.')
+        super().__init__(default_model)
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self._genai = genai
+        self._models: Dict[str, Any] = {}
+        self._lock = Lock()
+
+    def _model(self, model_name: Optional[str]):
+        name = model_name or self.default_model
+        with self._lock:
+            model = self._models.get(name)
+            if model is None:
+                model = self._genai.GenerativeModel(name)
+                self._models[name] = model
+            return model
+
+    def generate(self, contents, generation_config=None, model_name=None, cancel_token=None) -> LLMResult:
+        # The SDK call cannot be interrupted; callers stop waiting on cancellation.
+        response = self._model(model_name).generate_content(
+            contents=contents,
+            generation_config=generation_config
+        )
+        usage = getattr(response, 'usage_metadata', None)
+        return LLMResult(
+            text=(getattr(response, 'text', '') or '').strip(),
+            model=model_name or self.default_model,
+            prompt_tokens=getattr(usage, 'prompt_token_count', None) if usage else None,
+            response_tokens=getattr(usage, 'candidates_token_count', None) if usage else None
+        )
+
+    def stream(self, contents, generation_config=None, model_name=None, cancel_token=None) -> Iterator[str]:
+        response = self._model(model_name).generate_content(
+            contents=contents,
+            generation_config=generation_config,
+            stream=True
+        )
+        for chunk in response:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            text = getattr(chunk, 'text', '') or ''
+            if text:
+                yield text
+
+
+_FAKE_VOCABULARY = (
+    'plan', 'review', 'draft', 'outline', 'context', 'goal', 'step', 'check', 'prompt', 'result',
+    'clarify', 'example', 'constraint', 'iterate', 'summary', 'detail', 'focus', 'task', 'next', 'refine'
+)
+
+
+class FakeProvider(LLMProvider):
+    """Offline provider for load tests and CI.
+
+    The reply text is derived from the request contents, so the same prompt
+    always gets the same reply. Latency and injected errors are drawn per call
+    (content seed plus a call counter), so a retry of a failed prompt can
+    succeed; ``content_seeded=True`` draws them from the contents alone, making
+    every call with the same prompt fail or stall the same way.
+
+    ``latency`` is one of ``fixed:<ms>``, ``uniform:<min_ms>:<max_ms>``,
+    ``normal:<mean_ms>:<stddev_ms>`` or ``lognormal:<median_ms>:<sigma>`` and
+    covers the time to first token; the reply then streams at
+    ``tokens_per_second``.
+    """
+
+    name = 'fake'
+
+    def __init__(
+        self,
+        default_model: str = 'fake-model',
+        latency: str = 'fixed:0',
+        tokens_per_second: float = 0.0,
+        response_tokens: int = 60,
+        error_rate: float = 0.0,
+        seed: str = '',
+        content_seeded: bool = False,
+    ):
+        super().__init__(default_model)
+        self.latency_kind, self.latency_params = self._parse_latency(latency)
+        self.tokens_per_second = max(0.0, float(tokens_per_second))
+        self.response_tokens = max(1, int(response_tokens))
+        self.error_rate = min(1.0, max(0.0, float(error_rate)))
+        self.seed = seed
+        self.content_seeded = content_seeded
+        self._calls = itertools.count()
+        self._calls_lock = Lock()
+
+    @staticmethod
+    def _parse_latency(spec: str):
+        kind, _, raw_params = (spec or 'fixed:0').partition(':')
+        kind = kind.strip().lower()
+        try:
+            params = [float(value) for value in raw_params.split(':') if value.strip()]
+        except ValueError:
+            raise ValueError(f'Invalid fake latency spec: {spec!r}')
+        expected = {'fixed': 1, 'uniform': 2, 'normal': 2, 'lognormal': 2}
+        if kind not in expected or len(params) != expected[kind]:
+            raise ValueError(f'Invalid fake latency spec: {spec!r}')
+        return kind, params
+
+    def _digest(self, contents, generation_config, model_name) -> str:
+        payload = json.dumps(
+            [self.seed, model_name, contents, generation_config],
+            sort_keys=True,
+            default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _call_rng(self, digest: str) -> random.Random:
+        if self.content_seeded:
+            return random.Random(digest)
+        with self._calls_lock:
+            call = next(self._calls)
+        return random.Random(f'{digest}:{call}')
+
+    def _first_token_delay(self, rng: random.Random) -> float:
+        params = self.latency_params
+        if self.latency_kind == 'fixed':
+            millis = params[0]
+        elif self.latency_kind == 'uniform':
+            millis = rng.uniform(params[0], params[1])
+        elif self.latency_kind == 'normal':
+            millis = rng.gauss(params[0], params[1])
+        else:
+            millis = params[0] * math.exp(rng.gauss(0.0, params[1]))
+        return max(0.0, millis) / 1000.0
+
+    def _plan(self, contents, generation_config, model_name):
+        digest = self._digest(contents, generation_config, model_name)
+        draws = self._call_rng(digest)
+        delay = self._first_token_delay(draws)
+        failed = draws.random() < self.error_rate
+        rng = random.Random(digest)
+        count = max(1, int(rng.uniform(0.5, 1.5) * self.response_tokens))
+        prompt = contents_text(contents)
+        last_line = prompt.strip().splitlines()[-1] if prompt.strip() else ''
+        words = [rng.choice(_FAKE_VOCABULARY) for _ in range(count)]
+        text = f"**Fake reply** to: {last_line[:80]}\n\n" + ' '.join(words)
+        return delay, failed, text, estimate_tokens(prompt)
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def generate(self, contents, generation_config=None, model_name=None, cancel_token=None) -> LLMResult:
+        delay, failed, text, prompt_tokens = self._plan(contents, generation_config, model_name)
+        response_tokens = estimate_tokens(text)
+        _sleep(delay, cancel_token)
+        if failed:
+            raise TransientLLMError('Injected fake provider error')
+        _sleep(response_tokens * self._token_delay(), cancel_token)
+        return LLMResult(
+            text=text,
+            model=model_name or self.default_model,
+            prompt_tokens=prompt_tokens,
+            response_tokens=response_tokens
+        )
+
+    def stream(self, contents, generation_config=None, model_name=None, cancel_token=None) -> Iterator[str]:
+        delay, failed, text, _ = self._plan(contents, generation_config, model_name)
+        _sleep(delay, cancel_token)
+        if failed:
+            raise TransientLLMError('Injected fake provider error')
+        per_token = self._token_delay()
+        words = text.split(' ')
+        for index, word in enumerate(words):
+            chunk = word if index == 0 else f' {word}'
+            _sleep(estimate_tokens(chunk) * per_token, cancel_token)
+            yield chunk
+
+
+def create_provider(env: Mapping[str, str] = os.environ, fake_content_seeded: bool = False) -> LLMProvider:
+    name = (env.get('LLM_PROVIDER') or 'gemini').strip().lower()
+    if name == 'gemini':
+        return GeminiProvider(
+            api_key=env.get('GEMINI_API_KEY'),
+            default_model=env.get('GEMINI_MODEL') or 'gemini-2.5-flash'
+        )
+    if name == 'fake':
+        return FakeProvider(
+            default_model=env.get('FAKE_LLM_MODEL') or 'fake-model',
+            latency=env.get('FAKE_LLM_LATENCY_MS') or 'fixed:0',
+            tokens_per_second=float(env.get('FAKE_LLM_TOKENS_PER_SECOND') or 0),
+            response_tokens=int(env.get('FAKE_LLM_RESPONSE_TOKENS') or 60),
+            error_rate=float(env.get('FAKE_LLM_ERROR_RATE') or 0),
+            seed=env.get('FAKE_LLM_SEED') or '',
+            content_seeded=fake_content_seeded
+        )
+    raise RuntimeError(f'Unknown LLM_PROVIDER: {name}')
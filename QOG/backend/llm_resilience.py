@@ -0,0 +1,350 @@
+import random
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+from llm_providers import (
+    CancellationToken, GenerationCancelled, LLMProvider, LLMProviderError, LLMResult, TransientLLMError
+)
+from metrics import Metrics
+
+
+class LLMTimeoutError(TransientLLMError):
+    pass
+
+
+class CircuitOpenError(LLMProviderError):
+    def __init__(self, retry_after: float):
+        super().__init__('Model upstream is unavailable; failing fast while the circuit is open')
+        self.retry_after = retry_after
+
+
+# google.api_core exception names that indicate a transient upstream problem.
+_RETRYABLE_ERROR_NAMES = {
+    'ServiceUnavailable', 'ResourceExhausted', 'DeadlineExceeded', 'InternalServerError',
+    'TooManyRequests', 'GatewayTimeout', 'Aborted', 'Unknown'
+}
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (TransientLLMError, TimeoutError, ConnectionError)):
+        return True
+    return type(error).__name__ in _RETRYABLE_ERROR_NAMES
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half-open (one probe) -> closed."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self._lock = Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half_open'
+            return 'open'
+
+    def allow(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            elapsed = time.monotonic() - self._opened_at
+            if elapsed < self.reset_timeout:
+                raise CircuitOpenError(self.reset_timeout - elapsed)
+            if self._probe_in_flight:
+                raise CircuitOpenError(1.0)
+            self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """Forget an in-flight half-open probe whose caller gave up."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> bool:
+        """Record an upstream failure; returns True when this trips the breaker."""
+        with self._lock:
+            self._failures += 1
+            was_probe = self._probe_in_flight
+            self._probe_in_flight = False
+            if was_probe or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 200):
+        self._samples: deque = deque(maxlen=window)
+        self._lock = Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < max(1, min_samples):
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class ResilientLLM(LLMProvider):
+    """Wraps a provider with attempt timeouts, jittered retries, hedging and a breaker.
+
+    Upstream calls run on a bounded thread pool so a hung call can be abandoned
+    after ``attempt_timeout``; the abandoned thread finishes in the background
+    and its result is discarded. A ``CancellationToken`` caps every attempt at
+    the remaining deadline and is polled every ``CANCEL_POLL_SECONDS`` so the
+    caller is released as soon as it trips.
+    """
+
+    CANCEL_POLL_SECONDS = 0.1
+
+    def __init__(
+        self,
+        provider: LLMProvider,
+        metrics: Metrics,
+        attempt_timeout: float = 30.0,
+        max_attempts: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        hedge_enabled: bool = False,
+        hedge_percentile: float = 95.0,
+        hedge_min_samples: int = 20,
+        breaker_failure_threshold: int = 5,
+        breaker_reset_timeout: float = 30.0,
+        max_concurrency: int = 16,
+    ):
+        super().__init__(provider.default_model)
+        self.provider = provider
+        self.name = provider.name
+        self.metrics = metrics
+        self.attempt_timeout = float(attempt_timeout)
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff_base = float(backoff_base)
+        self.backoff_max = float(backoff_max)
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = float(hedge_percentile)
+        self.hedge_min_samples = int(hedge_min_samples)
+        self.breaker = CircuitBreaker(breaker_failure_threshold, breaker_reset_timeout)
+        self.latency = LatencyTracker()
+        self._model_latency: Dict[str, LatencyTracker] = {}
+        self._model_latency_lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(max_concurrency)), thread_name_prefix='llm')
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: uniform over [0, min(max, base * 2^attempt)].
+        return random.uniform(0.0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _timed_generate(self, contents, generation_config, model_name, cancel_token) -> LLMResult:
+        started = time.monotonic()
+        result = self.provider.generate(contents, generation_config, model_name, cancel_token)
+        elapsed = time.monotonic() - started
+        self.latency.add(elapsed)
+        self._tracker(model_name or self.default_model).add(elapsed)
+        return result
+
+    def _tracker(self, model_name: str) -> LatencyTracker:
+        with self._model_latency_lock:
+            tracker = self._model_latency.get(model_name)
+            if tracker is None:
+                tracker = LatencyTracker()
+                self._model_latency[model_name] = tracker
+            return tracker
+
+    def model_p95_ms(self, model_name: str, min_samples: int = 5) -> Optional[float]:
+        """Observed p95 attempt latency for one model, or None until enough samples exist."""
+        p95 = self._tracker(model_name).percentile(95.0, min_samples)
+        return p95 * 1000.0 if p95 is not None else None
+
+    def _record_error(self, error: BaseException) -> bool:
+        """Feed an upstream error to the breaker; returns whether it is retryable."""
+        retryable = is_retryable(error)
+        if not retryable:
+            # The upstream answered (e.g. a bad request), so it is healthy.
+            self.breaker.record_success()
+        elif self.breaker.record_failure():
+            self.metrics.incr('llm.circuit_trips')
+        return retryable
+
+    def _attempt(self, contents, generation_config, model_name, cancel_token) -> LLMResult:
+        started = time.monotonic()
+        timeout = self.attempt_timeout
+        if cancel_token is not None:
+            timeout = min(timeout, cancel_token.remaining())
+        submit_args = (self._timed_generate, contents, generation_config, model_name, cancel_token)
+        primary = self._executor.submit(*submit_args)
+        pending = {primary}
+        hedge_after = None
+        if self.hedge_enabled:
+            # Per-model: a slow model's calls must not hedge a fast model too late, or vice versa.
+            tracker = self._tracker(model_name or self.default_model)
+            hedge_after = tracker.percentile(self.hedge_percentile, self.hedge_min_samples)
+        hedged = False
+        errors: List[BaseException] = []
+        while pending:
+            elapsed = time.monotonic() - started
+            remaining = timeout - elapsed
+            if remaining <= 0:
+                break
+            wait_for = remaining
+            if hedge_after is not None and not hedged:
+                wait_for = min(remaining, max(0.0, hedge_after - elapsed))
+            if cancel_token is not None:
+                wait_for = min(wait_for, self.CANCEL_POLL_SECONDS)
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    if hedged:
+                        self.metrics.incr('llm.hedge_wins' if future is not primary else 'llm.hedge_primary_wins')
+                    return future.result()
+                errors.append(error)
+            if cancel_token is not None and cancel_token.is_cancelled():
+                for future in pending:
+                    future.cancel()
+                raise GenerationCancelled(cancel_token.reason or 'cancelled')
+            if (hedge_after is not None and not hedged and primary in pending
+                    and time.monotonic() - started >= hedge_after):
+                hedged = True
+                self.metrics.incr('llm.hedges')
+                pending.add(self._executor.submit(*submit_args))
+        if not pending and errors:
+            raise errors[-1]
+        for future in pending:
+            future.cancel()
+        if cancel_token is not None and cancel_token.is_cancelled():
+            raise GenerationCancelled(cancel_token.reason or 'cancelled')
+        raise LLMTimeoutError(f'Model call exceeded {timeout:g}s')
+
+    def generate(
+        self,
+        contents: List[Dict[str, Any]],
+        generation_config: Optional[Dict[str, Any]] = None,
+        model_name: Optional[str] = None,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> LLMResult:
+        self.metrics.incr('llm.calls')
+        try:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            self.breaker.allow()
+        except CircuitOpenError:
+            self.metrics.incr('llm.circuit_rejections')
+            raise
+        except GenerationCancelled:
+            self.metrics.incr('llm.cancelled')
+            raise
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            self.metrics.incr('llm.attempts')
+            try:
+                result = self._attempt(contents, generation_config, model_name, cancel_token)
+            except GenerationCancelled:
+                self.breaker.release_probe()
+                self.metrics.incr('llm.cancelled')
+                raise
+            except Exception as error:
+                retryable = self._record_error(error)
+                if isinstance(error, LLMTimeoutError):
+                    self.metrics.incr('llm.timeouts')
+                attempt += 1
+                if not retryable or attempt >= self.max_attempts or self.breaker.state == 'open':
+                    self.metrics.incr('llm.failures')
+                    raise
+                self.metrics.incr('llm.retries')
+                try:
+                    if cancel_token is not None:
+                        cancel_token.sleep(self._backoff(attempt - 1))
+                    else:
+                        time.sleep(self._backoff(attempt - 1))
+                except GenerationCancelled:
+                    self.metrics.incr('llm.cancelled')
+                    raise
+                continue
+            self.breaker.record_success()
+            self.metrics.incr('llm.successes')
+            self.metrics.observe('llm.latency_ms', (time.monotonic() - started) * 1000.0)
+            return result
+
+    def stream(self, contents, generation_config=None, model_name=None, cancel_token=None):
+        self.metrics.incr('llm.calls')
+        try:
+            self.breaker.allow()
+        except CircuitOpenError:
+            self.metrics.incr('llm.circuit_rejections')
+            raise
+        started = time.monotonic()
+        try:
+            chunks = self.provider.stream(contents, generation_config, model_name, cancel_token)
+        except GenerationCancelled:
+            self.breaker.release_probe()
+            self.metrics.incr('llm.cancelled')
+            raise
+        except Exception as error:
+            self._record_error(error)
+            self.metrics.incr('llm.failures')
+            raise
+        return self._recorded_stream(chunks, started)
+
+    def _recorded_stream(self, chunks, started: float):
+        """Yield ``chunks`` and report how the stream ended to the breaker and metrics.
+
+        A stream that is cancelled or dropped by its consumer part-way says
+        nothing about upstream health, so it only releases a half-open probe
+        and counts as ``llm.cancelled``. ``llm.latency_ms`` covers the whole
+        stream, as it covers every attempt in generate.
+        """
+        recorded = False
+        try:
+            for chunk in chunks:
+                yield chunk
+            self.breaker.record_success()
+            recorded = True
+            self.metrics.incr('llm.successes')
+            self.metrics.observe('llm.latency_ms', (time.monotonic() - started) * 1000.0)
+        except GenerationCancelled:
+            raise
+        except Exception as error:
+            self._record_error(error)
+            recorded = True
+            self.metrics.incr('llm.failures')
+            raise
+        finally:
+            if not recorded:
+                self.breaker.release_probe()
+                self.metrics.incr('llm.cancelled')
+
+    def status(self) -> Dict[str, Any]:
+        p95 = self.latency.percentile(95.0)
+        with self._model_latency_lock:
+            models = list(self._model_latency)
+        model_p95 = {}
+        for model_name in models:
+            value = self.model_p95_ms(model_name, min_samples=1)
+            model_p95[model_name] = round(value, 1) if value is not None else None
+        return {
+            'provider': self.provider.name,
+            'circuit': self.breaker.state,
+            'p95_latency_ms': round(p95 * 1000.0, 1) if p95 is not None else None,
+            'model_p95_latency_ms': model_p95
+        }
@@ -0,0 +1,148 @@
+import json
+import os
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional
+
+
+class RoutingPolicyError(ValueError):
+    pass
+
+
+class Route:
+    def __init__(self, model: str, generation_config: Dict[str, Any], rule: str):
+        self.model = model
+        self.generation_config = generation_config
+        self.rule = rule
+
+
+class RoutingRule:
+    """One ``rules`` entry: every condition present under ``when`` must hold.
+
+    Supported conditions:
+    - ``min_prompt_tokens`` / ``max_prompt_tokens``: inclusive bounds on the
+      estimated prompt size.
+    - ``categories``: task categories (case-insensitive).
+    - ``kinds``: ``"send"`` and/or ``"improve"``.
+    - ``max_p95_latency_ms``: skip the rule while the rule's own model is
+      observed to be slower than this (no samples yet counts as fast enough).
+    """
+
+    CONDITIONS = ('min_prompt_tokens', 'max_prompt_tokens', 'categories', 'kinds', 'max_p95_latency_ms')
+
+    def __init__(self, spec: Dict[str, Any], index: int):
+        if not isinstance(spec, dict) or not spec.get('model'):
+            raise RoutingPolicyError(f'Rule #{index} must be an object with a "model"')
+        when = spec.get('when') or {}
+        unknown = set(when) - set(self.CONDITIONS)
+        if unknown:
+            raise RoutingPolicyError(f'Rule #{index} has unknown conditions: {sorted(unknown)}')
+        self.name = spec.get('name') or f'rule-{index}'
+        self.model = spec['model']
+        self.generation_config = spec.get('generation_config')
+        self.min_prompt_tokens = when.get('min_prompt_tokens')
+        self.max_prompt_tokens = when.get('max_prompt_tokens')
+        self.categories = {str(value).lower() for value in when['categories']} if 'categories' in when else None
+        self.kinds = set(when['kinds']) if 'kinds' in when else None
+        self.max_p95_latency_ms = when.get('max_p95_latency_ms')
+
+    def matches(self, prompt_tokens: int, category: str, kind: str, p95_latency_ms: Optional[float]) -> bool:
+        if self.min_prompt_tokens is not None and prompt_tokens < self.min_prompt_tokens:
+            return False
+        if self.max_prompt_tokens is not None and prompt_tokens > self.max_prompt_tokens:
+            return False
+        if self.categories is not None and (category or '').lower() not in self.categories:
+            return False
+        if self.kinds is not None and kind not in self.kinds:
+            return False
+        if (self.max_p95_latency_ms is not None and p95_latency_ms is not None
+                and p95_latency_ms > self.max_p95_latency_ms):
+            return False
+        return True
+
+
+class RoutingPolicy:
+    """Declarative model routing: the first matching rule wins, else ``default``.
+
+    A policy file looks like::
+
+        {
+          "version": 1,
+          "default": {"model": "gemini-2.5-flash", "generation_config": {"temperature": 0.7}},
+          "models": {"gemini-2.5-flash": {"input_cost_per_mtok": 0.3, ...}},
+          "rules": [{"name": "short-chat", "when": {"max_prompt_tokens": 300}, "model": "..."}]
+        }
+
+    Rules without a ``generation_config`` inherit the default one. ``models``
+    holds pricing and latency profiles used by ``replay_routing.py``.
+    """
+
+    def __init__(self, spec: Dict[str, Any], default_model: str, default_config: Dict[str, Any]):
+        default = spec.get('default') or {}
+        self.version = spec.get('version')
+        self.default_model = default.get('model') or default_model
+        self.default_config = dict(default.get('generation_config') or default_config)
+        self.models: Dict[str, Dict[str, Any]] = dict(spec.get('models') or {})
+        self.rules: List[RoutingRule] = [
+            RoutingRule(rule, index) for index, rule in enumerate(spec.get('rules') or [], start=1)
+        ]
+
+    @classmethod
+    def load(cls, path: Optional[str], default_model: str, default_config: Dict[str, Any]) -> 'RoutingPolicy':
+        if not path:
+            return cls({}, default_model, default_config)
+        try:
+            with open(path, 'r') as f:
+                spec = json.load(f)
+        except (OSError, ValueError) as error:
+            raise RoutingPolicyError(f'Cannot load routing policy {path}: {error}')
+        if not isinstance(spec, dict):
+            raise RoutingPolicyError(f'Routing policy {path} must be a JSON object')
+        return cls(spec, default_model, default_config)
+
+    def route(
+        self,
+        prompt_tokens: int,
+        category: str = 'General',
+        kind: str = 'send',
+        latency_p95_ms: Optional[Callable[[str], Optional[float]]] = None,
+    ) -> Route:
+        for rule in self.rules:
+            p95 = latency_p95_ms(rule.model) if latency_p95_ms else None
+            if rule.matches(prompt_tokens, category, kind, p95):
+                config = rule.generation_config if rule.generation_config is not None else self.default_config
+                return Route(rule.model, dict(config), rule.name)
+        return Route(self.default_model, dict(self.default_config), 'default')
+
+
+class PolicyFile:
+    """Reloads the policy when the file's mtime changes, keeping the last good one on errors."""
+
+    def __init__(self, path: Optional[str], default_model: str, default_config: Dict[str, Any]):
+        self.path = path
+        self.default_model = default_model
+        self.default_config = default_config
+        self._lock = Lock()
+        self._mtime: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._policy = RoutingPolicy.load(path, default_model, default_config)
+        if path:
+            self._mtime = os.path.getmtime(path)
+
+    def current(self) -> RoutingPolicy:
+        if not self.path:
+            return self._policy
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return self._policy
+        if mtime == self._mtime:
+            return self._policy
+        with self._lock:
+            if mtime != self._mtime:
+                try:
+                    self._policy = RoutingPolicy.load(self.path, self.default_model, self.default_config)
+                    self.last_error = None
+                except RoutingPolicyError as error:
+                    self.last_error = str(error)
+                self._mtime = mtime
+        return self._policy
@@ -0,0 +1,37 @@
+from threading import Lock
+from typing import Any, Dict
+
+
+class Metrics:
+    """Process-local counters and value summaries exposed via the admin API."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counters: Dict[str, int] = {}
+        self._observations: Dict[str, Dict[str, float]] = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            entry = self._observations.get(name)
+            if entry is None:
+                entry = {'count': 0, 'sum': 0.0, 'max': value}
+                self._observations[name] = entry
+            entry['count'] += 1
+            entry['sum'] += value
+            entry['max'] = max(entry['max'], value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            observations = {
+                name: {
+                    'count': entry['count'],
+                    'mean': round(entry['sum'] / entry['count'], 3) if entry['count'] else None,
+                    'max': round(entry['max'], 3)
+                }
+                for name, entry in self._observations.items()
+            }
+            return {'counters': dict(self._counters), 'observations': observations}
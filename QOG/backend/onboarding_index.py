@@ -0,0 +1,76 @@
+import json
+import os
+import shutil
+from threading import Lock
+from typing import Any, Callable, Dict, Optional
+from uuid import uuid4
+
+
+class OnboardingIndex:
+    """Onboarding completion state per user, one small file each in ``directory``.
+
+    An entry is ``{'completed', 'completed_at', 'answers_ref'}``; the answers
+    themselves stay wherever ``answers_ref`` points, so looking up a user's
+    status reads one tiny file regardless of how many users there are.
+    Completed entries are cached in memory (completion is never undone).
+
+    The directory is built once from ``seed()`` (user_id -> entry) into a
+    temporary directory that is renamed into place, so concurrent workers
+    cannot leave a half-built index behind.
+    """
+
+    def __init__(self, directory: str, seed: Callable[[], Dict[str, Dict[str, Any]]]):
+        self.directory = directory
+        self.seed = seed
+        self._lock = Lock()
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._ready = False
+
+    def _path(self, user_id: str) -> str:
+        return os.path.join(self.directory, f'{user_id}.json')
+
+    def _ensure_built(self) -> None:
+        if self._ready:
+            return
+        with self._lock:
+            if self._ready:
+                return
+            if not os.path.isdir(self.directory):
+                staging = f'{self.directory}.{uuid4().hex}.tmp'
+                os.makedirs(staging)
+                for user_id, entry in self.seed().items():
+                    with open(os.path.join(staging, f'{user_id}.json'), 'w') as f:
+                        json.dump(entry, f)
+                try:
+                    os.rename(staging, self.directory)
+                except OSError:
+                    # Another worker finished first; its index is equivalent.
+                    shutil.rmtree(staging, ignore_errors=True)
+            self._ready = True
+
+    def get(self, user_id: str, cached: bool = True) -> Optional[Dict[str, Any]]:
+        """The user's entry; ``cached=False`` rereads it in case another worker updated it."""
+        if cached and user_id in self._cache:
+            return self._cache[user_id]
+        self._ensure_built()
+        try:
+            with open(self._path(user_id), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict):
+            return None
+        if entry.get('completed'):
+            self._cache[user_id] = entry
+        return entry
+
+    def mark_completed(self, user_id: str, completed_at: str, answers_ref: Dict[str, Any]) -> Dict[str, Any]:
+        self._ensure_built()
+        entry = {'completed': True, 'completed_at': completed_at, 'answers_ref': answers_ref}
+        path = self._path(user_id)
+        tmp_path = f'{path}.{uuid4().hex}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+        self._cache[user_id] = entry
+        return entry
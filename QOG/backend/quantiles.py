@@ -0,0 +1,259 @@
+import atexit
+import json
+import math
+import os
+import random
+import time
+from threading import Lock
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows dev machines
+    fcntl = None
+
+
+class KLLSketch:
+    """Mergeable streaming quantile sketch (Karnin, Lang & Liberty, 2016).
+
+    Items live in levels of compactors; an item on level ``h`` stands for
+    ``2**h`` inputs. When the sketch outgrows its capacity the lowest full
+    level is sorted and every other item (random offset) is promoted, which
+    keeps rank error around ``1.65 / k`` with ``O(k)`` memory. Sketches built
+    in different processes merge by concatenating levels and compacting.
+    """
+
+    def __init__(self, k: int = 200, seed: Optional[int] = None):
+        self.k = max(8, int(k))
+        self.n = 0
+        self.levels: List[List[float]] = [[]]
+        self._random = random.Random(seed)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * (2.0 / 3.0) ** depth)))
+
+    def _size(self) -> int:
+        return sum(len(items) for items in self.levels)
+
+    def _compress(self) -> None:
+        while self._size() > sum(self._capacity(level) for level in range(len(self.levels))):
+            for level, items in enumerate(self.levels):
+                if len(items) >= self._capacity(level):
+                    if level + 1 == len(self.levels):
+                        self.levels.append([])
+                    items.sort()
+                    offset = self._random.randint(0, 1)
+                    # An odd item out stays behind so no weight is lost.
+                    keep = [items.pop()] if len(items) % 2 else []
+                    self.levels[level + 1].extend(items[offset::2])
+                    self.levels[level] = keep
+                    break
+
+    def update(self, value: float) -> None:
+        self.levels[0].append(float(value))
+        self.n += 1
+        if len(self.levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def merge(self, other: 'KLLSketch') -> None:
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.n += other.n
+        self._compress()
+
+    def rank(self, value: float) -> Tuple[float, float]:
+        """Estimated (weight of items below ``value``, weight equal to it)."""
+        below = 0.0
+        equal = 0.0
+        for level, items in enumerate(self.levels):
+            weight = float(1 << level)
+            for item in items:
+                if item < value:
+                    below += weight
+                elif item == value:
+                    equal += weight
+        return below, equal
+
+    def quantile(self, q: float) -> Optional[float]:
+        weighted = sorted(
+            (item, 1 << level) for level, items in enumerate(self.levels) for item in items
+        )
+        if not weighted:
+            return None
+        target = max(0.0, min(1.0, q)) * sum(weight for _, weight in weighted)
+        running = 0
+        for item, weight in weighted:
+            running += weight
+            if running >= target:
+                return item
+        return weighted[-1][0]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'k': self.k, 'n': self.n, 'levels': self.levels}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'KLLSketch':
+        sketch = cls(int(data.get('k') or 200))
+        sketch.n = int(data.get('n') or 0)
+        levels = data.get('levels') or [[]]
+        sketch.levels = [[float(item) for item in items] for items in levels] or [[]]
+        return sketch
+
+
+def percentile_of(value: float, sketches: Iterable[KLLSketch]) -> Tuple[Optional[float], int]:
+    """Mid-rank percentile (0-100) of ``value`` across the union of ``sketches``."""
+    below = equal = weight = 0.0
+    population = 0
+    for sketch in sketches:
+        sketch_below, sketch_equal = sketch.rank(value)
+        below += sketch_below
+        equal += sketch_equal
+        population += sketch.n
+        # Compaction keeps the total weight within one item of n; normalise by
+        # the weight actually held so the answer stays within 0-100.
+        weight += sum(float(1 << level) * len(items) for level, items in enumerate(sketch.levels))
+    if not population or weight <= 0:
+        return None, population
+    return 100.0 * (below + 0.5 * equal) / weight, population
+
+
+class SketchStore:
+    """Per-key KLL sketches shared by worker processes through one JSON file.
+
+    ``add`` only touches an in-memory pending sketch. Every ``flush_interval``
+    seconds (and at exit) pending sketches are merged into ``path`` under an
+    exclusive lock, and the merged file becomes the local snapshot, so each
+    process sees the others' values with at most that much delay. Queries
+    combine snapshot, in-flight and pending sketches.
+    """
+
+    def __init__(self, path: Optional[str] = None, k: int = 200, flush_interval: float = 30.0):
+        self.path = path
+        self.k = int(k)
+        self.flush_interval = float(flush_interval)
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._snapshot: Dict[str, KLLSketch] = {}
+        self._in_flight: Dict[str, KLLSketch] = {}
+        self._pending: Dict[str, KLLSketch] = {}
+        self._last_flush = time.monotonic()
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._snapshot = self._load_file()
+            atexit.register(self.flush)
+
+    def _load_file(self) -> Dict[str, KLLSketch]:
+        try:
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        sketches = stored.get('sketches') if isinstance(stored, dict) else None
+        if not isinstance(sketches, dict):
+            return {}
+        return {key: KLLSketch.from_dict(value) for key, value in sketches.items() if isinstance(value, dict)}
+
+    def _write_file(self, sketches: Dict[str, KLLSketch]) -> None:
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'format': 1, 'sketches': {key: sketch.to_dict() for key, sketch in sketches.items()}}, f)
+        os.replace(tmp_path, self.path)
+
+    def _locked(self, action: Callable[[], Any]) -> Any:
+        with open(f'{self.path}.lock', 'a') as lock_handle:
+            if fcntl is not None:
+                fcntl.flock(lock_handle, fcntl.LOCK_EX)
+            try:
+                return action()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_handle, fcntl.LOCK_UN)
+
+    def add(self, values: Dict[str, float]) -> None:
+        if not values:
+            return
+        with self._lock:
+            for key, value in values.items():
+                sketch = self._pending.get(key)
+                if sketch is None:
+                    sketch = self._pending[key] = KLLSketch(self.k)
+                sketch.update(value)
+            due = self.path and time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def percentile(self, key: str, value: float) -> Tuple[Optional[float], int]:
+        with self._lock:
+            sketches = [layer[key] for layer in (self._snapshot, self._in_flight, self._pending) if key in layer]
+            return percentile_of(value, sketches)
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return sorted(set(self._snapshot) | set(self._in_flight) | set(self._pending))
+
+    def flush(self) -> None:
+        if not self.path:
+            return
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = {}
+                self._in_flight = pending
+                self._last_flush = time.monotonic()
+
+            def merge_into_file() -> Dict[str, KLLSketch]:
+                merged = self._load_file()
+                for key, sketch in pending.items():
+                    if key in merged:
+                        merged[key].merge(sketch)
+                    else:
+                        merged[key] = sketch
+                self._write_file(merged)
+                return merged
+
+            try:
+                merged = self._locked(merge_into_file)
+            except OSError:
+                # Keep the values for the next attempt.
+                with self._lock:
+                    for key, sketch in pending.items():
+                        if key in self._pending:
+                            sketch.merge(self._pending[key])
+                        self._pending[key] = sketch
+                    self._in_flight = {}
+                return
+            with self._lock:
+                self._snapshot = merged
+                self._in_flight = {}
+
+    def seed_if_missing(self, rows: Callable[[], Iterable[Dict[str, float]]]) -> bool:
+        """Build the shared file from ``rows()`` unless some process already has.
+
+        Runs under the file lock, so concurrent workers seed it exactly once.
+        """
+        if not self.path:
+            return False
+
+        def seed() -> Optional[Dict[str, KLLSketch]]:
+            if os.path.exists(self.path):
+                return None
+            sketches: Dict[str, KLLSketch] = {}
+            for values in rows():
+                for key, value in values.items():
+                    sketch = sketches.get(key)
+                    if sketch is None:
+                        sketch = sketches[key] = KLLSketch(self.k)
+                    sketch.update(value)
+            self._write_file(sketches)
+            return sketches
+
+        seeded = self._locked(seed)
+        with self._lock:
+            self._snapshot = seeded if seeded is not None else self._load_file()
+        return seeded is not None
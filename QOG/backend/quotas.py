@@ -0,0 +1,189 @@
+import json
+import os
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional
+
+LIMIT_FIELDS = ('daily_soft_tokens', 'daily_hard_tokens', 'monthly_soft_tokens', 'monthly_hard_tokens')
+
+
+class QuotaPolicy:
+    """Token allowances per user tier.
+
+    A policy file looks like::
+
+        {
+          "default_tier": "free",
+          "tiers": {
+            "free": {"daily_soft_tokens": 150000, "daily_hard_tokens": 200000,
+                     "monthly_soft_tokens": 2000000, "monthly_hard_tokens": 3000000},
+            "staff": {"daily_hard_tokens": 0}
+          },
+          "users": {"user-123": "staff"}
+        }
+
+    A limit of 0 (or a missing one) means unlimited. A user's tier comes from
+    ``users``, then the ``tier`` field on their account, then ``default_tier``.
+    """
+
+    def __init__(self, spec: Dict[str, Any], fallback_limits: Dict[str, int]):
+        self.default_tier = spec.get('default_tier') or 'default'
+        tiers = spec.get('tiers') if isinstance(spec.get('tiers'), dict) else {}
+        self.tiers: Dict[str, Dict[str, int]] = {
+            name: {field: int(limits.get(field) or 0) for field in LIMIT_FIELDS}
+            for name, limits in tiers.items()
+            if isinstance(limits, dict)
+        }
+        self.tiers.setdefault(self.default_tier, dict(fallback_limits))
+        users = spec.get('users') if isinstance(spec.get('users'), dict) else {}
+        self.user_tiers: Dict[str, str] = {str(key): str(value) for key, value in users.items()}
+
+    def tier_for(self, user_id: str, account_lookup: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None) -> str:
+        tier = self.user_tiers.get(user_id)
+        if tier is None and account_lookup is not None and len(self.tiers) > 1:
+            # Only worth loading the account when there is more than one tier.
+            tier = (account_lookup(user_id) or {}).get('tier')
+        return tier if tier in self.tiers else self.default_tier
+
+    def limits(self, tier: str) -> Dict[str, int]:
+        return self.tiers.get(tier) or self.tiers[self.default_tier]
+
+
+class QuotaDecision:
+    def __init__(self, allowed: bool, tier: str, periods: List[Dict[str, Any]]):
+        self.allowed = allowed
+        self.tier = tier
+        self.periods = periods
+
+    @property
+    def exceeded(self) -> Optional[Dict[str, Any]]:
+        return next((period for period in self.periods if period['state'] == 'exceeded'), None)
+
+    @property
+    def warnings(self) -> List[Dict[str, Any]]:
+        return [period for period in self.periods if period['state'] == 'warning']
+
+    def headers(self) -> Dict[str, str]:
+        limited = [period for period in self.periods if period['hard_limit']]
+        if not limited:
+            return {}
+        tightest = min(limited, key=lambda period: period['remaining'])
+        headers = {
+            'Quota-Limit': str(tightest['hard_limit']),
+            'Quota-Remaining': str(tightest['remaining']),
+            'Quota-Reset': tightest['resets_at']
+        }
+        if self.warnings:
+            headers['Quota-Warning'] = ', '.join(f"{period['period']} soft limit reached" for period in self.warnings)
+        return headers
+
+    def error_payload(self) -> Dict[str, Any]:
+        period = self.exceeded or {}
+        label = 'daily' if period.get('period') == 'day' else 'monthly'
+        return {
+            'error': (
+                f"This request would exceed your {label} AI allowance of {period.get('hard_limit', 0):,} tokens "
+                f"({period.get('used', 0):,} used). It resets at {period.get('resets_at')}."
+            ),
+            'code': 'quota_exceeded',
+            'quota': {**period, 'tier': self.tier}
+        }
+
+    def retry_after(self, now: datetime) -> int:
+        period = self.exceeded
+        if not period:
+            return 0
+        return max(1, int((datetime.fromisoformat(period['resets_at']) - now).total_seconds()))
+
+
+def _next_day(now: datetime) -> datetime:
+    return datetime(now.year, now.month, now.day) + timedelta(days=1)
+
+
+def _next_month(now: datetime) -> datetime:
+    return datetime(now.year + (now.month // 12), now.month % 12 + 1, 1)
+
+
+class QuotaEnforcer:
+    """Checks a request's estimated tokens against the user's day and month usage.
+
+    Usage comes from ``usage_lookup(scope, key)``, which must be O(1); the
+    ledger's in-memory counters serve that role, so the check costs two dict
+    lookups. The policy file is re-read when its mtime changes.
+    """
+
+    def __init__(
+        self,
+        usage_lookup: Callable[[str, str], Dict[str, Any]],
+        fallback_limits: Dict[str, int],
+        policy_path: Optional[str] = None,
+    ):
+        self.usage_lookup = usage_lookup
+        self.fallback_limits = fallback_limits
+        self.policy_path = policy_path
+        self.last_error: Optional[str] = None
+        self._lock = Lock()
+        self._mtime: Optional[float] = None
+        self._policy = QuotaPolicy({}, fallback_limits)
+        self.policy()
+
+    def policy(self) -> QuotaPolicy:
+        if not self.policy_path:
+            return self._policy
+        try:
+            mtime = os.path.getmtime(self.policy_path)
+        except OSError:
+            return self._policy
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    try:
+                        with open(self.policy_path, 'r') as f:
+                            spec = json.load(f)
+                        self._policy = QuotaPolicy(spec if isinstance(spec, dict) else {}, self.fallback_limits)
+                        self.last_error = None
+                    except (OSError, ValueError, TypeError, AttributeError) as error:
+                        self.last_error = f'Cannot load quota policy {self.policy_path}: {error}'
+                    self._mtime = mtime
+        return self._policy
+
+    def check(
+        self,
+        user_id: str,
+        estimated_tokens: int,
+        account_lookup: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None,
+        now: Optional[datetime] = None,
+    ) -> QuotaDecision:
+        now = now or datetime.now()
+        policy = self.policy()
+        tier = policy.tier_for(user_id, account_lookup)
+        limits = policy.limits(tier)
+        periods = []
+        allowed = True
+        for period, scope, key, soft, hard, resets_at in (
+            ('day', 'user_day', f"{user_id}/{now.strftime('%Y-%m-%d')}",
+             limits['daily_soft_tokens'], limits['daily_hard_tokens'], _next_day(now)),
+            ('month', 'user_month', f"{user_id}/{now.strftime('%Y-%m')}",
+             limits['monthly_soft_tokens'], limits['monthly_hard_tokens'], _next_month(now)),
+        ):
+            if not soft and not hard:
+                continue
+            counters = self.usage_lookup(scope, key)
+            used = int(counters.get('prompt_tokens', 0)) + int(counters.get('response_tokens', 0))
+            projected = used + max(0, int(estimated_tokens))
+            state = 'ok'
+            if hard and projected > hard:
+                state = 'exceeded'
+                allowed = False
+            elif soft and projected > soft:
+                state = 'warning'
+            periods.append({
+                'period': period,
+                'used': used,
+                'soft_limit': soft,
+                'hard_limit': hard,
+                'remaining': max(0, hard - used) if hard else None,
+                'resets_at': resets_at.isoformat(),
+                'state': state
+            })
+        return QuotaDecision(allowed, tier, periods)
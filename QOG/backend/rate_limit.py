@@ -0,0 +1,166 @@
+import json
+import os
+import time
+from threading import Lock
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows dev machines
+    fcntl = None
+
+
+class BucketSpec:
+    """A token bucket holding up to ``capacity`` tokens, refilled at ``rate`` per second."""
+
+    def __init__(self, key: str, capacity: float, rate: float, cost: float = 1.0):
+        self.key = key
+        self.capacity = float(capacity)
+        self.rate = float(rate)
+        self.cost = min(float(cost), self.capacity)
+
+
+class RateLimitDecision:
+    def __init__(self, allowed: bool, limit: int, remaining: int, reset_seconds: int, retry_after: int = 0):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_seconds = reset_seconds
+        self.retry_after = retry_after
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            'RateLimit-Limit': str(self.limit),
+            'RateLimit-Remaining': str(self.remaining),
+            'RateLimit-Reset': str(self.reset_seconds)
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(self.retry_after)
+        return headers
+
+
+def _refill(state: Optional[List[float]], spec: BucketSpec, now: float) -> float:
+    if state is None:
+        return spec.capacity
+    tokens, updated = state
+    return min(spec.capacity, tokens + max(0.0, now - updated) * spec.rate)
+
+
+def _decide(states: Dict[str, List[float]], specs: List[BucketSpec], now: float) -> RateLimitDecision:
+    """Take ``cost`` from every bucket, or from none if any is short (all-or-nothing)."""
+    levels = [(spec, _refill(states.get(spec.key), spec, now)) for spec in specs]
+    short = [(spec, level) for spec, level in levels if level < spec.cost]
+    allowed = not short
+    if allowed:
+        for spec, level in levels:
+            states[spec.key] = [level - spec.cost, now]
+        levels = [(spec, level - spec.cost) for spec, level in levels]
+    else:
+        for spec, level in levels:
+            states[spec.key] = [level, now]
+
+    # Report the most constrained bucket, as a fraction of its capacity.
+    spec, level = min(levels, key=lambda item: item[1] / item[0].capacity if item[0].capacity else 0.0)
+    reset = (spec.capacity - level) / spec.rate if spec.rate else 0.0
+    retry_after = 0.0
+    for short_spec, short_level in short:
+        wait = (short_spec.cost - short_level) / short_spec.rate if short_spec.rate else 3600.0
+        retry_after = max(retry_after, wait)
+    return RateLimitDecision(
+        allowed=allowed,
+        limit=int(spec.capacity),
+        remaining=max(0, int(level)),
+        reset_seconds=max(0, int(reset + 0.999)),
+        retry_after=max(1, int(retry_after + 0.999)) if not allowed else 0
+    )
+
+
+class MemoryBucketStore:
+    def __init__(self):
+        self._states: Dict[str, List[float]] = {}
+        self._lock = Lock()
+
+    def consume(self, specs: List[BucketSpec]) -> RateLimitDecision:
+        with self._lock:
+            return _decide(self._states, specs, time.monotonic())
+
+
+class FileBucketStore:
+    """Bucket state shared by every worker process through a locked JSON file."""
+
+    IDLE_PRUNE_SECONDS = 3600.0
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _load(self, handle) -> Dict[str, List[float]]:
+        handle.seek(0)
+        raw = handle.read()
+        try:
+            data = json.loads(raw) if raw else {}
+        except ValueError:
+            data = {}
+        return data if isinstance(data, dict) else {}
+
+    def consume(self, specs: List[BucketSpec]) -> RateLimitDecision:
+        with self._lock, open(self.path, 'a+') as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                states = self._load(handle)
+                decision = _decide(states, specs, now)
+                states = {
+                    key: state for key, state in states.items()
+                    if now - state[1] < self.IDLE_PRUNE_SECONDS
+                }
+                handle.seek(0)
+                handle.truncate()
+                json.dump(states, handle)
+                handle.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+        return decision
+
+
+class RateLimiter:
+    """Per-user and global request-rate and prompt-token buckets."""
+
+    def __init__(
+        self,
+        user_rps: float,
+        user_burst: float,
+        user_tokens_per_minute: float,
+        global_rps: float,
+        global_burst: float,
+        global_tokens_per_minute: float,
+        state_path: Optional[str] = None,
+    ):
+        self.user_rps = user_rps
+        self.user_burst = user_burst
+        self.user_tokens_per_minute = user_tokens_per_minute
+        self.global_rps = global_rps
+        self.global_burst = global_burst
+        self.global_tokens_per_minute = global_tokens_per_minute
+        self.store = FileBucketStore(state_path) if state_path else MemoryBucketStore()
+
+    def _specs(self, user_id: str, prompt_tokens: int) -> List[BucketSpec]:
+        specs = []
+        for scope, rps, burst, tokens_per_minute in (
+            (f'user:{user_id}', self.user_rps, self.user_burst, self.user_tokens_per_minute),
+            ('global', self.global_rps, self.global_burst, self.global_tokens_per_minute),
+        ):
+            if rps > 0:
+                specs.append(BucketSpec(f'{scope}:requests', max(1.0, burst), rps))
+            if tokens_per_minute > 0:
+                specs.append(BucketSpec(f'{scope}:tokens', tokens_per_minute, tokens_per_minute / 60.0, prompt_tokens))
+        return specs
+
+    def check(self, user_id: str, prompt_tokens: int) -> Optional[RateLimitDecision]:
+        specs = self._specs(user_id or 'anonymous', max(0, int(prompt_tokens)))
+        if not specs:
+            return None
+        return self.store.consume(specs)
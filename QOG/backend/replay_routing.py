@@ -0,0 +1,171 @@
+"""Offline replay of a routing policy against stored task histories.
+
+Every assistant reply in ``task_history/*.json`` is re-routed as if it were
+generated now, and its latency and cost are estimated from the ``models``
+profiles in the policy file. Usage::
+
+    python replay_routing.py --policy routing_policy.example.json
+    python replay_routing.py --policy candidate.json --baseline current.json --json
+
+Prompt size is approximated the way the app builds context: the system
+instruction plus the preceding messages, capped at the context budget.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+from typing import Any, Dict, Iterator, List, Optional
+
+from llm_providers import estimate_tokens
+from llm_routing import RoutingPolicy
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_HISTORY_DIR = os.path.join(os.environ.get('DATA_DIR', BACKEND_DIR), 'task_history')
+DEFAULT_MODEL = os.environ.get('GEMINI_MODEL') or 'gemini-2.5-flash'
+DEFAULT_GENERATION_CONFIG = {'temperature': 0.7, 'top_p': 0.9}
+MESSAGE_TOKEN_OVERHEAD = 4
+SYSTEM_PROMPT_TOKENS = 60
+
+
+def iter_turns(history_dir: str, context_budget: int) -> Iterator[Dict[str, Any]]:
+    for path in sorted(glob.glob(os.path.join(history_dir, '*.json'))):
+        try:
+            with open(path, 'r') as f:
+                tasks = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not isinstance(tasks, dict):
+            continue
+        for task in tasks.values():
+            if not isinstance(task, dict):
+                continue
+            history_tokens = 0
+            for message in task.get('messages') or []:
+                content = message.get('content') or ''
+                tokens = estimate_tokens(content) + MESSAGE_TOKEN_OVERHEAD if content else 0
+                if message.get('role') == 'assistant':
+                    metadata = message.get('metadata') or {}
+                    yield {
+                        'category': task.get('category') or 'General',
+                        'kind': 'improve' if metadata.get('kind') == 'improved_response' else 'send',
+                        'prompt_tokens': SYSTEM_PROMPT_TOKENS + min(history_tokens, context_budget),
+                        'response_tokens': estimate_tokens(content)
+                    }
+                history_tokens += tokens
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def replay(policy: RoutingPolicy, turns: List[Dict[str, Any]], assumed_p95: Dict[str, float]) -> Dict[str, Any]:
+    latencies: List[float] = []
+    total_cost = 0.0
+    by_model: Dict[str, Dict[str, Any]] = {}
+    by_rule: Dict[str, int] = {}
+    unpriced = set()
+    for turn in turns:
+        route = policy.route(turn['prompt_tokens'], turn['category'], turn['kind'], assumed_p95.get)
+        profile = policy.models.get(route.model)
+        if profile is None:
+            unpriced.add(route.model)
+            profile = {}
+        cost = (
+            turn['prompt_tokens'] * float(profile.get('input_cost_per_mtok', 0))
+            + turn['response_tokens'] * float(profile.get('output_cost_per_mtok', 0))
+        ) / 1_000_000
+        tokens_per_second = float(profile.get('tokens_per_second') or 0)
+        latency_ms = float(profile.get('first_token_ms', 0))
+        if tokens_per_second > 0:
+            latency_ms += turn['response_tokens'] / tokens_per_second * 1000.0
+        latencies.append(latency_ms)
+        total_cost += cost
+        model_stats = by_model.setdefault(route.model, {'requests': 0, 'cost_usd': 0.0})
+        model_stats['requests'] += 1
+        model_stats['cost_usd'] += cost
+        by_rule[route.rule] = by_rule.get(route.rule, 0) + 1
+    count = len(latencies)
+    return {
+        'requests': count,
+        'cost_usd': round(total_cost, 6),
+        'cost_per_1k_requests_usd': round(total_cost / count * 1000, 4) if count else 0.0,
+        'latency_ms': {
+            'mean': round(sum(latencies) / count, 1) if count else 0.0,
+            'p50': round(_percentile(latencies, 50), 1),
+            'p95': round(_percentile(latencies, 95), 1)
+        },
+        'by_model': {
+            name: {'requests': stats['requests'], 'cost_usd': round(stats['cost_usd'], 6)}
+            for name, stats in sorted(by_model.items())
+        },
+        'by_rule': dict(sorted(by_rule.items())),
+        'unpriced_models': sorted(unpriced)
+    }
+
+
+def _print_report(label: str, report: Dict[str, Any]) -> None:
+    latency = report['latency_ms']
+    print(f"{label}: {report['requests']} replies, ${report['cost_usd']:.6f} total "
+          f"(${report['cost_per_1k_requests_usd']:.4f} per 1k), latency mean {latency['mean']}ms "
+          f"p50 {latency['p50']}ms p95 {latency['p95']}ms")
+    for name, stats in report['by_model'].items():
+        print(f"  {name:<28} {stats['requests']:>6} replies  ${stats['cost_usd']:.6f}")
+    for name, count in report['by_rule'].items():
+        print(f"  rule {name:<23} {count:>6} replies")
+    if report['unpriced_models']:
+        print(f"  no profile for: {', '.join(report['unpriced_models'])} (counted as free and instant)")
+
+
+def _parse_assumed_p95(values: Optional[List[str]]) -> Dict[str, float]:
+    assumed = {}
+    for value in values or []:
+        model, sep, millis = value.partition('=')
+        if not sep:
+            raise SystemExit(f'--assume-p95 expects MODEL=MS, got {value!r}')
+        assumed[model] = float(millis)
+    return assumed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--policy', required=True, help='candidate routing policy JSON')
+    parser.add_argument('--baseline', help='policy to compare against (default: no rules, default model)')
+    parser.add_argument('--history-dir', default=DEFAULT_HISTORY_DIR)
+    parser.add_argument('--context-budget', type=int, default=int(os.environ.get('CONTEXT_TOKEN_BUDGET', 4000)))
+    parser.add_argument('--assume-p95', action='append', metavar='MODEL=MS',
+                        help='observed p95 latency to assume for a model (repeatable)')
+    parser.add_argument('--json', action='store_true', help='print the reports as JSON')
+    args = parser.parse_args(argv)
+
+    candidate = RoutingPolicy.load(args.policy, DEFAULT_MODEL, DEFAULT_GENERATION_CONFIG)
+    if args.baseline:
+        baseline = RoutingPolicy.load(args.baseline, DEFAULT_MODEL, DEFAULT_GENERATION_CONFIG)
+    else:
+        # Same pricing table, but everything goes to the candidate's default model.
+        baseline = RoutingPolicy({
+            'default': {'model': candidate.default_model},
+            'models': candidate.models
+        }, DEFAULT_MODEL, DEFAULT_GENERATION_CONFIG)
+
+    turns = list(iter_turns(args.history_dir, args.context_budget))
+    assumed_p95 = _parse_assumed_p95(args.assume_p95)
+    reports = {
+        'baseline': replay(baseline, turns, assumed_p95),
+        'candidate': replay(candidate, turns, assumed_p95)
+    }
+    if args.json:
+        json.dump(reports, sys.stdout, indent=2)
+        print()
+    else:
+        _print_report('baseline', reports['baseline'])
+        _print_report('candidate', reports['candidate'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
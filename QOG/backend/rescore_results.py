@@ -0,0 +1,318 @@
+"""Re-score stored reflection results against the current question bank.
+
+Scores in ``results.json`` are computed when a submission arrives, so they go stale when ``questions.json`` changes. This
+command recomputes them in bulk and stamps each record with ``score_meta``
+(question bank version, whether reverse scoring was applied, when). Usage::
+
+    python rescore_results.py                     # results.json in $DATA_DIR
+    python rescore_results.py --dry-run
+    python rescore_results.py --reverse-scored --workers 4 results.json
+    python rescore_results.py --benchmark 1000000
+
+Without ``--reverse-scored`` the scores are identical to
+``compute_reflection_score``. With it, scale questions marked "(reverse
+scored)" are inverted the way the Clarity dashboard does.
+
+Answers are flattened into NumPy arrays (one entry per Likert or MCQ answer,
+with per-question bounds looked up by question index) and the per-record
+means are reduced with ``np.bincount``, which adds in input order, so the
+floating-point sums match the sequential ones in ``ScoringPlan.score``.
+Each file is read, re-scored and atomically replaced while holding the
+``<path>.lock`` flock the app takes to append results, so submissions made
+during a run wait for it instead of being lost.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows dev machines
+    fcntl = None
+
+from scoring import ScoringPlan, ScoringPlanFile, sample_submissions, is_positive_option
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.environ.get('DATA_DIR', BACKEND_DIR)
+DEFAULT_PATHS = [os.path.join(DATA_DIR, 'results.json')]
+# Below this many records a process pool costs more than it saves.
+MIN_RECORDS_PER_WORKER = 50000
+
+
+def _flatten(plan: ScoringPlan, answers_list: List[Any]) -> Tuple[Dict[str, np.ndarray], int]:
+    scale_ids = {qid: index for index, qid in enumerate(plan.scales)}
+    choices = plan.choices
+    likert_record: List[int] = []
+    likert_question: List[int] = []
+    likert_value: List[float] = []
+    mcq_record: List[int] = []
+    mcq_positive: List[int] = []
+    mcq_selected: List[int] = []
+    add_likert_record = likert_record.append
+    add_likert_question = likert_question.append
+    add_likert_value = likert_value.append
+    add_mcq_record = mcq_record.append
+    add_mcq_positive = mcq_positive.append
+    add_mcq_selected = mcq_selected.append
+
+    for record_index, answers in enumerate(answers_list):
+        if not isinstance(answers, dict):
+            continue
+        for qid, value in answers.items():
+            scale_index = scale_ids.get(qid)
+            if scale_index is not None:
+                try:
+                    x = float(value)
+                except Exception:
+                    continue
+                add_likert_record(record_index)
+                add_likert_question(scale_index)
+                add_likert_value(x)
+                continue
+            choice = choices.get(qid)
+            if choice is None:
+                continue
+            single, positives, options = choice
+            if single:
+                selected = [value] if isinstance(value, str) else []
+            else:
+                selected = value if isinstance(value, list) else []
+            positive_count = 0
+            for option in selected:
+                if isinstance(option, str) and (
+                    option in positives or (option not in options and is_positive_option(option))
+                ):
+                    positive_count += 1
+            add_mcq_record(record_index)
+            add_mcq_positive(positive_count)
+            add_mcq_selected(len(selected))
+
+    arrays = {
+        'likert_record': np.array(likert_record, dtype=np.intp),
+        'likert_question': np.array(likert_question, dtype=np.intp),
+        'likert_value': np.array(likert_value, dtype=np.float64),
+        'mcq_record': np.array(mcq_record, dtype=np.intp),
+        'mcq_positive': np.array(mcq_positive, dtype=np.float64),
+        'mcq_selected': np.array(mcq_selected, dtype=np.float64)
+    }
+    return arrays, len(answers_list)
+
+
+def _round2(values: np.ndarray) -> List[float]:
+    """Python's round(value, 2) for every element.
+
+    ``np.round`` scales by 100 and can differ in the last digit, so the
+    distinct values (few, since scores are means of small fractions) go
+    through the builtin and are scattered back.
+    """
+    if not len(values):
+        return []
+    distinct, inverse = np.unique(values, return_inverse=True)
+    rounded = np.array([round(value, 2) for value in distinct.tolist()], dtype=np.float64)
+    return rounded[inverse.reshape(-1)].tolist()
+
+
+def _score_arrays(plan: ScoringPlan, answers_list: List[Any], reverse_scored: bool) -> Tuple[np.ndarray, ...]:
+    """Unrounded (overall, likert_mean, mcq_mean, likert_count, mcq_count) columns."""
+    arrays, count = _flatten(plan, answers_list)
+    mins = np.fromiter((bounds[0] for bounds in plan.scales.values()), dtype=np.float64, count=len(plan.scales))
+    spans = np.fromiter((bounds[1] for bounds in plan.scales.values()), dtype=np.float64, count=len(plan.scales))
+
+    question = arrays['likert_question']
+    norm = (arrays['likert_value'] - mins[question]) / spans[question]
+    # max(0.0, min(1.0, norm)): NaN and values above 1 become 1, then <= 0 becomes 0.
+    norm = np.where(norm <= 1.0, norm, 1.0)
+    norm = np.where(norm <= 0.0, 0.0, norm)
+    if reverse_scored and plan.reverse_scored:
+        inverted = np.fromiter((qid in plan.reverse_scored for qid in plan.scales), dtype=bool, count=len(plan.scales))
+        norm = np.where(inverted[question], 1.0 - norm, norm)
+    likert_sum = np.bincount(arrays['likert_record'], weights=norm * 100.0, minlength=count).astype(np.float64)
+    likert_count = np.bincount(arrays['likert_record'], minlength=count)
+
+    selected = arrays['mcq_selected']
+    pct = np.divide(arrays['mcq_positive'], selected, out=np.zeros_like(selected), where=selected > 0) * 100.0
+    mcq_sum = np.bincount(arrays['mcq_record'], weights=pct, minlength=count).astype(np.float64)
+    mcq_count = np.bincount(arrays['mcq_record'], minlength=count)
+
+    has_likert = likert_count > 0
+    has_mcq = mcq_count > 0
+    likert_mean = np.divide(likert_sum, likert_count, out=np.zeros_like(likert_sum), where=has_likert)
+    mcq_mean = np.divide(mcq_sum, mcq_count, out=np.zeros_like(mcq_sum), where=has_mcq)
+    overall = np.where(
+        has_likert & has_mcq,
+        (likert_mean + mcq_mean) / 2.0,
+        np.where(has_likert, likert_mean, np.where(has_mcq, mcq_mean, 0.0))
+    )
+    return overall, likert_mean, mcq_mean, likert_count, mcq_count
+
+
+def _to_scores(overall, likert_mean, mcq_mean, likert_count, mcq_count) -> List[Dict[str, Any]]:
+    return [
+        {
+            'overall': row_overall,
+            'likert_mean': row_likert if row_likert_count else None,
+            'mcq_mean': row_mcq if row_mcq_count else None,
+            'likert_count': row_likert_count,
+            'mcq_count': row_mcq_count
+        }
+        for row_overall, row_likert, row_mcq, row_likert_count, row_mcq_count in zip(
+            _round2(overall), _round2(likert_mean), _round2(mcq_mean), likert_count.tolist(), mcq_count.tolist()
+        )
+    ]
+
+
+def score_batch(plan: ScoringPlan, answers_list: List[Any], reverse_scored: bool = False) -> List[Dict[str, Any]]:
+    """Scores for many answer dicts at once; element ``i`` equals ``plan.score(answers_list[i])``
+    (with reverse-scored scale questions inverted when ``reverse_scored``)."""
+    return _to_scores(*_score_arrays(plan, answers_list, reverse_scored))
+
+
+_worker_plan: Optional[ScoringPlan] = None
+
+
+def _init_worker(plan: ScoringPlan) -> None:
+    global _worker_plan
+    _worker_plan = plan
+
+
+def _score_chunk(args: Tuple[List[Any], bool]) -> Tuple[np.ndarray, ...]:
+    answers_list, reverse_scored = args
+    return _score_arrays(_worker_plan, answers_list, reverse_scored)
+
+
+def score_all(plan: ScoringPlan, answers_list: List[Any], reverse_scored: bool = False, workers: int = 1) -> List[Dict[str, Any]]:
+    """``score_batch`` split across a process pool for large inputs. Workers send
+    back NumPy columns, which pickle far more cheaply than score dicts."""
+    workers = max(1, min(int(workers), len(answers_list) // MIN_RECORDS_PER_WORKER))
+    if workers <= 1:
+        return score_batch(plan, answers_list, reverse_scored)
+    size = -(-len(answers_list) // workers)
+    chunks = [(answers_list[start:start + size], reverse_scored) for start in range(0, len(answers_list), size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(plan,)) as pool:
+        columns = list(zip(*pool.map(_score_chunk, chunks)))
+    return _to_scores(*(np.concatenate(column) for column in columns))
+
+
+@contextmanager
+def _locked(path: str):
+    """The exclusive ``<path>.lock`` flock app.persist_results holds while appending."""
+    with open(f'{path}.lock', 'a') as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def rescore_file(
+    path: str,
+    plan: ScoringPlan,
+    reverse_scored: bool = False,
+    workers: int = 1,
+    force: bool = False,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {'path': path, 'records': 0, 'rescored': 0, 'changed': 0, 'missing': True}
+    target = {'questions_version': plan.version, 'reverse_scored': reverse_scored}
+    with _locked(path):
+        try:
+            with open(path, 'r') as f:
+                records = json.load(f)
+        except FileNotFoundError:
+            return {'path': path, 'records': 0, 'rescored': 0, 'changed': 0, 'missing': True}
+        except ValueError:
+            raise SystemExit(f'{path}: not valid JSON')
+        if not isinstance(records, list):
+            raise SystemExit(f'{path}: expected a JSON list of results')
+
+        pending = []
+        for index, record in enumerate(records):
+            if not isinstance(record, dict):
+                continue
+            meta = record.get('score_meta') or {}
+            if not force and all(meta.get(key) == value for key, value in target.items()):
+                continue
+            pending.append(index)
+        scores = score_all(plan, [records[index].get('answers') for index in pending], reverse_scored, workers)
+
+        rescored_at = datetime.now().isoformat()
+        changed = 0
+        for index, score in zip(pending, scores):
+            record = records[index]
+            if record.get('context') == 'baseline' and not record.get('answers'):
+                # Baselines submitted without answers are stored unscored.
+                score = None
+            if record.get('score') != score:
+                changed += 1
+            record['score'] = score
+            record['score_meta'] = {**target, 'rescored_at': rescored_at}
+        stats = {'path': path, 'records': len(records), 'rescored': len(pending), 'changed': changed}
+        if dry_run or not pending:
+            return stats
+
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(records, f, indent=2)
+        os.replace(tmp_path, path)
+        return stats
+
+
+def _benchmark(plan: ScoringPlan, count: int, workers: int, reverse_scored: bool) -> None:
+    print(f'generating {count:,} synthetic submissions...')
+    answers_list = sample_submissions(plan, count, answers_per_submission=10, seed=7)
+    started = time.perf_counter()
+    scores = score_all(plan, answers_list, reverse_scored, workers)
+    elapsed = time.perf_counter() - started
+    print(f'{count:,} submissions re-scored in {elapsed:.2f}s ({count / elapsed:,.0f}/s, workers={workers})')
+    if not reverse_scored:
+        sample = random.Random(1).sample(range(count), min(count, 20000))
+        mismatches = sum(1 for index in sample if plan.score(answers_list[index]) != scores[index])
+        print(f'parity with compute_reflection_score on {len(sample):,} samples: {mismatches} mismatches')
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='*', help='result files (default: results.json)')
+    parser.add_argument('--questions', default=os.path.join(DATA_DIR, 'questions.json'))
+    parser.add_argument('--reverse-scored', action='store_true',
+                        help="invert scale questions marked '(reverse scored)', as the dashboard does")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help=f'process pool size (used once there are {MIN_RECORDS_PER_WORKER:,}+ records per worker)')
+    parser.add_argument('--force', action='store_true', help='re-score records already stamped with this version')
+    parser.add_argument('--dry-run', action='store_true', help='report what would change without writing')
+    parser.add_argument('--benchmark', type=int, metavar='N', help='time re-scoring N synthetic submissions')
+    args = parser.parse_args(argv)
+
+    plan = ScoringPlanFile(args.questions).current()
+    if not plan.scales and not plan.choices:
+        print(f'No scorable questions in {args.questions}')
+        return 1
+    if args.benchmark:
+        _benchmark(plan, args.benchmark, args.workers, args.reverse_scored)
+        return 0
+
+    for path in args.paths or DEFAULT_PATHS:
+        stats = rescore_file(path, plan, args.reverse_scored, args.workers, args.force, args.dry_run)
+        if stats.get('missing'):
+            print(f'{path}: not found, skipped')
+            continue
+        verb = 'would change' if args.dry_run else 'changed'
+        print(f"{path}: {stats['rescored']} of {stats['records']} records re-scored against "
+              f"questions v{plan.version}, {stats['changed']} {verb}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
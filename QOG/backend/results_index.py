@@ -0,0 +1,254 @@
+import json
+import os
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from threading import Lock
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - fcntl is unavailable on Windows
+    fcntl = None
+
+# Records without a parseable timestamp sort before everything else.
+UNDATED = float('-inf')
+
+
+def timestamp_key(value: Any) -> float:
+    """Epoch seconds for an ISO timestamp; naive values are local time, as stored."""
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            pass
+    return UNDATED
+
+
+def _as_record(value: Any) -> Optional[Dict[str, Any]]:
+    return value if isinstance(value, dict) else None
+
+
+def _append_offset(data: bytes, offset: int) -> Optional[int]:
+    """Where append_json_list writes next: just past the last element of the array ending ``data``."""
+    body = data.rstrip()
+    if not body.endswith(b']'):
+        return None
+    return offset + len(body[:-1].rstrip())
+
+
+class _Series:
+    """Records kept in timestamp order with a parallel list of sort keys."""
+
+    def __init__(self):
+        self.keys: List[Tuple[float, int]] = []
+        self.records: List[Dict[str, Any]] = []
+
+    def add(self, key: float, sequence: int, record: Dict[str, Any]) -> None:
+        # The file position breaks ties, so equal timestamps keep file order.
+        entry = (key, sequence)
+        if not self.keys or entry >= self.keys[-1]:
+            self.keys.append(entry)
+            self.records.append(record)
+            return
+        position = bisect_right(self.keys, entry)
+        self.keys.insert(position, entry)
+        self.records.insert(position, record)
+
+    def window(self, since: Optional[float], until: Optional[float]) -> Tuple[int, int]:
+        low = bisect_left(self.keys, (since, -1)) if since is not None else 0
+        high = bisect_left(self.keys, (until, -1)) if until is not None else len(self.keys)
+        return low, max(low, high)
+
+
+class ResultsIndex:
+    """Per-user (and per-user-and-task) views of a results file, ordered by timestamp.
+
+    Window queries bisect to ``[since, until)`` and only touch the records in
+    it. Appends made through this process are folded in by ``appended``. Any
+    other change to the file shows up as a new mtime/size: if the file only
+    grew (another worker appended), the next query reads just the new tail and
+    merges those records, each passed through ``normalize``; if it shrank, was
+    replaced (a re-score) or its tail does not parse, the index is rebuilt
+    from ``loader``. Records carrying a
+    ``client_record_id`` can also be looked up by (user_id, id).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        loader: Callable[[], List[Dict[str, Any]]],
+        normalize: Callable[[Any], Optional[Dict[str, Any]]] = _as_record,
+    ):
+        self.path = path
+        self.loader = loader
+        self.normalize = normalize
+        self.rebuilds = 0
+        self.tail_reads = 0
+        self._lock = Lock()
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._inode: Optional[int] = None
+        self._end: Optional[int] = None
+        self._count = 0
+        self._users: Dict[str, _Series] = {}
+        self._tasks: Dict[Tuple[str, Any], _Series] = {}
+        self._client_records: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _add(self, record: Dict[str, Any]) -> None:
+        sequence = self._count
+        self._count += 1
+        user_id = record.get('user_id')
+        if not user_id:
+            return
+        key = timestamp_key(record.get('timestamp'))
+        series = self._users.get(user_id)
+        if series is None:
+            series = self._users[user_id] = _Series()
+        series.add(key, sequence, record)
+        client_record_id = record.get('client_record_id')
+        if client_record_id:
+            self._client_records.setdefault((user_id, client_record_id), record)
+        task_id = record.get('task_id')
+        if task_id is not None:
+            task_series = self._tasks.get((user_id, task_id))
+            if task_series is None:
+                task_series = self._tasks[(user_id, task_id)] = _Series()
+            task_series.add(key, sequence, record)
+
+    def _ensure_current(self) -> None:
+        stamp = self.file_stamp()
+        if stamp is not None and stamp == self._stamp:
+            return
+        grew = stamp is not None and self._stamp is not None and stamp[1] > self._stamp[1]
+        if grew and self._end is not None and self._read_tail():
+            self.tail_reads += 1
+            return
+        self._users = {}
+        self._tasks = {}
+        self._client_records = {}
+        self._count = 0
+        self._stamp = self._inode = self._end = None
+        try:
+            f = open(self.path, 'rb')
+        except OSError:
+            f = None
+        try:
+            if f is not None:
+                # Hold appends off until the loader has read the same bytes we stamped.
+                self._snapshot(f)
+            for record in self.loader():
+                self._add(record)
+        finally:
+            if f is not None:
+                f.close()
+        self.rebuilds += 1
+
+    def _snapshot(self, f) -> None:
+        """Stamp the open file ``f`` and note where the next append will start; leaves it share-locked."""
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_SH)
+        stat = os.fstat(f.fileno())
+        start = max(0, stat.st_size - 4096)
+        f.seek(start)
+        self._stamp = (stat.st_mtime_ns, stat.st_size)
+        self._inode = stat.st_ino
+        self._end = _append_offset(f.read(), start)
+
+    def _read_tail(self) -> bool:
+        """Merge the records appended since the last sync; False if the file must be rebuilt.
+
+        append_json_list overwrites the old closing bracket, so from ``self._end``
+        on the file holds ``,\n<records>\n]``.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                if fcntl is not None:
+                    # Wait out an in-progress append_json_list from another worker.
+                    fcntl.flock(f, fcntl.LOCK_SH)
+                stat = os.fstat(f.fileno())
+                if stat.st_ino != self._inode or stat.st_size <= self._stamp[1]:
+                    return False
+                f.seek(self._end)
+                raw = f.read(stat.st_size - self._end)
+        except OSError:
+            return False
+        tail = raw.lstrip()
+        if tail.startswith(b','):
+            tail = tail[1:]
+        elif self._count:
+            return False
+        try:
+            records = json.loads(b'[' + tail)
+        except ValueError:
+            return False
+        end = _append_offset(raw, self._end)
+        if not isinstance(records, list) or end is None:
+            return False
+        for record in records:
+            record = self.normalize(record)
+            if record is not None:
+                self._add(record)
+        self._stamp = (stat.st_mtime_ns, stat.st_size)
+        self._end = end
+        return True
+
+    def appended(self, records: List[Dict[str, Any]], stamp_before: Optional[Tuple[int, int]]) -> None:
+        """Note that ``records`` were appended to a file that had ``stamp_before``."""
+        with self._lock:
+            if self._stamp is None or stamp_before != self._stamp:
+                # Not built yet, or the file moved on without us; catch up on the next query.
+                return
+            for record in records:
+                self._add(record)
+            try:
+                with open(self.path, 'rb') as f:
+                    self._snapshot(f)
+            except OSError:
+                self._stamp = None
+
+    def client_records(self, keys: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """Stored records for the given (user_id, client_record_id) pairs, where they exist."""
+        with self._lock:
+            self._ensure_current()
+            return {key: self._client_records[key] for key in keys if key in self._client_records}
+
+    def query(
+        self,
+        user_id: str,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        context: Optional[str] = None,
+        task_id: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """The user's records in ``[since, until)``, oldest first.
+
+        ``limit`` keeps the newest matching records. Without a ``since``,
+        records with no usable timestamp come first.
+        """
+        with self._lock:
+            self._ensure_current()
+            series = self._tasks.get((user_id, task_id)) if task_id is not None else self._users.get(user_id)
+            if series is None:
+                return []
+            low, high = series.window(since, until)
+            if context is None:
+                if limit is not None:
+                    low = max(low, high - limit)
+                return series.records[low:high]
+            matches = []
+            # Walk back from the newest record so a limit stops the scan early.
+            for position in range(high - 1, low - 1, -1):
+                record = series.records[position]
+                if record.get('context') == context:
+                    matches.append(record)
+                    if limit is not None and len(matches) >= limit:
+                        break
+            matches.reverse()
+            return matches
@@ -0,0 +1,254 @@
+"""Reflection scoring against a compiled question bank.
+
+``compile_scoring_plan`` turns ``questions.json`` into lookup tables once, so
+scoring a submission is a dict lookup and a little arithmetic per answer.
+``ScoringPlanFile`` keeps the plan current, recompiling only when the file's
+mtime or its ``version``/questions change. Benchmark with::
+
+    python scoring.py --benchmark
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from threading import Lock
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+# qid -> (min, max - min); zero-width scales are dropped at compile time.
+ScaleRule = Tuple[float, float]
+# qid -> (single choice?, positive options, all known options)
+ChoiceRule = Tuple[bool, FrozenSet[str], FrozenSet[str]]
+
+
+def is_positive_option(option: str) -> bool:
+    """Options tagged '(+1)' count towards the MCQ score."""
+    return '+1' in option
+
+
+def is_reverse_scored(question: Dict[str, Any]) -> bool:
+    """Same test as the dashboard's isReverseScored: the title or text says 'reverse scored'."""
+    return 'reverse scored' in f"{question.get('title') or ''} {question.get('question') or ''}".lower()
+
+
+class ScoringPlan:
+    def __init__(
+        self,
+        version: Any,
+        scales: Dict[str, ScaleRule],
+        choices: Dict[str, ChoiceRule],
+        reverse_scored: FrozenSet[str] = frozenset(),
+    ):
+        self.version = version
+        self.scales = scales
+        self.choices = choices
+        # Scale questions the dashboard inverts; score() itself does not.
+        self.reverse_scored = reverse_scored
+
+    def score(self, answers: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Likert answers normalise to 0-100 via (x - min) / (max - min); MCQ answers
+        score the percentage of selected options tagged (+1); overall averages the
+        Likert and MCQ means when both are present."""
+        scales = self.scales
+        choices = self.choices
+        likert_scores: List[float] = []
+        mcq_scores: List[float] = []
+        add_likert = likert_scores.append
+        add_mcq = mcq_scores.append
+
+        for qid, value in (answers or {}).items():
+            scale = scales.get(qid)
+            if scale is not None:
+                try:
+                    x = float(value)
+                except Exception:
+                    continue
+                min_v, span = scale
+                norm = (x - min_v) / span
+                # Same clamp as max(0.0, min(1.0, norm)), NaN included.
+                if not norm <= 1.0:
+                    norm = 1.0
+                elif norm <= 0.0:
+                    norm = 0.0
+                add_likert(norm * 100.0)
+                continue
+            choice = choices.get(qid)
+            if choice is None:
+                continue
+            single, positives, options = choice
+            if single:
+                selected = [value] if isinstance(value, str) else []
+            else:
+                selected = value if isinstance(value, list) else []
+            if not selected:
+                add_mcq(0.0)
+                continue
+            positive_count = 0
+            for option in selected:
+                if not isinstance(option, str):
+                    continue
+                if option in positives:
+                    positive_count += 1
+                elif option not in options and is_positive_option(option):
+                    # Free-text or stale options are judged by their tag, as before.
+                    positive_count += 1
+            add_mcq((positive_count / len(selected)) * 100.0)
+
+        likert_mean = sum(likert_scores) / len(likert_scores) if likert_scores else None
+        mcq_mean = sum(mcq_scores) / len(mcq_scores) if mcq_scores else None
+
+        if likert_mean is not None and mcq_mean is not None:
+            overall = (likert_mean + mcq_mean) / 2.0
+        elif likert_mean is not None:
+            overall = likert_mean
+        elif mcq_mean is not None:
+            overall = mcq_mean
+        else:
+            overall = 0.0
+
+        return {
+            'overall': round(overall, 2),
+            'likert_mean': round(likert_mean, 2) if likert_mean is not None else None,
+            'mcq_mean': round(mcq_mean, 2) if mcq_mean is not None else None,
+            'likert_count': len(likert_scores),
+            'mcq_count': len(mcq_scores)
+        }
+
+
+def compile_scoring_plan(bank: Any) -> ScoringPlan:
+    """Build a plan from a question bank payload (``{'version', 'questions'}``).
+
+    Later questions win on duplicate ids. Questions that cannot be scored
+    (unknown type, zero-width or malformed scale) are left out.
+    """
+    bank = bank if isinstance(bank, dict) else {}
+    questions = bank.get('questions') or []
+    q_by_id = {q.get('id'): q for q in questions if isinstance(q, dict)}
+    scales: Dict[str, ScaleRule] = {}
+    choices: Dict[str, ChoiceRule] = {}
+    reverse_scored = set()
+    for qid, q in q_by_id.items():
+        if not q:
+            continue
+        qtype = q.get('type')
+        if qtype == 'scale':
+            try:
+                scale = q.get('scale', {})
+                min_v = float(scale.get('min', 1))
+                max_v = float(scale.get('max', 5))
+            except (AttributeError, TypeError, ValueError):
+                continue
+            if max_v != min_v:
+                scales[qid] = (min_v, max_v - min_v)
+                if is_reverse_scored(q):
+                    reverse_scored.add(qid)
+        elif qtype in ('single', 'multi'):
+            options = frozenset(opt for opt in q.get('options') or [] if isinstance(opt, str))
+            positives = frozenset(opt for opt in options if is_positive_option(opt))
+            choices[qid] = (qtype == 'single', positives, options)
+    return ScoringPlan(bank.get('version'), scales, choices, frozenset(reverse_scored))
+
+
+class ScoringPlanFile:
+    """The compiled plan for a question bank file, refreshed when the file changes.
+
+    The file is stat'ed at most once per ``check_interval`` seconds, so
+    ``current()`` is normally just a clock read. A changed mtime re-reads the
+    file, but the plan is only recompiled when ``version`` or the questions
+    differ. A file that fails to parse (e.g. mid-write) keeps the previous
+    plan and is retried on the next call.
+    """
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = float(check_interval)
+        self.compiles = 0
+        self._checked_at = float('-inf')
+        self._lock = Lock()
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._bank: Any = None
+        self._plan = compile_scoring_plan({})
+
+    def current(self) -> ScoringPlan:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self._plan
+        self._checked_at = now
+        try:
+            stat = os.stat(self.path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return self._plan
+        if stamp == self._stamp:
+            return self._plan
+        with self._lock:
+            if stamp != self._stamp:
+                try:
+                    with open(self.path, 'r') as f:
+                        bank = json.load(f)
+                except (OSError, ValueError):
+                    self._checked_at = float('-inf')
+                    return self._plan
+                if self._bank is None or not isinstance(bank, dict) or bank.get('version') != self._bank.get('version') \
+                        or bank.get('questions') != self._bank.get('questions'):
+                    self._plan = compile_scoring_plan(bank)
+                    self._bank = bank if isinstance(bank, dict) else {}
+                    self.compiles += 1
+                self._stamp = stamp
+        return self._plan
+
+    @property
+    def bank(self) -> Dict[str, Any]:
+        """The raw payload behind the current plan."""
+        return self._bank or {}
+
+
+def sample_submissions(plan: ScoringPlan, count: int, answers_per_submission: int, seed: int) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    qids = list(plan.scales) + list(plan.choices)
+    submissions = []
+    for _ in range(count):
+        answers: Dict[str, Any] = {}
+        for qid in rng.sample(qids, min(answers_per_submission, len(qids))):
+            if qid in plan.scales:
+                low, span = plan.scales[qid]
+                answers[qid] = rng.randint(int(low), int(low + span))
+            else:
+                single, _, options = plan.choices[qid]
+                ordered = sorted(options)
+                answers[qid] = rng.choice(ordered) if single else rng.sample(ordered, rng.randint(1, len(ordered)))
+        submissions.append(answers)
+    return submissions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Reflection scoring tools')
+    parser.add_argument('--benchmark', action='store_true', help='measure submissions scored per second')
+    parser.add_argument('--questions', default=os.path.join(
+        os.environ.get('DATA_DIR', os.path.dirname(os.path.abspath(__file__))), 'questions.json'))
+    parser.add_argument('--submissions', type=int, default=100000)
+    parser.add_argument('--answers', type=int, default=10, help='answers per synthetic submission')
+    args = parser.parse_args(argv)
+    if not args.benchmark:
+        parser.print_help()
+        return 0
+
+    plan_file = ScoringPlanFile(args.questions)
+    plan = plan_file.current()
+    if not plan.scales and not plan.choices:
+        print(f'No scorable questions in {args.questions}')
+        return 1
+    submissions = sample_submissions(plan, args.submissions, args.answers, seed=42)
+    started = time.perf_counter()
+    for answers in submissions:
+        plan_file.current().score(answers)
+    elapsed = time.perf_counter() - started
+    print(f'{len(submissions)} submissions x {args.answers} answers in {elapsed:.3f}s: '
+          f'{len(submissions) / elapsed:,.0f} submissions/s (plan version {plan.version}, '
+          f'{len(plan.scales)} scale + {len(plan.choices)} choice questions)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
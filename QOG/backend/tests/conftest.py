@@ -0,0 +1,41 @@
+import importlib
+import os
+import shutil
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """The Flask app imported against a throwaway copy of the data files and the fake LLM provider."""
+    data_dir = tmp_path_factory.mktemp('data')
+    for name in os.listdir(BACKEND_DIR):
+        if name.endswith('.json'):
+            shutil.copy(os.path.join(BACKEND_DIR, name), data_dir)
+    os.makedirs(data_dir / 'task_history', exist_ok=True)
+    patched = {
+        'DATA_DIR': str(data_dir),
+        'LLM_PROVIDER': 'fake',
+        'FAKE_LLM_LATENCY_MS': 'fixed:0',
+    }
+    previous = {key: os.environ.get(key) for key in patched}
+    os.environ.update(patched)
+    sys.modules.pop('app', None)
+    try:
+        yield importlib.import_module('app')
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,10 @@
+def test_rate_limiting_is_opt_in(app_module):
+    assert app_module.rate_limiter is None
+
+
+def test_quotas_are_opt_in(app_module):
+    assert app_module.quota_enforcer is None
+
+
+def test_cross_task_memory_is_opt_in(app_module):
+    assert app_module.user_memory is None
@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from idempotency import FileIdempotencyStore, IdempotencyStore
+
+
+@pytest.fixture
+def task(app_module, client):
+    user_id = next(iter(app_module.load_users()))
+    return client.post('/api/new-task', json={'user_id': user_id}).get_json()
+
+
+def _send(client, task, message, key):
+    return client.post(
+        '/api/send-message',
+        json={'user_id': task['user_id'], 'task_id': task['id'], 'message': message},
+        headers={'Idempotency-Key': key}
+    )
+
+
+def test_retry_with_same_key_replays_the_first_response(app_module, client, task):
+    first = _send(client, task, 'hello', 'replay-key')
+    second = _send(client, task, 'hello', 'replay-key')
+    assert first.status_code == second.status_code == 200
+    assert 'Idempotent-Replayed' not in first.headers
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert second.get_json() == first.get_json()
+    # The message was only processed once.
+    assert len(app_module.tasks_by_id[task['id']].messages) == 2
+
+
+def test_same_key_with_a_different_body_is_rejected(client, task):
+    assert _send(client, task, 'hello', 'conflict-key').status_code == 200
+    response = _send(client, task, 'something else', 'conflict-key')
+    assert response.status_code == 422
+
+
+@pytest.fixture(params=['memory', 'file'])
+def store_pair(request, tmp_path):
+    """Two handles on one store, standing in for two requests (or two worker processes)."""
+    if request.param == 'memory':
+        store = IdempotencyStore(ttl_seconds=60)
+        return store, store
+    path = str(tmp_path / 'idempotency.json')
+    return FileIdempotencyStore(path, ttl_seconds=60), FileIdempotencyStore(path, ttl_seconds=60)
+
+
+def test_concurrent_duplicate_waits_for_the_original(store_pair):
+    owner, other = store_pair
+    state, entry = owner.begin('key', 'fp')
+    assert state == 'new'
+    state, waiting = other.begin('key', 'fp')
+    assert state == 'pending'
+    finisher = threading.Timer(0.2, owner.finish, args=('key', entry, 200, b'body', {'X-Test': '1'}))
+    finisher.start()
+    assert other.wait('key', waiting, timeout=5)
+    finisher.join()
+    assert (waiting.status, waiting.body) == (200, b'body')
+    state, replayed = other.begin('key', 'fp')
+    assert state == 'replay'
+    assert (replayed.status, replayed.body, replayed.headers) == (200, b'body', {'X-Test': '1'})
+    assert other.begin('key', 'other-fp')[0] == 'conflict'
+
+
+def test_released_key_runs_again(store_pair):
+    owner, other = store_pair
+    _, entry = owner.begin('key', 'fp')
+    owner.finish('key', entry, 500, b'error', keep=False)
+    assert other.begin('key', 'fp')[0] == 'new'
+
+
+def test_wait_times_out_when_the_original_never_finishes(store_pair):
+    owner, other = store_pair
+    owner.begin('key', 'fp')
+    _, waiting = other.begin('key', 'fp')
+    assert not other.wait('key', waiting, timeout=0.2)
@@ -0,0 +1,132 @@
+import pytest
+
+import llm_resilience
+from llm_providers import FakeProvider, TransientLLMError
+from llm_resilience import CircuitBreaker, CircuitOpenError, ResilientLLM
+from metrics import Metrics
+
+CONTENTS = [{'role': 'user', 'parts': [{'text': 'hello'}]}]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_resilience.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def _open_breaker(breaker):
+    while breaker.state == 'closed':
+        breaker.record_failure()
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    assert not breaker.record_failure()
+    assert not breaker.record_failure()
+    breaker.record_success()
+    assert not breaker.record_failure()
+    assert not breaker.record_failure()
+    assert breaker.state == 'closed'
+    assert breaker.record_failure()
+    assert breaker.state == 'open'
+    with pytest.raises(CircuitOpenError) as raised:
+        breaker.allow()
+    assert raised.value.retry_after == pytest.approx(30)
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    _open_breaker(breaker)
+    clock[0] += 30
+    assert breaker.state == 'half_open'
+    breaker.allow()
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_successful_probe_closes_the_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    _open_breaker(breaker)
+    clock[0] += 30
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    breaker.allow()
+    breaker.allow()
+
+
+def test_failed_probe_reopens_the_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30)
+    _open_breaker(breaker)
+    clock[0] += 30
+    breaker.allow()
+    assert breaker.record_failure()
+    assert breaker.state == 'open'
+    clock[0] += 29
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_released_probe_lets_the_next_caller_probe(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    _open_breaker(breaker)
+    clock[0] += 30
+    breaker.allow()
+    breaker.release_probe()
+    assert breaker.state == 'half_open'
+    breaker.allow()
+
+
+@pytest.fixture
+def llm(clock):
+    return ResilientLLM(FakeProvider(), Metrics(), breaker_failure_threshold=1, breaker_reset_timeout=30)
+
+
+def test_stream_outcomes_reach_the_breaker(llm, clock):
+    _open_breaker(llm.breaker)
+    clock[0] += 30
+    assert ''.join(llm.stream(CONTENTS))
+    assert llm.breaker.state == 'closed'
+
+    llm.provider.error_rate = 1.0
+    with pytest.raises(TransientLLMError):
+        list(llm.stream(CONTENTS))
+    assert llm.breaker.state == 'open'
+
+
+def test_abandoned_stream_releases_the_probe(llm, clock):
+    _open_breaker(llm.breaker)
+    clock[0] += 30
+    chunks = llm.stream(CONTENTS)
+    next(chunks)
+    chunks.close()
+    assert llm.breaker.state == 'half_open'
+    assert ''.join(llm.stream(CONTENTS))
+    assert llm.breaker.state == 'closed'
+
+
+def test_stream_keeps_the_same_counters_as_generate(llm):
+    assert ''.join(llm.stream(CONTENTS))
+    chunks = llm.stream(CONTENTS)
+    next(chunks)
+    chunks.close()
+    llm.provider.error_rate = 1.0
+    with pytest.raises(TransientLLMError):
+        list(llm.stream(CONTENTS))
+    snapshot = llm.metrics.snapshot()
+    counters = snapshot['counters']
+    assert counters['llm.calls'] == 3
+    assert (counters['llm.successes'], counters['llm.cancelled'], counters['llm.failures']) == (1, 1, 1)
+    assert snapshot['observations']['llm.latency_ms']['count'] == 1
+
+
+def test_generate_fails_fast_while_open(llm, clock):
+    llm.provider.error_rate = 1.0
+    llm.max_attempts = 1
+    with pytest.raises(TransientLLMError):
+        llm.generate(CONTENTS)
+    assert llm.breaker.state == 'open'
+    with pytest.raises(CircuitOpenError):
+        llm.generate(CONTENTS)
+    assert llm.metrics.snapshot()['counters']['llm.circuit_rejections'] == 1
@@ -0,0 +1,111 @@
+import bisect
+import json
+import random
+
+import pytest
+
+from quantiles import KLLSketch, SketchStore, percentile_of
+
+# Observed worst case is under 0.8 points at k=200; the bound leaves headroom
+# for other seeds while still catching a broken compactor.
+MAX_RANK_ERROR = 2.0
+
+
+@pytest.fixture(scope='module')
+def values():
+    rng = random.Random(11)
+    return [rng.gauss(50, 15) for _ in range(50000)]
+
+
+def _worst_rank_error(sketch, ordered):
+    worst = 0.0
+    for step in range(1, 100):
+        value = ordered[step * len(ordered) // 100]
+        exact = 100.0 * (bisect.bisect_left(ordered, value) + 0.5) / len(ordered)
+        percentile, population = percentile_of(value, [sketch])
+        assert population == len(ordered)
+        worst = max(worst, abs(percentile - exact))
+    return worst
+
+
+def test_rank_error_is_bounded_and_memory_is_sublinear(values):
+    sketch = KLLSketch(200, seed=1)
+    for value in values:
+        sketch.update(value)
+    assert sum(len(items) for items in sketch.levels) < 3 * 200 * 2
+    assert _worst_rank_error(sketch, sorted(values)) <= MAX_RANK_ERROR
+
+
+def test_merged_and_serialised_sketches_keep_the_bound(values):
+    parts = [KLLSketch(200, seed=seed) for seed in range(3)]
+    for index, value in enumerate(values):
+        parts[index % 3].update(value)
+    merged = KLLSketch.from_dict(json.loads(json.dumps(parts[0].to_dict())))
+    merged.merge(parts[1])
+    merged.merge(KLLSketch.from_dict(json.loads(json.dumps(parts[2].to_dict()))))
+    assert merged.n == len(values)
+    assert _worst_rank_error(merged, sorted(values)) <= MAX_RANK_ERROR
+
+
+def test_quantile_lands_within_the_rank_bound(values):
+    sketch = KLLSketch(200, seed=2)
+    for value in values:
+        sketch.update(value)
+    ordered = sorted(values)
+    for q in (0.05, 0.25, 0.5, 0.75, 0.95):
+        rank = 100.0 * bisect.bisect_left(ordered, sketch.quantile(q)) / len(ordered)
+        assert abs(rank - 100.0 * q) <= MAX_RANK_ERROR
+
+
+def test_small_populations_are_exact_and_ties_take_the_mid_rank():
+    sketch = KLLSketch(200)
+    for value in [0] * 50 + [100] * 50:
+        sketch.update(value)
+    assert percentile_of(100, [sketch]) == (75.0, 100)
+    assert percentile_of(0, [sketch]) == (25.0, 100)
+    assert percentile_of(50, [sketch]) == (50.0, 100)
+    assert percentile_of(1, [KLLSketch()]) == (None, 0)
+
+
+def test_stores_sharing_a_file_see_each_others_values(tmp_path):
+    path = str(tmp_path / 'benchmarks.json')
+    first = SketchStore(path, flush_interval=1e9)
+    second = SketchStore(path, flush_interval=1e9)
+    assert first.seed_if_missing(lambda: [{'A': 10}, {'A': 20}])
+    assert not second.seed_if_missing(lambda: [{'A': 99}])
+    first.add({'A': 30})
+    second.add({'A': 40})
+    first.flush()
+    second.flush()
+    first.flush()
+    assert first.percentile('A', 25) == second.percentile('A', 25) == (50.0, 4)
+
+
+def test_percentiles_rank_the_users_latest_submission(app_module, client):
+    user_id = next(iter(app_module.load_users()))
+    bank = app_module.read_json_file(app_module.QUESTIONS_PATH, {'questions': []})
+    scales = [q for q in bank['questions'] if q.get('type') == 'scale']
+    answers = {q['id']: q['scale'].get('max', 5) for q in scales}
+    response = client.post('/api/reflection/submit', json={'user_id': user_id, 'task_id': 't', 'answers': answers})
+    assert response.status_code == 200
+    latest = app_module.results_index.query(user_id, limit=1)[0]
+    expected = app_module.record_domain_scores(latest, app_module._dashboard_rules())
+
+    body = client.get(f'/api/benchmarks/percentiles?user_id={user_id}').get_json()
+    reported = {entry['domain']: entry for entry in body['domains']}
+    assert set(expected) <= set(reported)
+    for domain, score in expected.items():
+        assert reported[domain]['score'] == round(score, 2)
+        assert reported[domain]['scored_at'] == latest['timestamp']
+        assert 0.0 <= reported[domain]['percentile'] <= 100.0
+
+
+def test_percentiles_read_the_aggregate_not_the_results_history(app_module, client, monkeypatch):
+    user_id = next(iter(app_module.load_users()))
+    expected = client.get(f'/api/benchmarks/percentiles?user_id={user_id}').get_json()
+
+    def no_scan(*args, **kwargs):
+        raise AssertionError('percentiles walked the results history')
+
+    monkeypatch.setattr(app_module.results_index, 'query', no_scan)
+    assert client.get(f'/api/benchmarks/percentiles?user_id={user_id}').get_json() == expected
@@ -0,0 +1,65 @@
+import rate_limit
+from rate_limit import BucketSpec, FileBucketStore, RateLimiter, _decide
+
+
+def test_bucket_debits_until_empty_then_refills_at_its_rate():
+    states = {}
+    spec = BucketSpec('user:u:requests', capacity=2, rate=1.0)
+    assert _decide(states, [spec], now=0.0).allowed
+    assert _decide(states, [spec], now=0.0).allowed
+    denied = _decide(states, [spec], now=0.0)
+    assert not denied.allowed
+    assert denied.remaining == 0
+    assert denied.retry_after == 1
+    # Half a token is not enough; a full second refills one.
+    assert not _decide(states, [spec], now=0.5).allowed
+    assert _decide(states, [spec], now=1.0).allowed
+    # Refill is capped at capacity however long the bucket sits idle.
+    decision = _decide(states, [spec], now=100.0)
+    assert decision.allowed and decision.remaining == 1
+
+
+def test_buckets_are_debited_all_or_nothing():
+    states = {}
+    requests = BucketSpec('user:u:requests', capacity=5, rate=1.0)
+    tokens = BucketSpec('user:u:tokens', capacity=100, rate=1.0, cost=80)
+    assert _decide(states, [requests, tokens], now=0.0).allowed
+    denied = _decide(states, [requests, tokens], now=0.0)
+    assert not denied.allowed
+    # The request bucket was not charged for the rejected call.
+    assert states['user:u:requests'][0] == 4
+    assert denied.retry_after == 60
+
+
+def test_token_cost_is_capped_at_capacity():
+    spec = BucketSpec('global:tokens', capacity=10, rate=1.0, cost=500)
+    assert spec.cost == 10
+    assert _decide({}, [spec], now=0.0).allowed
+
+
+def test_rate_limiter_limits_users_independently(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(rate_limit.time, 'monotonic', lambda: clock[0])
+    limiter = RateLimiter(
+        user_rps=1, user_burst=2, user_tokens_per_minute=0,
+        global_rps=0, global_burst=0, global_tokens_per_minute=0
+    )
+    assert limiter.check('alice', 10).allowed
+    assert limiter.check('alice', 10).allowed
+    assert not limiter.check('alice', 10).allowed
+    assert limiter.check('bob', 10).allowed
+    clock[0] += 1.0
+    assert limiter.check('alice', 10).allowed
+
+
+def test_file_store_shares_buckets_between_workers(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(rate_limit.time, 'time', lambda: clock[0])
+    path = str(tmp_path / 'rate_limits.json')
+    first, second = FileBucketStore(path), FileBucketStore(path)
+    spec = BucketSpec('global:requests', capacity=2, rate=1.0)
+    assert first.consume([spec]).allowed
+    assert second.consume([spec]).allowed
+    assert not first.consume([spec]).allowed
+    clock[0] += 1.0
+    assert second.consume([spec]).allowed
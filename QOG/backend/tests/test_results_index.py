@@ -0,0 +1,57 @@
+import json
+import os
+
+from results_index import ResultsIndex
+
+
+def _record(n, user_id='u'):
+    return {'user_id': user_id, 'task_id': 't', 'timestamp': f'2025-01-01T00:00:{n:02d}', 'n': n}
+
+
+def _index(path):
+    def loader():
+        with open(path) as f:
+            return json.load(f)
+    return ResultsIndex(path, loader)
+
+
+def test_appends_from_another_worker_are_read_from_the_tail(app_module, tmp_path):
+    path = str(tmp_path / 'results.json')
+    app_module.append_json_list(path, [_record(1), _record(2)])
+    index = _index(path)
+    assert [r['n'] for r in index.query('u')] == [1, 2]
+    # Written without telling the index, as another worker process would.
+    app_module.append_json_list(path, [_record(4), _record(3, 'v')])
+    app_module.append_json_list(path, [_record(0)])
+    assert [r['n'] for r in index.query('u')] == [0, 1, 2, 4]
+    assert [r['n'] for r in index.query('v')] == [3]
+    assert [r['n'] for r in index.query('u', task_id='t', limit=1)] == [4]
+    assert (index.rebuilds, index.tail_reads) == (1, 1)
+
+
+def test_tail_read_starts_from_an_empty_array(app_module, tmp_path):
+    path = tmp_path / 'results.json'
+    path.write_text('[]')
+    index = _index(str(path))
+    assert index.query('u') == []
+    app_module.append_json_list(str(path), [_record(1)])
+    assert [r['n'] for r in index.query('u')] == [1]
+    assert (index.rebuilds, index.tail_reads) == (1, 1)
+
+
+def test_replaced_or_shrunk_file_is_rebuilt(app_module, tmp_path):
+    path = str(tmp_path / 'results.json')
+    app_module.append_json_list(path, [_record(1), _record(2)])
+    index = _index(path)
+    index.query('u')
+    # A re-score writes a new file and renames it over the old one.
+    replacement = str(tmp_path / 'results.json.tmp')
+    with open(replacement, 'w') as f:
+        json.dump([_record(1), _record(2), {**_record(3), 'rescored': True}], f, indent=2)
+    os.replace(replacement, path)
+    assert [r.get('rescored', False) for r in index.query('u')] == [False, False, True]
+    assert index.rebuilds == 2
+    with open(path, 'w') as f:
+        json.dump([_record(5)], f)
+    assert [r['n'] for r in index.query('u')] == [5]
+    assert (index.rebuilds, index.tail_reads) == (3, 0)
@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+
+def test_append_json_list_appends_to_an_array(app_module, tmp_path):
+    path = str(tmp_path / 'results.json')
+    app_module.append_json_list(path, [{'id': 1}])
+    app_module.append_json_list(path, [{'id': 2}, {'id': 3}])
+    with open(path) as f:
+        assert json.load(f) == [{'id': 1}, {'id': 2}, {'id': 3}]
+
+
+def test_append_json_list_appends_to_an_empty_array(app_module, tmp_path):
+    path = tmp_path / 'results.json'
+    path.write_text('[]\n')
+    app_module.append_json_list(str(path), [{'id': 1}])
+    assert json.loads(path.read_text()) == [{'id': 1}]
+
+
+@pytest.mark.parametrize('content', [
+    '{"results": [{"id": 1}]}',
+    '[{"id": 1}, {"id": 2}',
+    'not json at all',
+    '"a string"',
+])
+def test_append_json_list_refuses_to_overwrite_a_malformed_file(app_module, tmp_path, content):
+    path = tmp_path / 'results.json'
+    path.write_text(content)
+    with pytest.raises(ValueError):
+        app_module.append_json_list(str(path), [{'id': 3}])
+    assert path.read_text() == content
@@ -0,0 +1,184 @@
+import json
+import math
+import os
+import random
+import threading
+import time
+
+import pytest
+
+from rescore_results import _locked, rescore_file, score_batch
+from scoring import compile_scoring_plan
+
+QUESTIONS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'questions.json')
+
+
+def legacy_score(bank, answers):
+    """compute_reflection_score as it was before scoring.py, kept as the reference."""
+    q_by_id = {q.get('id'): q for q in bank.get('questions', [])}
+    likert_scores = []
+    mcq_scores = []
+    for qid, value in (answers or {}).items():
+        q = q_by_id.get(qid)
+        if not q:
+            continue
+        qtype = q.get('type')
+        if qtype == 'scale':
+            scale = q.get('scale', {})
+            min_v = float(scale.get('min', 1))
+            max_v = float(scale.get('max', 5))
+            try:
+                x = float(value)
+            except Exception:
+                continue
+            if max_v == min_v:
+                continue
+            norm = max(0.0, min(1.0, (x - min_v) / (max_v - min_v)))
+            likert_scores.append(norm * 100.0)
+        elif qtype in ('single', 'multi'):
+            if qtype == 'single':
+                selected = [value] if isinstance(value, str) else []
+            else:
+                selected = value if isinstance(value, list) else []
+            if not selected:
+                mcq_scores.append(0.0)
+                continue
+            pos_selected = [opt for opt in selected if isinstance(opt, str) and ('(+1' in opt or '+1' in opt)]
+            mcq_scores.append((len(pos_selected) / len(selected)) * 100.0)
+    likert_mean = sum(likert_scores) / len(likert_scores) if likert_scores else None
+    mcq_mean = sum(mcq_scores) / len(mcq_scores) if mcq_scores else None
+    if likert_mean is not None and mcq_mean is not None:
+        overall = (likert_mean + mcq_mean) / 2.0
+    elif likert_mean is not None:
+        overall = likert_mean
+    elif mcq_mean is not None:
+        overall = mcq_mean
+    else:
+        overall = 0.0
+    return {
+        'overall': round(overall, 2),
+        'likert_mean': round(likert_mean, 2) if likert_mean is not None else None,
+        'mcq_mean': round(mcq_mean, 2) if mcq_mean is not None else None,
+        'likert_count': len(likert_scores),
+        'mcq_count': len(mcq_scores)
+    }
+
+
+@pytest.fixture(scope='module')
+def bank():
+    with open(QUESTIONS_PATH, 'r') as f:
+        return json.load(f)
+
+
+def _random_answer(rng, question):
+    qtype = question.get('type')
+    options = list(question.get('options') or [])
+    roll = rng.random()
+    if qtype == 'scale':
+        scale = question.get('scale', {})
+        low, high = scale.get('min', 1), scale.get('max', 5)
+        if roll < 0.1:
+            return rng.choice(['abc', None, '', [3], 'nan', 'inf', '-inf'])
+        if roll < 0.2:
+            return rng.uniform(low - 5, high + 5)
+        return str(rng.randint(low, high)) if roll < 0.3 else rng.randint(low, high)
+    if qtype == 'single':
+        if roll < 0.15:
+            return rng.choice([None, 3, ['x'], 'Something else (+1)', 'Something else'])
+        return rng.choice(options) if options else 'free text'
+    if roll < 0.15:
+        return rng.choice([None, 'not a list', [], [1, None], ['Other (+1)', 'Other']])
+    return rng.sample(options, rng.randint(1, len(options))) if options else []
+
+
+def _random_submissions(bank, count, seed):
+    rng = random.Random(seed)
+    questions = bank['questions']
+    submissions = []
+    for _ in range(count):
+        chosen = rng.sample(questions, rng.randint(0, min(12, len(questions))))
+        answers = {q['id']: _random_answer(rng, q) for q in chosen}
+        if rng.random() < 0.1:
+            answers['unknown-question'] = 4
+        submissions.append(answers)
+    return submissions
+
+
+def _same(left, right):
+    for key in ('overall', 'likert_mean', 'mcq_mean'):
+        a, b = left[key], right[key]
+        if a is None or b is None:
+            if a is not b:
+                return False
+        elif not (a == b or (math.isnan(a) and math.isnan(b))):
+            return False
+    return left['likert_count'] == right['likert_count'] and left['mcq_count'] == right['mcq_count']
+
+
+def test_compiled_plan_matches_legacy_scorer(bank):
+    plan = compile_scoring_plan(bank)
+    for answers in _random_submissions(bank, 3000, seed=42):
+        expected = legacy_score(bank, answers)
+        assert _same(plan.score(answers), expected), answers
+
+
+def test_batch_rescoring_matches_legacy_scorer(bank):
+    plan = compile_scoring_plan(bank)
+    submissions = _random_submissions(bank, 1000, seed=7)
+    for answers, scored in zip(submissions, score_batch(plan, submissions)):
+        assert _same(scored, legacy_score(bank, answers)), answers
+
+
+def test_batch_rescoring_matches_compute_reflection_score(app_module):
+    bank = app_module.read_json_file(app_module.QUESTIONS_PATH, {'questions': []})
+    plan = compile_scoring_plan(bank)
+    submissions = _random_submissions(bank, 1000, seed=3)
+    for answers, scored in zip(submissions, score_batch(plan, submissions)):
+        assert _same(scored, app_module.compute_reflection_score(answers)), answers
+
+
+def test_rescore_waits_for_the_results_lock(bank, tmp_path):
+    path = str(tmp_path / 'results.json')
+    with open(path, 'w') as f:
+        json.dump([{'user_id': 'u', 'answers': {}, 'score': None}], f)
+    plan = compile_scoring_plan(bank)
+    finished = threading.Event()
+
+    def run():
+        rescore_file(path, plan)
+        finished.set()
+
+    with _locked(path):
+        worker = threading.Thread(target=run)
+        worker.start()
+        time.sleep(0.2)
+        assert not finished.is_set()
+        # An append made while the app holds the lock must survive the re-score.
+        with open(path, 'w') as f:
+            json.dump([{'user_id': 'u', 'answers': {}, 'score': None}, {'user_id': 'v', 'answers': {}}], f)
+    worker.join(5)
+    with open(path) as f:
+        records = json.load(f)
+    assert [record['user_id'] for record in records] == ['u', 'v']
+    assert all(record['score_meta']['questions_version'] == plan.version for record in records)
+
+
+def test_edge_cases_match_legacy_scorer():
+    bank = {'version': 1, 'questions': [
+        {'id': 'flat', 'type': 'scale', 'scale': {'min': 3, 'max': 3}},
+        {'id': 'likert', 'type': 'scale', 'scale': {'min': 1, 'max': 5}},
+        {'id': 'one', 'type': 'single', 'options': ['Yes (+1)', 'No']},
+        {'id': 'many', 'type': 'multi', 'options': ['A (+1)', 'B', 'C (+1)']},
+    ]}
+    plan = compile_scoring_plan(bank)
+    cases = [
+        {},
+        {'flat': 3},
+        {'likert': 'nan'},
+        {'likert': 99, 'one': 'Yes (+1)'},
+        {'likert': -4, 'many': []},
+        {'one': 'Typed answer (+1)', 'many': ['A (+1)', 'B', 7]},
+        {'one': ['Yes (+1)'], 'many': 'A (+1)'},
+    ]
+    for answers in cases:
+        assert _same(plan.score(answers), legacy_score(bank, answers)), answers
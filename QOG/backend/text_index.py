@@ -0,0 +1,268 @@
+import math
+import re
+import zlib
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+# Small per-user collections give IDF little to work with, so the most common
+# function words are dropped up front.
+_STOP_WORDS = frozenset(
+    "a an and are as at be but by can could do does for from had has have how i i'm in is it it's "
+    "me my of on or our should so that the their them then there these this to was we were what "
+    "when where which who why will with would you your".split()
+)
+
+
+def hashed_features(text: Optional[str], dim: int) -> Dict[int, float]:
+    """Sublinear term frequencies of word unigrams and bigrams, hashed into ``dim`` buckets.
+
+    crc32 is used instead of ``hash()`` so buckets are stable across processes.
+    """
+    tokens = [token for token in _TOKEN_PATTERN.findall((text or '').lower()) if token not in _STOP_WORDS]
+    counts: Dict[int, int] = {}
+    grams = tokens + [f'{first} {second}' for first, second in zip(tokens, tokens[1:])]
+    for gram in grams:
+        bucket = zlib.crc32(gram.encode('utf-8')) % dim
+        counts[bucket] = counts.get(bucket, 0) + 1
+    return {bucket: 1.0 + math.log(count) for bucket, count in counts.items()}
+
+
+class HashedTfidfIndex:
+    """Cosine TF-IDF search over hashed n-grams, stored as sparse NumPy arrays.
+
+    Each document's raw sublinear term frequencies are appended to flat
+    ``(bucket, weight, row)`` arrays, so memory grows with the number of
+    distinct terms stored (a snippet has a few hundred at most) rather than
+    ``rows * dim``. IDF weights and row norms are snapshotted and only
+    recomputed once the collection size drifts by more than
+    ``IDF_REFRESH_RATIO``; in between, new rows get their norm under the
+    current snapshot, so adding a document is O(terms) and a query is one
+    pass over the stored weights. Once ``max_docs`` is reached the oldest
+    document is dropped. Removed rows are zeroed and compacted away when the
+    arrays need to grow.
+    """
+
+    IDF_REFRESH_RATIO = 0.1
+
+    def __init__(self, dim: int = 2048, max_docs: int = 2000):
+        self.dim = int(dim)
+        self.max_docs = max(1, int(max_docs))
+        self._lock = Lock()
+        self._buckets = np.zeros(256, dtype=np.int32)
+        self._weights = np.zeros(256, dtype=np.float32)
+        self._owners = np.zeros(256, dtype=np.int32)
+        self._stored = 0
+        self._live = 0
+        self._spans: List[Tuple[int, int]] = []
+        self._df = np.zeros(self.dim, dtype=np.float32)
+        self._ids: List[Optional[str]] = []
+        self._payloads: List[Any] = []
+        self._positions: 'OrderedDict[str, int]' = OrderedDict()
+        self._idf: Optional[np.ndarray] = None
+        self._idf_docs = 0
+        self._norms = np.zeros(16, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._positions
+
+    def nbytes(self) -> int:
+        """Bytes held by the NumPy arrays backing the index."""
+        return sum(array.nbytes for array in (self._buckets, self._weights, self._owners, self._df, self._norms))
+
+    def _row_sums(self, values: np.ndarray) -> np.ndarray:
+        return np.bincount(
+            self._owners[:self._stored], weights=values, minlength=len(self._ids)
+        ).astype(np.float32)
+
+    def _refresh_idf(self) -> np.ndarray:
+        docs = len(self._positions)
+        if self._idf is None or abs(docs - self._idf_docs) > self.IDF_REFRESH_RATIO * max(1, self._idf_docs):
+            self._idf = np.log((1.0 + docs) / (1.0 + self._df)).astype(np.float32) + 1.0
+            self._idf_docs = docs
+            stored = slice(0, self._stored)
+            weighted = self._weights[stored] * self._idf[self._buckets[stored]]
+            self._norms = np.zeros(max(16, len(self._ids)), dtype=np.float32)
+            self._norms[:len(self._ids)] = np.sqrt(self._row_sums(np.square(weighted)))
+        return self._idf
+
+    def _compact(self) -> None:
+        keep = list(self._positions.values())
+        spans = [self._spans[row] for row in keep]
+        lengths = [end - start for start, end in spans]
+        if spans:
+            taken = np.concatenate([np.arange(start, end) for start, end in spans])
+        else:
+            taken = np.zeros(0, dtype=np.int64)
+        count = len(taken)
+        self._buckets[:count] = self._buckets[taken]
+        self._weights[:count] = self._weights[taken]
+        self._owners[:count] = np.repeat(np.arange(len(keep), dtype=np.int32), lengths)
+        self._weights[count:self._stored] = 0.0
+        offsets = np.cumsum([0] + lengths)
+        self._spans = [(int(offsets[row]), int(offsets[row + 1])) for row in range(len(keep))]
+        self._ids = [self._ids[row] for row in keep]
+        self._payloads = [self._payloads[row] for row in keep]
+        self._positions = OrderedDict((doc_id, row) for row, doc_id in enumerate(self._ids))
+        self._stored = self._live = count
+        self._idf = None
+
+    def _reserve(self, count: int) -> None:
+        if self._stored + count <= len(self._weights):
+            return
+        if self._live <= self._stored // 2:
+            self._compact()
+        if self._stored + count > len(self._weights):
+            capacity = max(len(self._weights) * 2, self._stored + count)
+            for name in ('_buckets', '_weights', '_owners'):
+                current = getattr(self, name)
+                grown = np.zeros(capacity, dtype=current.dtype)
+                grown[:self._stored] = current[:self._stored]
+                setattr(self, name, grown)
+
+    def _remove_locked(self, doc_id: str) -> bool:
+        row = self._positions.pop(doc_id, None)
+        if row is None:
+            return False
+        start, end = self._spans[row]
+        self._df[self._buckets[start:end]] -= 1.0
+        self._weights[start:end] = 0.0
+        self._live -= end - start
+        self._ids[row] = None
+        self._payloads[row] = None
+        if self._idf is not None:
+            self._norms[row] = 0.0
+        return True
+
+    def add(self, doc_id: str, text: str, payload: Any = None) -> bool:
+        features = hashed_features(text, self.dim)
+        if not features:
+            return False
+        with self._lock:
+            if doc_id in self._positions:
+                return False
+            while len(self._positions) >= self.max_docs:
+                self._remove_locked(next(iter(self._positions)))
+            count = len(features)
+            self._reserve(count)
+            row = len(self._ids)
+            start, end = self._stored, self._stored + count
+            buckets = np.fromiter(features.keys(), dtype=np.int32, count=count)
+            weights = np.fromiter(features.values(), dtype=np.float32, count=count)
+            self._buckets[start:end] = buckets
+            self._weights[start:end] = weights
+            self._owners[start:end] = row
+            self._stored = end
+            self._live += count
+            self._spans.append((start, end))
+            self._df[buckets] += 1.0
+            self._ids.append(doc_id)
+            self._payloads.append(payload)
+            self._positions[doc_id] = row
+            if self._idf is not None:
+                if row >= len(self._norms):
+                    self._norms = np.concatenate([self._norms, np.zeros(len(self._norms), dtype=np.float32)])
+                self._norms[row] = np.sqrt(np.sum(np.square(weights * self._idf[buckets])))
+        return True
+
+    def remove(self, doc_id: str) -> bool:
+        with self._lock:
+            return self._remove_locked(doc_id)
+
+    def query(
+        self,
+        text: str,
+        k: int = 3,
+        min_score: float = 0.0,
+        exclude: Optional[Callable[[Any], bool]] = None,
+    ) -> List[Tuple[float, Any]]:
+        """Top ``k`` ``(cosine score, payload)`` pairs scoring at least ``min_score``."""
+        features = hashed_features(text, self.dim)
+        if not features or k <= 0:
+            return []
+        with self._lock:
+            if not self._positions:
+                return []
+            idf = self._refresh_idf()
+            query_vector = np.zeros(self.dim, dtype=np.float32)
+            buckets = np.fromiter(features.keys(), dtype=np.int64, count=len(features))
+            query_vector[buckets] = np.fromiter(features.values(), dtype=np.float32, count=len(features))
+            query_vector *= idf
+            query_norm = float(np.linalg.norm(query_vector))
+            if query_norm == 0.0:
+                return []
+            rows = len(self._ids)
+            norms = self._norms[:rows]
+            weighted_query = query_vector * idf
+            stored = slice(0, self._stored)
+            dots = self._row_sums(self._weights[stored] * weighted_query[self._buckets[stored]])
+            scores = np.divide(dots, norms * query_norm, out=np.zeros_like(dots), where=norms > 0)
+            candidates = np.flatnonzero(scores >= max(min_score, 1e-9))
+            ordered = candidates[np.argsort(-scores[candidates], kind='stable')]
+            results = []
+            for row in ordered:
+                payload = self._payloads[row]
+                if exclude is not None and exclude(payload):
+                    continue
+                results.append((float(scores[row]), payload))
+                if len(results) >= k:
+                    break
+            return results
+
+
+class PerUserIndex:
+    """One ``HashedTfidfIndex`` per user, built lazily and kept for the ``max_users``
+    most recently used users."""
+
+    def __init__(self, dim: int = 2048, max_docs_per_user: int = 2000, max_users: int = 256):
+        self.dim = dim
+        self.max_docs_per_user = max_docs_per_user
+        self.max_users = max(1, int(max_users))
+        self._indexes: 'OrderedDict[str, HashedTfidfIndex]' = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, user_id: str) -> Optional[HashedTfidfIndex]:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+            return index
+
+    def build(self, user_id: str, documents: Iterable[Tuple[str, str, Any]]) -> HashedTfidfIndex:
+        index = HashedTfidfIndex(self.dim, self.max_docs_per_user)
+        for doc_id, text, payload in documents:
+            index.add(doc_id, text, payload)
+        with self._lock:
+            existing = self._indexes.get(user_id)
+            if existing is not None:
+                # Another thread finished first; keep the index that may already
+                # have received incremental updates.
+                return existing
+            self._indexes[user_id] = index
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def add(self, user_id: str, doc_id: str, text: str, payload: Any = None) -> None:
+        """Index a new document if the user's index is loaded; otherwise the next
+        ``build`` will pick it up."""
+        index = self.get(user_id)
+        if index is not None:
+            index.add(doc_id, text, payload)
+
+    def remove(self, user_id: str, doc_id: str) -> None:
+        index = self.get(user_id)
+        if index is not None:
+            index.remove(doc_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sizes = [len(index) for index in self._indexes.values()]
+        return {'users': len(sizes), 'documents': sum(sizes), 'dim': self.dim}
@@ -0,0 +1,210 @@
+import atexit
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows dev machines
+    fcntl = None
+
+
+# Rollup scopes and how their keys are built.
+#   total:      'all'
+#   day:        'YYYY-MM-DD'
+#   user:       user_id
+#   user_day:   'user_id/YYYY-MM-DD'
+#   user_month: 'user_id/YYYY-MM'
+#   task:       task_id
+#   model_day:  'model/YYYY-MM-DD'
+SCOPES = ('total', 'day', 'user', 'user_day', 'user_month', 'task', 'model_day')
+_DAY_SCOPES = ('day', 'user_day', 'model_day')
+
+
+def _empty_counters() -> Dict[str, Any]:
+    return {
+        'requests': 0,
+        'cached': 0,
+        'prompt_tokens': 0,
+        'response_tokens': 0,
+        'latency_ms': 0.0,
+        'max_latency_ms': 0.0
+    }
+
+
+def _merge(target: Dict[str, Any], delta: Dict[str, Any]) -> None:
+    for field, value in delta.items():
+        if field == 'max_latency_ms':
+            target[field] = max(target.get(field, 0.0), value)
+        elif field == 'user_id':
+            target[field] = value
+        else:
+            target[field] = target.get(field, 0) + value
+
+
+def with_averages(counters: Dict[str, Any]) -> Dict[str, Any]:
+    result = dict(counters)
+    requests_count = counters.get('requests', 0)
+    result['total_tokens'] = counters.get('prompt_tokens', 0) + counters.get('response_tokens', 0)
+    result['latency_ms'] = round(counters.get('latency_ms', 0.0), 1)
+    result['mean_latency_ms'] = round(counters.get('latency_ms', 0.0) / requests_count, 1) if requests_count else None
+    return result
+
+
+class UsageLedger:
+    """Incremental token and latency rollups, shared by worker processes through one JSON file.
+
+    ``record`` only touches in-memory pending deltas. Every ``flush_interval``
+    seconds (and at exit) the deltas are merged into ``path`` under an
+    exclusive lock and the merged state becomes the local snapshot, so each
+    process sees the others' usage with at most that much delay. ``counters``
+    reads snapshot plus pending deltas in O(1).
+    """
+
+    def __init__(self, path: Optional[str] = None, flush_interval: float = 30.0, retention_days: int = 400):
+        self.path = path
+        self.flush_interval = float(flush_interval)
+        self.retention_days = int(retention_days)
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._snapshot: Dict[str, Dict[str, Dict[str, Any]]] = {scope: {} for scope in SCOPES}
+        self._pending: Dict[str, Dict[str, Dict[str, Any]]] = {scope: {} for scope in SCOPES}
+        # Deltas being written by flush(); still counted until the snapshot is replaced.
+        self._in_flight: Dict[str, Dict[str, Dict[str, Any]]] = {scope: {} for scope in SCOPES}
+        self._last_flush = time.monotonic()
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._snapshot = self._load_file()
+            atexit.register(self.flush)
+
+    def _keys(self, user_id: str, task_id: Optional[str], model: Optional[str], now: datetime) -> Dict[str, str]:
+        day = now.strftime('%Y-%m-%d')
+        keys = {
+            'total': 'all',
+            'day': day,
+            'user': user_id,
+            'user_day': f'{user_id}/{day}',
+            'user_month': f"{user_id}/{now.strftime('%Y-%m')}"
+        }
+        if task_id:
+            keys['task'] = task_id
+        if model:
+            keys['model_day'] = f'{model}/{day}'
+        return keys
+
+    def record(
+        self,
+        user_id: str,
+        task_id: Optional[str],
+        model: Optional[str],
+        prompt_tokens: int = 0,
+        response_tokens: int = 0,
+        latency_ms: float = 0.0,
+        cached: bool = False,
+    ) -> None:
+        """Add one generation. Cached or reused replies count as ``cached`` and spend no tokens."""
+        delta = {
+            'requests': 0 if cached else 1,
+            'cached': 1 if cached else 0,
+            'prompt_tokens': 0 if cached else int(prompt_tokens or 0),
+            'response_tokens': 0 if cached else int(response_tokens or 0),
+            'latency_ms': 0.0 if cached else float(latency_ms or 0.0),
+            'max_latency_ms': 0.0 if cached else float(latency_ms or 0.0)
+        }
+        with self._lock:
+            for scope, key in self._keys(user_id or 'anonymous', task_id, model, datetime.now()).items():
+                bucket = self._pending[scope].setdefault(key, {})
+                _merge(bucket, delta)
+                if scope == 'task':
+                    bucket['user_id'] = user_id
+            due = self.path and time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def counters(self, scope: str, key: str) -> Dict[str, Any]:
+        with self._lock:
+            merged = _empty_counters()
+            for layer in (self._snapshot, self._in_flight, self._pending):
+                _merge(merged, layer.get(scope, {}).get(key, {}))
+            return merged
+
+    def scope_items(self, scope: str) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            keys = set()
+            for layer in (self._snapshot, self._in_flight, self._pending):
+                keys.update(layer.get(scope, {}))
+        return {key: self.counters(scope, key) for key in keys}
+
+    def _load_file(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        state = {scope: {} for scope in SCOPES}
+        try:
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return state
+        for scope in SCOPES:
+            values = stored.get(scope) if isinstance(stored, dict) else None
+            if isinstance(values, dict):
+                state[scope] = values
+        return state
+
+    def _prune(self, state: Dict[str, Dict[str, Dict[str, Any]]]) -> None:
+        if self.retention_days <= 0:
+            return
+        cutoff = (datetime.now() - timedelta(days=self.retention_days)).strftime('%Y-%m-%d')
+        for scope in _DAY_SCOPES:
+            state[scope] = {key: value for key, value in state[scope].items() if key.rsplit('/', 1)[-1] >= cutoff}
+
+    def flush(self) -> None:
+        if not self.path:
+            return
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = {scope: {} for scope in SCOPES}
+                self._in_flight = pending
+                self._last_flush = time.monotonic()
+            lock_path = f'{self.path}.lock'
+            try:
+                with open(lock_path, 'a') as lock_handle:
+                    if fcntl is not None:
+                        fcntl.flock(lock_handle, fcntl.LOCK_EX)
+                    try:
+                        state = self._load_file()
+                        for scope, entries in pending.items():
+                            for key, delta in entries.items():
+                                _merge(state[scope].setdefault(key, {}), delta)
+                        self._prune(state)
+                        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+                        with open(tmp_path, 'w') as f:
+                            json.dump(state, f)
+                        os.replace(tmp_path, self.path)
+                    finally:
+                        if fcntl is not None:
+                            fcntl.flock(lock_handle, fcntl.LOCK_UN)
+            except OSError:
+                # Keep the deltas for the next attempt.
+                with self._lock:
+                    for scope, entries in pending.items():
+                        for key, delta in entries.items():
+                            _merge(self._pending[scope].setdefault(key, {}), delta)
+                    self._in_flight = {scope: {} for scope in SCOPES}
+                return
+            with self._lock:
+                self._snapshot = state
+                self._in_flight = {scope: {} for scope in SCOPES}
+
+    def top(self, scope: str, field: str, limit: int = 10, predicate=None) -> List[Dict[str, Any]]:
+        items = self.scope_items(scope)
+        rows = []
+        for key, counters in items.items():
+            if predicate is not None and not predicate(key, counters):
+                continue
+            row = with_averages(counters)
+            row['key'] = key
+            rows.append(row)
+        rows.sort(key=lambda row: row.get(field) or 0, reverse=True)
+        return rows[:max(0, limit)]